@@ -0,0 +1,526 @@
+# -*- coding:utf-8 -*-
+
+"""Asynchronous asset conversion pipeline and image conversion
+
+:Organization:
+ AIST
+
+Requirements
+------------
+* Pillow (optional, imagemagick is used if not available)
+
+Examples
+--------
+
+Wrap an asset handler to convert assets in worker threads (readers get
+futures which are resolved to the converted path when they are rendered)
+
+>>> import tempfile
+>>> d = tempfile.mkdtemp()
+>>> for n in ['a.png', 'b.png']:
+...     with open(os.path.join(d, n), 'w') as f:
+...         f.write('same content')
+>>> calls = []
+>>> def handler(f):
+...     calls.append(f)
+...     return os.path.basename(f) + '.jpg'
+>>> pipeline = AssetPipeline(handler, jobs=4)
+>>> t1 = pipeline(os.path.join(d, 'a.png'))
+>>> t2 = pipeline(os.path.join(d, 'a.png'))
+>>> t3 = pipeline(os.path.join(d, 'b.png'))
+>>> t1 is t2
+True
+>>> str(t1), str(t3)
+('a.png.jpg', 'a.png.jpg')
+>>> len(calls)
+1
+>>> pipeline.close()
+
+Transcode image in process (Pillow is used when available, ImageMagick
+convert command otherwise)
+
+>>> from PIL import Image
+>>> Image.new('RGBA', (1000, 300)).save(os.path.join(d, 'c.png'))
+>>> convertimage(os.path.join(d, 'c.png'), os.path.join(d, 'c.jpg'), maxsize=512, poweroftwo=True)
+>>> Image.open(os.path.join(d, 'c.jpg')).size
+(512, 128)
+
+Metadata of the source image is stripped
+
+>>> Image.new('RGB', (8, 8)).save(os.path.join(d, 'icc.png'), icc_profile='profile')
+>>> 'icc_profile' in Image.open(os.path.join(d, 'icc.png')).info
+True
+>>> convertimage(os.path.join(d, 'icc.png'), os.path.join(d, 'icc2.png'))
+>>> 'icc_profile' in Image.open(os.path.join(d, 'icc2.png')).info
+False
+
+Write files to the output directory through the content addressed store
+(same content is written only once, later copies are hardlinked)
+
+>>> store = getstore(os.path.join(d, 'out'))
+>>> os.mkdir(store.dirname)
+>>> store.copy(os.path.join(d, 'a.png'), os.path.join(store.dirname, 'a.png'))
+>>> store.copy(os.path.join(d, 'b.png'), os.path.join(store.dirname, 'b.png'))
+>>> os.path.samefile(os.path.join(store.dirname, 'a.png'), os.path.join(store.dirname, 'b.png'))
+True
+>>> getstore(os.path.join(d, 'out')) is store
+True
+
+File already in the output directory is kept as is
+
+>>> store.copy(os.path.join(store.dirname, 'a.png'), os.path.join(store.dirname, 'a.png'))
+>>> open(os.path.join(store.dirname, 'a.png')).read()
+'same content'
+>>> clonefile(os.path.join(d, 'c.png'), os.path.join(d, 'c.png'))
+>>> os.path.exists(os.path.join(d, 'c.png'))
+True
+
+Run export jobs on a pool of forked worker processes (same result as
+running them one after another)
+
+>>> exporter = ExportPool(jobs=2)
+>>> for n in ['x', 'y', 'z']:
+...     exporter.submit(shutil.copyfile, os.path.join(d, 'a.png'), os.path.join(d, n))
+>>> exporter.run()
+>>> [open(os.path.join(d, n)).read() for n in ['x', 'y', 'z']]
+['same content', 'same content', 'same content']
+
+Digest of the mesh data (used to write identical meshes only once)
+
+>>> from . import model
+>>> m1 = model.MeshData()
+>>> m1.vertex = numpy.array([[0, 0, 0], [1, 0, 0], [0, 1, 0]])
+>>> m1.vertex_index = numpy.array([[0, 1, 2]])
+>>> m2 = model.MeshData()
+>>> m2.vertex = numpy.array([[0, 0, 0], [1, 0, 0], [0, 1, 0]])
+>>> m2.vertex_index = numpy.array([[0, 1, 2]])
+>>> meshdigest(m1) == meshdigest(m2)
+True
+>>> m2.material = model.MaterialModel()
+>>> meshdigest(m1) == meshdigest(m2)
+False
+
+Size of the converted image
+
+>>> imagesize(8192, 4096, maxsize=2048)
+(2048, 1024)
+>>> imagesize(1000, 300, poweroftwo=True)
+(1024, 256)
+"""
+
+import os
+import math
+import shutil
+import hashlib
+import logging
+import subprocess
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+from . import utils
+
+
+def filehash(f, blocksize=1 << 20):
+    '''
+    SHA1 digest of the file content (None if the file is not readable)
+    '''
+    h = hashlib.sha1()
+    try:
+        with utils.openfile(f, 'rb', raw=True) as fd:
+            while True:
+                b = fd.read(blocksize)
+                if not b:
+                    break
+                h.update(b)
+    except IOError:
+        return None
+    return h.hexdigest()
+
+
+class AssetFuture(object):
+    '''
+    Path of the asset being converted (resolved by result() or str())
+    '''
+    def __init__(self, asyncresult):
+        self._asyncresult = asyncresult
+
+    def result(self):
+        return self._asyncresult.get()
+
+    def __str__(self):
+        return str(self.result())
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class _Pending(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+    def get(self):
+        self.event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class AssetPipeline(object):
+    '''
+    Asset handler which runs the given handler in a pool of worker threads
+
+    Same source path is converted only once, and sources with the same
+    content share the result of the first conversion.
+    '''
+    def __init__(self, handler, jobs=None):
+        self._handler = handler
+        self._pool = ThreadPool(jobs or multiprocessing.cpu_count())
+        self._lock = threading.Lock()
+        self._bypath = {}
+        self._byhash = {}
+
+    def __call__(self, f):
+        with self._lock:
+            try:
+                return self._bypath[f]
+            except KeyError:
+                pass
+            future = AssetFuture(self._pool.apply_async(self._convert, (f,)))
+            self._bypath[f] = future
+            return future
+
+    def _convert(self, f):
+        h = filehash(f)
+        if h is None:
+            return self._handler(f)
+        with self._lock:
+            pending = self._byhash.get(h)
+            owner = pending is None
+            if owner:
+                pending = _Pending()
+                self._byhash[h] = pending
+        if not owner:
+            return pending.get()
+        try:
+            pending.value = self._handler(f)
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            pending.event.set()
+        return pending.value
+
+    def wait(self):
+        '''
+        Wait until all the requested conversions finish
+        '''
+        for future in self._bypath.values():
+            future.result()
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self._pool.close()
+            self._pool.join()
+
+
+FICLONE = 0x40049409  #: ioctl to clone (reflink) the file on linux
+
+
+def clonefile(src, dst):
+    '''
+    Copy file as copy-on-write clone (reflink) if the filesystem supports
+    it, by plain copy otherwise
+    '''
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return
+    if os.path.lexists(dst):
+        # do not write through hardlinks made by the previous run
+        os.unlink(dst)
+    if utils.splitarchive(src)[0] is not None:
+        # member of the archive
+        with utils.openfile(src, 'rb', raw=True) as s, open(dst, 'wb') as d:
+            shutil.copyfileobj(s, d)
+        return
+    if fcntl is not None:
+        try:
+            with open(src, 'rb') as s, open(dst, 'wb') as d:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            return
+        except (IOError, OSError):
+            pass
+    shutil.copyfile(src, dst)
+
+
+def linkfile(src, dst):
+    '''
+    Make dst refer the same content as src (hardlink, reflink or copy)
+    '''
+    if os.path.lexists(dst):
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            return
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+    except (OSError, AttributeError):
+        clonefile(src, dst)
+
+
+def _update(h, obj):
+    if obj is None:
+        h.update('N')
+    elif isinstance(obj, numpy.ndarray):
+        h.update('A%s%s' % (obj.dtype.str, obj.shape))
+        h.update(numpy.ascontiguousarray(obj).data)
+    elif isinstance(obj, (list, tuple)):
+        h.update('L%i' % len(obj))
+        for o in obj:
+            _update(h, o)
+    elif isinstance(obj, AssetFuture):
+        h.update('V%r' % (str(obj),))
+    elif hasattr(obj, '__dict__'):
+        h.update('O%s' % type(obj).__name__)
+        for k in sorted(obj.__dict__.keys()):
+            if k == 'name' or k.startswith('_'):
+                # names and caches are not written to the mesh file
+                continue
+            h.update(k)
+            _update(h, obj.__dict__[k])
+    else:
+        h.update('V%r' % (str(obj),))
+
+
+def meshdigest(data):
+    '''
+    SHA1 digest of the mesh data (geometry, scenegraph and material)
+    '''
+    h = hashlib.sha1()
+    _update(h, data)
+    return h.hexdigest()
+
+
+class AssetStore(object):
+    '''
+    Content addressed index of the files written to the output directory
+
+    Files are registered by key (content hash of the file or digest of the
+    mesh data), so the writers can refer to or link the file already written.
+    '''
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self._lock = threading.Lock()
+        self._files = {}
+
+    def find(self, key):
+        '''
+        Path of the file registered by the key (None if not available)
+        '''
+        with self._lock:
+            f = self._files.get(key)
+        if f is not None and os.path.exists(f):
+            return f
+        return None
+
+    def add(self, key, f):
+        '''
+        Register the file by the key (previous registration of the path is removed)
+        '''
+        with self._lock:
+            for k, v in self._files.items():
+                if v == f:
+                    del self._files[k]
+            self._files[key] = f
+
+    def copy(self, src, dst):
+        '''
+        Copy file to dst, or link the file with the same content already written
+        '''
+        key = filehash(src)
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            # the file is already in the output directory
+            if key is not None:
+                self.add(key, dst)
+            return
+        f = self.find(key) if key is not None else None
+        if f is not None:
+            linkfile(f, dst)
+        else:
+            clonefile(src, dst)
+        if key is not None:
+            self.add(key, dst)
+
+
+_exportjobs = None
+_exportlock = threading.Lock()
+
+
+def _runexport(i):
+    func, args = _exportjobs[i]
+    func(*args)
+
+
+def _resolvetextures(obj, seen):
+    if id(obj) in seen:
+        return
+    seen.add(id(obj))
+    if isinstance(obj, (list, tuple)):
+        for o in obj:
+            _resolvetextures(o, seen)
+        return
+    attrs = getattr(obj, '__dict__', None)
+    if attrs is None:
+        return
+    material = attrs.get('material')
+    if material is not None and isinstance(getattr(material, 'texture', None), AssetFuture):
+        material.texture.result()
+    for name in ['links', 'visuals', 'collisions', 'data', 'children']:
+        _resolvetextures(attrs.get(name), seen)
+
+
+class ExportPool(object):
+    '''
+    Run export jobs (function and arguments) on a pool of worker processes
+
+    The jobs are inherited by the forked workers, so the mesh buffers are
+    shared copy-on-write instead of being pickled to the workers. Jobs run
+    one after another if jobs is 1 or fork is not available.
+    '''
+    def __init__(self, jobs=None):
+        self.jobs = jobs or 1
+        self._queue = []
+
+    def submit(self, func, *args):
+        self._queue.append((func, args))
+
+    def run(self):
+        '''
+        Run all the submitted jobs and wait for them to finish
+        '''
+        global _exportjobs
+        queue = self._queue
+        self._queue = []
+        if self.jobs <= 1 or len(queue) <= 1 or not hasattr(os, 'fork'):
+            for func, args in queue:
+                func(*args)
+            return
+        # textures converted by the asset pipeline are resolved in the
+        # parent, the worker threads are not inherited by the workers
+        seen = set()
+        for func, args in queue:
+            _resolvetextures(args, seen)
+        # jobs are passed to the workers in the global variable, so the
+        # pools of writers running concurrently take turns
+        with _exportlock:
+            _exportjobs = queue
+            try:
+                pool = multiprocessing.Pool(min(self.jobs, len(queue)))
+                try:
+                    pool.map(_runexport, range(len(queue)), chunksize=1)
+                finally:
+                    pool.close()
+                    pool.join()
+            finally:
+                _exportjobs = None
+
+
+_stores = {}
+_storeslock = threading.Lock()
+
+
+def getstore(dirname):
+    '''
+    Asset store of the output directory (shared in the process, so that
+    models written to the same directory share their assets)
+    '''
+    dirname = os.path.abspath(dirname)
+    with _storeslock:
+        try:
+            return _stores[dirname]
+        except KeyError:
+            store = AssetStore(dirname)
+            _stores[dirname] = store
+            return store
+
+
+def imagesize(w, h, maxsize=None, poweroftwo=False):
+    '''
+    Size of the image clamped to maxsize (and rounded to power of two)
+    '''
+    if maxsize and max(w, h) > maxsize:
+        scale = float(maxsize) / max(w, h)
+        w = max(1, int(round(w * scale)))
+        h = max(1, int(round(h * scale)))
+    if poweroftwo:
+        limit = 2 ** int(math.log(maxsize, 2)) if maxsize else None
+        w = 2 ** int(round(math.log(w, 2)))
+        h = 2 ** int(round(math.log(h, 2)))
+        if limit:
+            w = min(w, limit)
+            h = min(h, limit)
+    return (w, h)
+
+
+_imagecache = {}
+_imagecachelock = threading.Lock()
+
+
+def convertimage(src, dst, maxsize=None, poweroftwo=False):
+    '''
+    Convert image to the format of the destination file extension
+    (metadata is stripped, result is cached by the content of the source)
+    '''
+    key = (filehash(src), os.path.splitext(dst)[1].lower(), maxsize, poweroftwo)
+    with _imagecachelock:
+        cached = _imagecache.get(key)
+    if cached is not None and os.path.exists(cached):
+        if os.path.abspath(cached) != os.path.abspath(dst):
+            linkfile(cached, dst)
+        return
+    if os.path.lexists(dst) and not (os.path.exists(src) and os.path.samefile(src, dst)):
+        # do not write through hardlinks made by the previous run
+        os.unlink(dst)
+    if Image is not None:
+        img = Image.open(utils.openfile(src, 'rb', raw=True))
+        size = imagesize(img.size[0], img.size[1], maxsize, poweroftwo)
+        if size != img.size:
+            img = img.resize(size, Image.LANCZOS)
+        if os.path.splitext(dst)[1].lower() in ('.jpg', '.jpeg') and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        # encoders write the image info (exif, icc profile, text) of the
+        # image, only transparency of the palette is kept
+        img = img.copy()
+        img.info = dict([(k, v) for k, v in img.info.items() if k == 'transparency'])
+        img.save(dst)
+    else:
+        args = ['convert', src, '-strip']
+        if poweroftwo:
+            (w, h) = [int(v) for v in subprocess.check_output(['identify', '-format', '%w %h', src]).split()[0:2]]
+            args.extend(['-resize', '%ix%i!' % imagesize(w, h, maxsize, poweroftwo)])
+        elif maxsize:
+            args.extend(['-resize', '%ix%i>' % (maxsize, maxsize)])
+        args.append(dst)
+        try:
+            subprocess.check_call(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError:
+            logging.error('Unable to find python imaging library (Pillow) or imagemagick "convert" command.')
+            logging.error('Please install one of them by:')
+            logging.error('$ sudo apt-get install python-pil')
+            logging.error('$ sudo apt-get install imagemagick')
+            raise
+    with _imagecachelock:
+        _imagecache[key] = dst
@@ -5,8 +5,11 @@
 
 import os
 import sys
-import subprocess
+import copy
 import shutil
+import tempfile
+import functools
+import subprocess
 import logging
 try:
     import coloredlogs
@@ -18,106 +21,84 @@ except ImportError:
     pass
 
 from argparse import ArgumentParser, ArgumentError
+from multiprocessing.pool import ThreadPool
 
-from ._version import get_versions
-__version__ = get_versions()['version']
-
-from . import model
-from . import vrml
-from . import urdf
-from . import sdf
-from . import cnoidbody
-from . import collada
-from . import stl
-from . import graphviz
+from . import __version__
+from . import formats
 from . import utils
 
+# modules of the formats (and the libraries they use) are imported only
+# when the format is used, see simtrans.formats
+readformats = ', '.join([f.name for f in formats.formats if f.readername is not None])
+writeformats = ', '.join([f.name for f in formats.formats if f.writername is not None or f.meshwritername is not None])
+
 parser = ArgumentParser(description='Convert robot simulation model from one another.')
 parser.add_argument('-i', '--input', dest='fromfile', metavar='FILE', help='convert from FILE')
-parser.add_argument('-o', '--output', dest='tofile', metavar='FILE', help='convert to FILE')
-parser.add_argument('-f', '--from', dest='fromformat', metavar='FORMAT', help='convert from FORMAT (optional)')
+parser.add_argument('-o', '--output', dest='tofile', metavar='FILE', action='append', help='convert to FILE (repeat to write multiple outputs from single read)')
+parser.add_argument('-f', '--from', dest='fromformat', metavar='FORMAT', help='convert from FORMAT (%s, optional)' % readformats)
 parser.add_argument('-c', '--use-collision', action='store_true', dest='usecollision', default=False, help='use collision shape when converting to VRML')
 parser.add_argument('-b', '--use-both', action='store_true', dest='useboth', default=False, help='use both visual and collision shape when converting to VRML (only supported on most recent version of Choreonoid)')
-parser.add_argument('-t', '--to', dest='toformat', metavar='FORMAT', help='convert to FORMAT (optional)')
+parser.add_argument('-t', '--to', dest='toformat', metavar='FORMAT', action='append', help='convert to FORMAT (%s, optional, n-th format is used for n-th output)' % writeformats)
 parser.add_argument('-p', '--prefix', dest='prefix', metavar='PREFIX', default='', help='prefix given to mesh path (e.g. package://packagename, optional)')
 parser.add_argument('-s', '--skip-validation', action='store_true', dest='skipvalidation', default=False, help='skip validation of model data')
 parser.add_argument('-e', '--estimatemass', dest='estimatemass', metavar='SPGR', help='estimate mass and inertia from bounding box of the shape given the sp.gr. (optional)', type=float)
+parser.add_argument('--native-urdf', action='store_true', dest='nativeurdf', default=False, help='read URDF without libsdformat (fixed joints are not lumped)')
+parser.add_argument('--corba-loader', action='store_true', dest='corbaloader', default=False, help='read VRML using OpenHRP model loader (CORBA) instead of the builtin parser')
+parser.add_argument('--texture-size', dest='texturesize', metavar='PIXELS', type=int, help='downscale textures larger than PIXELS (optional)')
+parser.add_argument('--texture-pot', action='store_true', dest='texturepot', default=False, help='round texture size to power of two (optional)')
+parser.add_argument('--compact', action='store_true', dest='compact', default=False, help='write compact VRML (round floats, omit normals regenerated by creaseAngle and write repeated meshes once)')
+parser.add_argument('--precision', dest='precision', metavar='DIGITS', type=int, default=6, help='significant digits of floats in compact VRML (optional)')
+parser.add_argument('--keep-normals', action='store_true', dest='keepnormals', default=False, help='keep normals in compact VRML (optional)')
+parser.add_argument('--concurrent', action='store_true', dest='concurrent', default=False, help='write multiple outputs concurrently (optional)')
+parser.add_argument('-j', '--jobs', dest='jobs', metavar='N', type=int, default=1, help='export meshes using N worker processes (optional)')
 parser.add_argument('-v', '--verbose', action='store_true', dest='verbose', default=False, help='verbose output')
 
 checkerparser = ArgumentParser(description='Check robot simulation model.')
 checkerparser.add_argument('fromfiles', metavar='F', type=str, nargs='+', help='model files to validate')
 checkerparser.add_argument('-e', '--export', dest='export', metavar='FILE', help='export validation result to FILE in csv format')
+checkerparser.add_argument('--corba-loader', action='store_true', dest='corbaloader', default=False, help='read VRML using OpenHRP model loader (CORBA) instead of the builtin parser')
+checkerparser.add_argument('--loaders', dest='loaders', metavar='N', type=int, default=1, help='number of OpenHRP model loaders to run in parallel (implies --corba-loader)')
 checkerparser.add_argument('-v', '--verbose', action='store_true', dest='verbose', default=False, help='verbose output')
 
 
 basedir = ''
+imageoptions = {}
+imageexts = ['.png', '.jpg', '.jpeg', '.bmp', '.tga', '.tif', '.tiff', '.gif']
 
 
 def nullhandler(f):
     return f
 
 
-def jpegconverthandler(f):
-    global basedir
-    fname = os.path.join(basedir, os.path.splitext(os.path.basename(f))[0] + '.jpg')
-    try:
-        subprocess.check_call(['convert', f, fname], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except OSError:
-        logging.error('Unable to find imagemagick "convert" command.')
-        logging.error('Please install imagemagick package by:')
-        logging.error('$ sudo apt-get install imagemagick')
-        raise
-    return os.path.relpath(fname, basedir)
+def jpegconverthandler(f, dirname=None):
+    from . import asset
+    dirname = dirname or basedir
+    fname = os.path.join(dirname, os.path.splitext(os.path.basename(f))[0] + '.jpg')
+    asset.convertimage(f, fname, **imageoptions)
+    return os.path.relpath(fname, dirname)
 
 
-def copyhandler(f):
-    global basedir
-    fname = os.path.join(basedir, os.path.basename(f))
-    shutil.copyfile(f, fname)
-    return os.path.relpath(fname, basedir)
+def copyhandler(f, dirname=None):
+    from . import asset
+    dirname = dirname or basedir
+    fname = os.path.join(dirname, os.path.basename(f))
+    if len(imageoptions) > 0 and os.path.splitext(f)[1].lower() in imageexts:
+        asset.convertimage(f, fname, **imageoptions)
+    else:
+        asset.getstore(dirname).copy(f, fname)
+    return os.path.relpath(fname, dirname)
 
 
 def read(fromfile, handler, options):
-    reader = None
-    meshinput = False
-    if hasattr(options, 'fromformat'):
-        if options.fromformat == "vrml":
-            reader = vrml.VRMLReader()
-        if options.fromformat == "urdf":
-            reader = urdf.URDFReader()
-        if options.fromformat == "sdf":
-            reader = sdf.SDFReader()
-        if options.fromformat == "body":
-            reader = cnoidbody.CnoidBodyReader()
-        if options.fromformat == "collada":
-            reader = collada.ColladaReader()
-            meshinput = True
-        if options.fromformat == "stl":
-            reader = stl.STLReader()
-            meshinput = True
-    if reader is None:
-        ext = os.path.splitext(fromfile)[1]
-        if ext == '.wrl':
-            reader = vrml.VRMLReader()
-        elif ext == '.urdf':
-            reader = urdf.URDFReader()
-        elif ext == '.sdf':
-            reader = sdf.SDFReader()
-        elif ext == '.body':
-            reader = cnoidbody.CnoidBodyReader()
-        elif ext == '.dae':
-            reader = collada.ColladaReader()
-            meshinput = True
-        elif ext == '.stl':
-            reader = stl.STLReader()
-            meshinput = True
-        else:
-            logging.error('unable to detect input format (may be not supported?)')
-            sys.exit(1)
+    fmt = formats.find(getattr(options, 'fromformat', None), fromfile)
+    if fmt is None or fmt.readername is None:
+        logging.error('unable to detect input format (may be not supported?)')
+        sys.exit(1)
     
-    m = reader.read(fromfile, assethandler=handler, options=options)
+    m = fmt.reader().read(fromfile, assethandler=handler, options=options)
 
-    if meshinput:
+    if fmt.mesh:
+        from . import model
         nm = model.BodyModel()
         nl = model.LinkModel()
         nl.name = 'root'
@@ -125,15 +106,43 @@ def read(fromfile, handler, options):
         ns.name = 'visual'
         ns.shapeType = model.ShapeModel.SP_MESH
         ns.data = m
-        nl.visuals.append(ns)
+        nl.visuals = [ns]
         nm.links.append(nl)
         m = nm
         
     return m
 
 
+assethandlers = {
+    'copy': copyhandler,
+    'jpeg': jpegconverthandler
+}
+
+
+def getwriter(tofile, toformat, meshinput):
+    '''
+    Writer for the output (returns writer, mesh writer, asset handler and
+    whether to write the mesh only, or None if the format is unknown)
+    '''
+    fmt = formats.find(toformat, tofile)
+    if fmt is None or (fmt.writername is None and fmt.meshwritername is None):
+        return None
+    writer = fmt.writer()
+    meshwriter = fmt.meshwriter()
+    handler = assethandlers.get(fmt.assets)
+    meshoutput = fmt.mesh or (meshinput and meshwriter is not None)
+    return (writer, meshwriter, handler, meshoutput)
+
+
+def write(m, writer, meshwriter, meshoutput, options):
+    if meshoutput and meshwriter is not None:
+        meshwriter.write(m.links[0].visuals[0], options.tofile, options=options)
+    else:
+        writer.write(m, options.tofile, options=options)
+
+
 def main():
-    global basedir
+    global basedir, imageoptions
     try:
         options = parser.parse_args()
     except ArgumentError, e:
@@ -153,98 +162,107 @@ def main():
 
     logging.info("simtrans (version %s)" % __version__)
     
-    options.tofile = os.path.abspath(utils.resolveFile(options.tofile))
+    tofiles = [os.path.abspath(utils.resolveFile(f)) for f in options.tofile]
+    toformats = options.toformat or []
     options.fromfile = os.path.abspath(utils.resolveFile(options.fromfile))
     logging.info("converting from: %s" % options.fromfile)
-    logging.info("             to: %s" % options.tofile)
+    for f in tofiles:
+        logging.info("             to: %s" % f)
     
-    basedir = os.path.dirname(os.path.abspath(options.tofile))
-    writer = None
-    meshwriter = None
-    handler = copyhandler
-    meshinput = False
-    meshoutput = False
-    if options.fromformat == "collada":
-        meshinput = True
-    if options.fromformat == "stl":
-        meshinput = True
-    ext = os.path.splitext(options.fromfile)[1]
-    if ext == '.dae':
-        meshinput = True
-    elif ext == '.stl':
-        meshinput = True
-    if options.toformat == "vrml":
-        writer = vrml.VRMLWriter()
-        meshwriter = vrml.VRMLMeshWriter()
-        if meshinput:
-            meshoutput = True
-        handler = jpegconverthandler
-    if options.toformat == "urdf":
-        writer = urdf.URDFWriter()
-    if options.toformat == "sdf":
-        writer = sdf.SDFWriter()
-    if options.toformat == "dot":
-        writer = graphviz.GraphvizWriter()
-        handler = None
-    if options.toformat == "collada":
-        writer = collada.ColladaWriter()
-        meshoutput = True
-    if options.toformat == "stl":
-        writer = stl.STLWriter()
-        handler = None
-        meshoutput = True
-    if writer is None:
-        ext = os.path.splitext(options.tofile)[1]
-        if ext == '.wrl':
-            writer = vrml.VRMLWriter()
-            meshwriter = vrml.VRMLMeshWriter()
-            if meshinput:
-                meshoutput = True
-            handler = jpegconverthandler
-        elif ext == '.urdf':
-            writer = urdf.URDFWriter()
-        elif ext == '.sdf':
-            writer = sdf.SDFWriter()
-        elif ext == '.world':
-            writer = sdf.SDFWriter()
-        elif ext == '.dot':
-            writer = graphviz.GraphvizWriter()
-            handler = None
-        elif ext == '.dae':
-            meshwriter = collada.ColladaWriter()
-            meshoutput = True
-        elif ext == '.stl':
-            meshwriter = stl.STLWriter()
-            meshoutput = True
-        else:
-            logging.error('unable to detect output format (may be not supported?)')
+    imageoptions = {}
+    if options.texturesize is not None:
+        imageoptions['maxsize'] = options.texturesize
+    if options.texturepot:
+        imageoptions['poweroftwo'] = True
+    fromformat = formats.find(options.fromformat, options.fromfile)
+    meshinput = fromformat is not None and fromformat.mesh
+
+    # i-th output format is given to i-th output file
+    outputs = []
+    for i, f in enumerate(tofiles):
+        o = copy.copy(options)
+        o.tofile = f
+        o.toformat = toformats[i] if i < len(toformats) else None
+        w = getwriter(o.tofile, o.toformat, meshinput)
+        if w is None:
+            logging.error('unable to detect output format of %s (may be not supported?)' % f)
             return 1
+        outputs.append((o, ) + w)
 
-    m = read(options.fromfile, handler, options)
-    
-    if len(m.links) == 0:
-        logging.error("cannot read links at all (probably the model refers to another model by <include> tag or <link> tag contains no <inertial> or <visual> or <collision> item and reduced by simulation optimization process of gz command used inside simtrans)")
-        return 1
+    from . import asset
+    pipeline = None
+    if len(outputs) == 1:
+        # asset handler of the output is used while reading the model
+        o, writer, meshwriter, handler, meshoutput = outputs[0]
+        basedir = os.path.dirname(o.tofile)
+        if handler is not None:
+            # convert assets in background while reading and writing the model
+            handler = pipeline = asset.AssetPipeline(handler)
+    else:
+        # assets are passed to the handler of each output when written
+        handler = os.path.abspath
 
-    if options.estimatemass is not None:
-        logging.info("estimating mass and inertia for each links")
-        meshoutput = False
-        for l in m.links:
-            bbox = l.getbbox()
-            (l.mass, l.centerofmass) = l.estimatemass(bbox, options.estimatemass)
-            l.inertia = l.estimateinertia(bbox)
-    
-    if options.skipvalidation == False:
-        logging.info('validating model data...')
-        if m.isvalid() == False:
-            logging.error('input model data is not valid')
+    try:
+        m = read(options.fromfile, handler, options)
+        
+        if len(m.links) == 0:
+            logging.error("cannot read links at all (probably the model refers to another model by <include> tag or <link> tag contains no <inertial> or <visual> or <collision> item and reduced by simulation optimization process of gz command used inside simtrans)")
             return 1
-    
-    if meshoutput and meshwriter is not None:
-        m = m.links[0].visuals[0]
-        meshwriter.write(m, options.tofile, options=options)
-    else:
-        writer.write(m, options.tofile, options=options)
+
+        if options.estimatemass is not None:
+            logging.info("estimating mass and inertia for each links")
+            outputs = [w[:4] + (False,) for w in outputs]
+            for l in m.links:
+                bbox = l.getbbox()
+                (l.mass, l.centerofmass) = l.estimatemass(bbox, options.estimatemass)
+                l.inertia = l.estimateinertia(bbox)
+        
+        if options.skipvalidation == False:
+            logging.info('validating model data...')
+            if m.isvalid() == False:
+                logging.error('input model data is not valid')
+                return 1
+
+        if len(outputs) == 1:
+            o, writer, meshwriter, h, meshoutput = outputs[0]
+            write(m, writer, meshwriter, meshoutput, o)
+            return 0
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+
+    # writers modify the model, each of them reads own copy from the
+    # snapshot (the mesh buffers are mapped copy-on-write)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        snapshotfile = os.path.join(tmpdir, 'model.snapshot')
+        formats.find('snapshot').writer().write(m, snapshotfile)
+        m = None
+
+        def output(args):
+            o, writer, meshwriter, handler, meshoutput = args
+            logging.info('writing %s' % o.tofile)
+            if handler is not None:
+                handler = asset.AssetPipeline(functools.partial(handler, dirname=os.path.dirname(o.tofile)))
+            try:
+                nm = formats.find('snapshot').reader().read(snapshotfile, assethandler=handler)
+                write(nm, writer, meshwriter, meshoutput, o)
+            finally:
+                if handler is not None:
+                    handler.close()
+
+        if options.concurrent:
+            pool = ThreadPool(len(outputs))
+            try:
+                pool.map(output, outputs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for args in outputs:
+                output(args)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
 
     return 0
 
@@ -269,8 +287,12 @@ def checker():
 
     logging.info("simtrans-checker (version %s)" % __version__)
     
-    ret = 0
-    for f in options.fromfiles:
+    if options.loaders > 1:
+        options.corbaloader = True
+        from . import vrml
+        vrml.getloaderpool(options.loaders)
+
+    def check(f):
         fromfile = os.path.abspath(utils.resolveFile(f))
         logging.info("loading: %s" % fromfile)
         try:
@@ -278,17 +300,28 @@ def checker():
             logging.info('validating model data...')
             if m.isvalid() == False:
                 logging.error('input model data is not valid')
-                if csvwriter is not None:
-                    csvwriter.writerow([f, 'invalid'])
-                ret = 1
-            else:
-                if csvwriter is not None:
-                    csvwriter.writerow([f, 'valid'])
+                return 'invalid'
+            return 'valid'
         except Exception as e:
             logging.error('error occurred while validating the model: %s', str(e))
-            if csvwriter is not None:
-                csvwriter.writerow([f, 'read error'])
+            return 'read error'
+
+    if options.loaders > 1:
+        pool = ThreadPool(options.loaders)
+        try:
+            results = pool.map(check, options.fromfiles)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [check(f) for f in options.fromfiles]
+
+    ret = 0
+    for f, r in zip(options.fromfiles, results):
+        if r != 'valid':
             ret = 1
+        if csvwriter is not None:
+            csvwriter.writerow([f, r])
     return ret
 
 if __name__ == '__main__':
@@ -9,7 +9,6 @@ Requirements
 ------------
 * numpy
 * yaml
-* jinja2 template engine
 
 Examples
 --------
@@ -22,8 +21,7 @@ Read body model data given the file path
 
 from . import model
 from . import utils
-from . import collada
-from . import stl
+from . import formats
 import os
 import sys
 import time
@@ -35,9 +33,11 @@ with warnings.catch_warnings():
 import math
 import numpy
 import copy
-import jinja2
-import uuid
 import yaml
+try:
+    from yaml import CSafeLoader as YAMLLoader
+except ImportError:
+    from yaml import SafeLoader as YAMLLoader
 
 class CnoidBodyReader(object):
     '''
@@ -75,12 +75,13 @@ class CnoidBodyReader(object):
         Read Choreonoid body model data given the file path
         '''
         self._assethandler = assethandler
-        modeldata = open(f, 'r').read()
+        with utils.openfile(f) as fd:
+            modeldata = fd.read()
         try:
-            self._model = yaml.load(modeldata)
+            self._model = yaml.load(modeldata, Loader=YAMLLoader)
         except yaml.scanner.ScannerError:
             # fallback for ScannerError (some choreonoid model contains invalid tab characters)
-            self._model = yaml.load(modeldata.replace("\t", ''))
+            self._model = yaml.load(modeldata.replace('\t', ''), Loader=YAMLLoader)
 
         if self._model['format'] != 'ChoreonoidBody':
             raise yaml.scanner.ScannerError('This file is not ChoreonoidBody format')
@@ -138,10 +139,7 @@ class CnoidBodyReader(object):
         rootname = self._model['rootLink']
         rootpose = self._rel_poses[rootname].getmatrix()
         rootlink = self._linknamemap[rootname][0]
-        for c in self._linknamemap.keys():
-            (lm2, jm2) = self._linknamemap[c]
-            if jm2 and jm2.parent == rootname:
-                self.relToAbs(rootpose, c)
+        self.relToAbs(rootpose, rootname)
         # TODO: need to translate CoM and inertia here
         for v in rootlink.visuals:
             v.matrix = numpy.dot(rootpose, v.getmatrix())
@@ -154,24 +152,32 @@ class CnoidBodyReader(object):
 
         return bm
 
-    def relToAbs(self, absparent, childname):
-        relchild = self._rel_poses[childname]
-        (lm, jm) = self._linknamemap[childname]
+    def relToAbs(self, absroot, rootname):
+        '''
+        Convert relative poses of the descendant links of the root to absolute
+        '''
+        childmap = {}
+        for c, (lm, jm) in self._linknamemap.items():
+            if jm:
+                childmap.setdefault(jm.parent, []).append(c)
 
-        # convert to absolute position
-        abschild = numpy.dot(absparent, relchild.getmatrix())
+        absposes = {rootname: absroot}
+        for c, parentname, depth, entering in utils.traverse(rootname, lambda n: childmap.get(n, [])):
+            if not entering or parentname is None:
+                continue
+            relchild = self._rel_poses[c]
+            (lm, jm) = self._linknamemap[c]
 
-        jm.matrix = abschild
-        jm.trans = None
-        jm.rot = None
-        lm.matrix = abschild
-        lm.trans = None
-        lm.rot = None
+            # convert to absolute position
+            abschild = numpy.dot(absposes[parentname], relchild.getmatrix())
+            absposes[c] = abschild
 
-        for c in self._linknamemap.keys():
-            (lm2, jm2) = self._linknamemap[c]
-            if jm2 and jm2.parent == childname:
-                self.relToAbs(abschild, c)
+            jm.matrix = abschild
+            jm.trans = None
+            jm.rot = None
+            lm.matrix = abschild
+            lm.trans = None
+            lm.rot = None
 
     def readJoint(self, m):
         name = m['name']
@@ -325,12 +331,8 @@ class CnoidBodyReader(object):
             if t == 'Resource':
                 sm.shapeType = model.ShapeModel.SP_MESH
                 filename = utils.resolveFile(e['geometry']['uri'])
-                fileext = os.path.splitext(filename)[1].lower()
-                if fileext == '.dae':
-                    reader = collada.ColladaReader()
-                else:
-                    reader = stl.STLReader()
-                    sm.data = reader.read(filename, assethandler=self._assethandler)
+                reader = formats.meshreader(filename, 'stl')
+                sm.data = reader.read(filename, assethandler=self._assethandler)
             elif t == 'Sphere':
                 sm.shapeType = model.ShapeModel.SP_SPHERE
                 sm.data = model.SphereData()
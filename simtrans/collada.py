@@ -24,6 +24,7 @@ Read collada model data given the file path
 
 from __future__ import absolute_import
 from . import model
+from . import utils
 import logging
 import warnings
 with warnings.catch_warnings():
@@ -32,15 +33,10 @@ with warnings.catch_warnings():
 import os
 import collada
 import numpy
-import uuid
 import lxml
+import lxml.etree
 from StringIO import StringIO
 
-# create this class to just to use generateNormals function
-class DummyTriangleSet(collada.triangleset.TriangleSet):
-    def __init__(self):
-        pass
-
 class ColladaReader(object):
     '''
     Collada reader class
@@ -49,6 +45,7 @@ class ColladaReader(object):
         self._basepath = None
         self._assethandler = None
         self._materials = {}
+        self._textures = {}
 
     def read(self, f, assethandler=None, submesh=None, options=None):
         '''
@@ -57,10 +54,15 @@ class ColladaReader(object):
         self._basepath = os.path.dirname(f)
         self._assethandler = assethandler
         try:
-            d = collada.Collada(f)
+            if utils.isplainfile(f):
+                d = collada.Collada(f)
+            else:
+                with utils.openfile(f) as fd:
+                    d = collada.Collada(fd)
         except:
             # workaround for pycollada's handling of xml comments
-            xdoc = lxml.etree.parse(f)
+            with utils.openfile(f) as fd:
+                xdoc = lxml.etree.parse(fd)
             for c in xdoc.xpath('//comment()'):
                 p = c.getparent()
                 p.remove(c)
@@ -74,13 +76,11 @@ class ColladaReader(object):
             mm.name = m.id
             if type(m.effect.diffuse) == collada.material.Map:
                 fname = os.path.abspath(os.path.join(self._basepath, m.effect.diffuse.sampler.surface.image.path))
-                if not os.path.exists(fname):
+                if not utils.fileexists(fname):
                     if fname.count('/meshes/') > 0:
                         fname = fname.replace('/meshes/', '/materials/textures/')
-                if self._assethandler:
-                    mm.texture = self._assethandler(fname)
-                else:
-                    mm.texture = fname
+                # texture is passed to the asset handler when it is used
+                self._textures[mm.name] = fname
             elif m.effect.diffuse is not None:
                 mm.diffuse = m.effect.diffuse
             self._materials[mm.name] = mm
@@ -107,6 +107,17 @@ class ColladaReader(object):
                 m.children.append(cm)
         return m
 
+    def usematerial(self, mm):
+        try:
+            fname = self._textures.pop(mm.name)
+        except KeyError:
+            return mm
+        if self._assethandler:
+            mm.texture = self._assethandler(fname)
+        else:
+            mm.texture = fname
+        return mm
+
     def findchild(self, d, name, trans):
         if type(d) not in [collada.scene.Node, collada.scene.NodeNode]:
             return None
@@ -179,7 +190,7 @@ class ColladaReader(object):
                     else:
                         sm.uvmap_index = numpy.array(p.texcoord_indexset[0]).reshape(len(p.texcoord_indexset[0])/3, 3)
                 try:
-                    sm.material = materialmap[p.material]
+                    sm.material = self.usematerial(materialmap[p.material])
                 except KeyError:
                     sm.material = model.MaterialModel()
                 m.children.append(sm)
@@ -188,102 +199,203 @@ class ColladaReader(object):
         return m
 
 
+COLLADA_NS = 'http://www.collada.org/2005/11/COLLADASchema'
+
+
+def _tag(t):
+    return '{%s}%s' % (COLLADA_NS, t)
+
+
+def formatarray(a, fmt='%.12g'):
+    '''
+    Format numbers in the array as space separated text (in bulk, floats
+    keep the 12 significant digits of str() as pycollada wrote them)
+
+    >>> formatarray(numpy.array([[0, 0.5], [1.0 / 3, 2]]))
+    '0 0.5 0.333333333333 2'
+    >>> formatarray(numpy.array([[0, 1, 2]]))
+    '0 1 2'
+    '''
+    a = numpy.asarray(a)
+    l = a.ravel().tolist()
+    if a.dtype.kind in 'iu':
+        return ' '.join(map(str, l))
+    return ' '.join([fmt] * len(l)) % tuple(l)
+
+
 class ColladaWriter(object):
     '''
     Collada writer class
     '''
     def __init__(self):
-        self._mesh = None
-        self._matnode = None
+        self._xf = None
+        self._nodecount = 0
+        self._shapecount = 0
 
     def write(self, m, f, options=None):
         '''
         Write simulation model in collada format
+
+        The document is streamed by lxml incremental writer and the array
+        data are formatted in bulk (ids and timestamps are fixed to make
+        the output reproducible).
         '''
-        # we use pycollada to generate the dae file
-        self._mesh = collada.Collada()
-
-        # create effect and material
-        if m.data.material:
-            if m.data.material.texture:
-                image = collada.material.CImage("material0-image", m.data.material.texture)
-                surface = collada.material.Surface("material0-image-surface", image)
-                sampler2d = collada.material.Sampler2D("material0-image-sampler", surface)
-                map1 = collada.material.Map(sampler2d, "UVSET0")
-                effect = collada.material.Effect("effect0", [surface, sampler2d], "lambert",
-                                                 emission=(0.0, 0.0, 0.0, 1),
-                                                 ambient=(0.0, 0.0, 0.0, 1),
-                                                 diffuse=map1,
-                                                 transparency=0.0,
-                                                 double_sided=True)
-                self._mesh.images.append(image)
+        material = getattr(m.data, 'material', None)
+        texture = None
+        if material is not None and material.texture:
+            texture = str(material.texture)
+        timestamp = utils.timestamp().isoformat()
+        with utils.openfile(f, 'wb') as fd, lxml.etree.xmlfile(fd, encoding='utf-8') as xf:
+            self._xf = xf
+            xf.write_declaration()
+            with xf.element(_tag('COLLADA'), nsmap={None: COLLADA_NS}, version='1.4.1'):
+                with self.element('asset'):
+                    self.text('created', timestamp)
+                    self.text('modified', timestamp)
+                    self.text('up_axis', 'Y_UP')
+
+                # create effect and material
+                with self.element('library_effects'):
+                    with self.element('effect', id='effect0', name='effect0'):
+                        with self.element('profile_COMMON'):
+                            self.writeeffect(material, texture)
+                if texture is not None:
+                    with self.element('library_images'):
+                        with self.element('image', id='material0-image', name='material0-image'):
+                            self.text('init_from', texture)
+                with self.element('library_materials'):
+                    with self.element('material', id='material0', name='mymaterial'):
+                        self.empty('instance_effect', url='#effect0')
+
+                # convert shapes recursively
+                with self.element('library_geometries'):
+                    self._shapecount = 0
+                    self.writegeometries(m.data)
+
+                # create scene graph
+                with self.element('library_visual_scenes'):
+                    with self.element('visual_scene', id='myscene'):
+                        with self.element('node', id='root', name='root'):
+                            self._nodecount = 0
+                            self._shapecount = 0
+                            self.writenodes(m.data)
+                with self.element('scene'):
+                    self.empty('instance_visual_scene', url='#myscene')
+        self._xf = None
+
+    def element(self, tag, **attrib):
+        return self._xf.element(_tag(tag), attrib)
+
+    def empty(self, tag, **attrib):
+        with self.element(tag, **attrib):
+            pass
+
+    def text(self, tag, text, **attrib):
+        with self.element(tag, **attrib):
+            self._xf.write(text)
+
+    def color(self, tag, c):
+        c = list(c)
+        if len(c) == 3:
+            c.append(1.0)
+        with self.element(tag):
+            self.text('color', formatarray(c))
+
+    def scalar(self, tag, v):
+        with self.element(tag):
+            self.text('float', formatarray([v]))
+
+    def writeeffect(self, material, texture):
+        if texture is not None:
+            with self.element('newparam', sid='material0-image-surface'):
+                with self.element('surface', type='2D'):
+                    self.text('init_from', 'material0-image')
+                    self.text('format', 'A8R8G8B8')
+            with self.element('newparam', sid='material0-image-sampler'):
+                with self.element('sampler2D'):
+                    self.text('source', 'material0-image-surface')
+        with self.element('technique', sid='common'):
+            if texture is not None:
+                with self.element('lambert'):
+                    self.color('emission', [0, 0, 0, 1])
+                    self.color('ambient', [0, 0, 0, 1])
+                    with self.element('diffuse'):
+                        self.empty('texture', texture='material0-image-sampler', texcoord='UVSET0')
+                    self.color('reflective', [0, 0, 0, 1])
+                    self.scalar('reflectivity', 0)
+                    self.color('transparent', [0, 0, 0, 1])
+                    self.scalar('transparency', 0)
             else:
-                effect = collada.material.Effect("effect0", [], "phong",
-                                                 double_sided=True,
-                                                 diffuse=m.data.material.diffuse,
-                                                 specular=m.data.material.specular,
-                                                 index_of_refraction=1.0)
-        else:
-            effect = collada.material.Effect("effect0", [], "phong",
-                                             double_sided=True,
-                                             diffuse=(0.8,0.8,0.8),
-                                             specular=(1,1,1),
-                                             index_of_refraction=1.0)
-        mat = collada.material.Material("material0", "mymaterial", effect)
-        self._mesh.effects.append(effect)
-        self._mesh.materials.append(mat)
-        self._matnode = collada.scene.MaterialNode("materialref", mat, inputs=[])
-
-        # convert shapes recursively
-        node = collada.scene.Node("root", children=[self.convertchild(m.data)])
-
-        # create scene graph
-        myscene = collada.scene.Scene("myscene", [node])
-        self._mesh.scenes.append(myscene)
-        self._mesh.scene = myscene
-        self._mesh.write(f)
-
-    def convertchild(self, m):
+                if material is not None:
+                    diffuse = material.diffuse
+                    specular = material.specular
+                else:
+                    diffuse = [0.8, 0.8, 0.8]
+                    specular = [1, 1, 1]
+                with self.element('phong'):
+                    self.color('emission', [0, 0, 0, 1])
+                    self.color('ambient', [0, 0, 0, 1])
+                    self.color('diffuse', diffuse)
+                    if specular is not None:
+                        self.color('specular', specular)
+                    self.scalar('shininess', 0)
+                    self.color('reflective', [0, 0, 0, 1])
+                    self.scalar('reflectivity', 0)
+                    self.color('transparent', [0, 0, 0, 1])
+                    self.scalar('transparency', 1)
+                    self.scalar('index_of_refraction', 1)
+        with self.element('extra'):
+            with self.element('technique', profile='GOOGLEEARTH'):
+                self.text('double_sided', '1')
+
+    def writesource(self, name, a, params):
+        with self.element('source', id=name):
+            self.text('float_array', formatarray(a), id=name + '-array', count=str(a.size))
+            with self.element('technique_common'):
+                with self.element('accessor', source='#' + name + '-array', count=str(a.size // len(params)), stride=str(len(params))):
+                    for p in params:
+                        self.empty('param', name=p, type='float')
+
+    def writegeometries(self, m):
         if type(m) == model.MeshTransformData:
-            children = []
-            name = 'node-' + str(uuid.uuid1()).replace('-', '')
             for c in m.children:
-                cn = self.convertchild(c)
-                if cn:
-                    children.append(cn)
-            node = collada.scene.Node(name, children=children)
-            return node
+                self.writegeometries(c)
         elif type(m) == model.MeshData:
-            name = 'shape-' + str(uuid.uuid1()).replace('-', '')
-            vertexname = name + '-vertex'
-            normalname = name + '-normal'
-            uvmapname = name + '-uvmap'
-            sources = []
-            input_list = collada.source.InputList()
-            sources.append(collada.source.FloatSource(vertexname, m.vertex.reshape(1, m.vertex.size), ('X', 'Y', 'Z')))
-            indices = m.vertex_index.reshape(1, m.vertex_index.size)
-            input_list.addInput(0, 'VERTEX', '#' + vertexname)
-            if m.normal is not None and m.normal_index.size > 0:
-                sources.append(collada.source.FloatSource(normalname, m.normal.reshape(1, m.normal.size), ('X', 'Y', 'Z')))
-                indices = numpy.vstack([indices, m.normal_index.reshape(1, m.normal_index.size)])
-                input_list.addInput(1, 'NORMAL', '#' + normalname)
-            else:
-                d = DummyTriangleSet()
-                d._vertex = m.vertex
-                d._vertex_index = m.vertex_index
-                d.generateNormals()
-                sources.append(collada.source.FloatSource(normalname, d._normal.reshape(1, d._normal.size), ('X', 'Y', 'Z')))
-                indices = numpy.vstack([indices, d._normal_index.reshape(1, d._normal_index.size)])
-                input_list.addInput(1, 'NORMAL', '#' + normalname)
+            name = 'shape-%i' % self._shapecount
+            geomid = 'geometry%i' % self._shapecount
+            self._shapecount += 1
+            vertex = numpy.asarray(m.vertex)
+            vertex_index = numpy.asarray(m.vertex_index)
+            normal, normal_index = m.getnormals()
+            columns = [vertex_index.ravel(), numpy.asarray(normal_index).ravel()]
             if m.uvmap is not None:
-                sources.append(collada.source.FloatSource(uvmapname, m.uvmap.reshape(1, m.uvmap.size), ('S', 'T')))
-                indices = numpy.vstack([indices, m.uvmap_index.reshape(1, m.uvmap_index.size)])
-                input_list.addInput(2, 'TEXCOORD', '#' + uvmapname, set="0")
-            geom = collada.geometry.Geometry(self._mesh, 'geometry0', name, sources, double_sided=True)
-            # create triangles
-            triset = geom.createTriangleSet(indices.T.reshape(1, indices.size), input_list, 'materialref')
-            geom.primitives.append(triset)
-            self._mesh.geometries.append(geom)
-            node = collada.scene.GeometryNode(geom, [self._matnode])
-            return node
-        return None
+                columns.append(numpy.asarray(m.uvmap_index).ravel())
+            with self.element('geometry', id=geomid, name=name):
+                with self.element('mesh'):
+                    self.writesource(name + '-vertex', vertex, ('X', 'Y', 'Z'))
+                    self.writesource(name + '-normal', numpy.asarray(normal), ('X', 'Y', 'Z'))
+                    if m.uvmap is not None:
+                        self.writesource(name + '-uvmap', numpy.asarray(m.uvmap), ('S', 'T'))
+                    with self.element('vertices', id=name + '-vertex-vertices'):
+                        self.empty('input', semantic='POSITION', source='#' + name + '-vertex')
+                    with self.element('triangles', count=str(vertex_index.size // 3), material='materialref'):
+                        self.empty('input', semantic='VERTEX', source='#' + name + '-vertex-vertices', offset='0')
+                        self.empty('input', semantic='NORMAL', source='#' + name + '-normal', offset='1')
+                        if m.uvmap is not None:
+                            self.empty('input', semantic='TEXCOORD', source='#' + name + '-uvmap', offset='2', set='0')
+                        self.text('p', formatarray(numpy.column_stack(columns).astype(int)))
+
+    def writenodes(self, m):
+        if type(m) == model.MeshTransformData:
+            name = 'node-%i' % self._nodecount
+            self._nodecount += 1
+            with self.element('node', id=name, name=name):
+                for c in m.children:
+                    self.writenodes(c)
+        elif type(m) == model.MeshData:
+            geomid = 'geometry%i' % self._shapecount
+            self._shapecount += 1
+            with self.element('instance_geometry', url='#' + geomid):
+                with self.element('bind_material'):
+                    with self.element('technique_common'):
+                        self.empty('instance_material', symbol='materialref', target='#material0')
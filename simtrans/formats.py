@@ -0,0 +1,104 @@
+# -*- coding:utf-8 -*-
+
+"""Registry of the model and mesh formats
+
+Formats are looked up by the name (given by -f and -t options) or by the
+file extension. Module of the format is imported only when its reader or
+writer is used, so that the libraries of the other formats are not
+loaded.
+
+>>> find('vrml').extensions
+['.wrl']
+>>> find(fname='/tmp/model.world').name
+'sdf'
+>>> find(fname='mesh.DAE.gz').name
+'collada'
+>>> find('unknown', 'model.urdf').name
+'urdf'
+>>> find('unknown') is None
+True
+>>> find('gltf').readername is None
+True
+"""
+
+import importlib
+from . import utils
+
+
+class Format(object):
+    '''
+    Model or mesh format
+    '''
+    def __init__(self, name, extensions, module, reader=None, writer=None, meshwriter=None, mesh=False, assets='copy'):
+        self.name = name                  #: Name of the format
+        self.extensions = extensions      #: File extensions (lower case)
+        self.module = module              #: Module implementing the format
+        self.readername = reader          #: Name of the reader class
+        self.writername = writer          #: Name of the writer class of the model
+        self.meshwritername = meshwriter  #: Name of the writer class of a mesh
+        self.mesh = mesh                  #: Whether the format stores single mesh
+        self.assets = assets              #: Handling of textures ('copy', 'jpeg' or None)
+
+    def load(self, name):
+        '''
+        Class of the format given the name (the module is imported on the first call)
+        '''
+        return getattr(importlib.import_module('simtrans.' + self.module), name)
+
+    def reader(self):
+        if self.readername is None:
+            return None
+        return self.load(self.readername)()
+
+    def writer(self):
+        if self.writername is None:
+            return None
+        return self.load(self.writername)()
+
+    def meshwriter(self):
+        if self.meshwritername is None:
+            return None
+        return self.load(self.meshwritername)()
+
+
+formats = [
+    Format('vrml', ['.wrl'], 'vrml', 'VRMLReader', 'VRMLWriter', meshwriter='VRMLMeshWriter', assets='jpeg'),
+    Format('urdf', ['.urdf'], 'urdf', 'URDFReader', 'URDFWriter'),
+    Format('sdf', ['.sdf', '.world'], 'sdf', 'SDFReader', 'SDFWriter'),
+    Format('body', ['.body'], 'cnoidbody', 'CnoidBodyReader'),
+    Format('collada', ['.dae'], 'collada', 'ColladaReader', meshwriter='ColladaWriter', mesh=True),
+    Format('stl', ['.stl'], 'stl', 'STLReader', meshwriter='STLWriter', mesh=True, assets=None),
+    Format('ply', ['.ply'], 'ply', 'PLYReader', meshwriter='PLYWriter', mesh=True),
+    Format('gltf', ['.glb', '.gltf'], 'gltf', meshwriter='GLTFWriter', mesh=True),
+    Format('dot', ['.dot'], 'graphviz', writer='GraphvizWriter', assets=None),
+    Format('snapshot', ['.snapshot'], 'snapshot', 'SnapshotReader', 'SnapshotWriter')
+]
+
+
+def find(name=None, fname=None):
+    '''
+    Find format by the name, or by the extension of the file name if the
+    name is not given or unknown (returns None if not found)
+    '''
+    for f in formats:
+        if name is not None and f.name == name:
+            return f
+    if fname is not None:
+        ext = utils.splitext(fname)[1].lower()
+        for f in formats:
+            if ext in f.extensions:
+                return f
+    return None
+
+
+def meshreader(fname, default=None):
+    '''
+    Reader of the mesh file detected by the extension (reader of the
+    default format is returned if the format is not a mesh format)
+    '''
+    f = find(fname=fname)
+    if f is None or not f.mesh or f.readername is None:
+        f = find(default)
+        if f is None:
+            raise Exception('unsupported mesh format: %s' % fname)
+    return f.reader()
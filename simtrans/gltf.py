@@ -0,0 +1,309 @@
+# -*- coding:utf-8 -*-
+
+"""Writer for glTF 2.0 format
+
+Meshes are written as binary buffers straight from numpy arrays. The
+output is binary glTF (GLB) if the file name ends with ".glb", JSON with
+a separate ".bin" buffer otherwise. Textures are referred by the uri.
+
+:Organization:
+ AIST
+
+Requirements
+------------
+* numpy
+
+Examples
+--------
+
+Write a mesh in GLB format
+
+>>> import tempfile
+>>> m = model.MeshData()
+>>> m.vertex = numpy.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=float)
+>>> m.vertex_index = numpy.array([[0, 1, 2], [0, 3, 1]])
+>>> m.material = model.MaterialModel()
+>>> s = model.ShapeModel()
+>>> s.data = m
+>>> fname = os.path.join(tempfile.mkdtemp(), 'mesh.glb')
+>>> GLTFWriter().write(s, fname)
+>>> doc, binary = readglb(fname)
+>>> doc['accessors'][0]['count'], doc['accessors'][0]['max']
+(4, [1.0, 1.0, 1.0])
+>>> sorted(doc['meshes'][0]['primitives'][0]['attributes'].items())
+[(u'NORMAL', 1), (u'POSITION', 0)]
+>>> len(binary) == doc['buffers'][0]['byteLength']
+True
+"""
+
+from __future__ import absolute_import
+from . import model
+from . import utils
+from .ply import weld
+import os
+import json
+import struct
+import numpy
+
+
+GLB_MAGIC = 0x46546c67
+GLB_JSON = 0x4e4f534a
+GLB_BIN = 0x004e4942
+
+# component types
+FLOAT = 5126
+UNSIGNED_SHORT = 5123
+UNSIGNED_INT = 5125
+
+# buffer view targets
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+
+
+def _pad(data, fill='\0'):
+    return data + fill * (-len(data) % 4)
+
+
+def readglb(f):
+    '''
+    Read JSON document and binary buffer of GLB file
+    '''
+    with utils.openfile(f) as fd:
+        data = fd.read()
+    magic, version, length = struct.unpack('<III', data[:12])
+    if magic != GLB_MAGIC:
+        raise Exception('not a glb file')
+    doc = None
+    binary = None
+    offset = 12
+    while offset < length:
+        chunklength, chunktype = struct.unpack('<II', data[offset:offset + 8])
+        chunk = data[offset + 8:offset + 8 + chunklength]
+        if chunktype == GLB_JSON:
+            doc = json.loads(chunk)
+        elif chunktype == GLB_BIN:
+            binary = chunk
+        offset += 8 + chunklength
+    return (doc, binary)
+
+
+class GLTFWriter(object):
+    '''
+    glTF writer class
+    '''
+    def __init__(self):
+        self._doc = None
+        self._buffer = None
+        self._length = 0
+        self._materials = {}
+        self._textures = {}
+
+    def write(self, m, f, options=None):
+        '''
+        Write mesh model in glTF format
+        '''
+        self._doc = {
+            'asset': {'version': '2.0', 'generator': 'simtrans'},
+            'scene': 0,
+            'scenes': [{'nodes': []}],
+            'nodes': [],
+            'meshes': [],
+            'materials': [],
+            'accessors': [],
+            'bufferViews': [],
+            'buffers': []
+        }
+        self._buffer = []
+        self._length = 0
+        self._materials = {}
+        self._textures = {}
+        root = self.writenode(m.data)
+        if root is not None:
+            self._doc['scenes'][0]['nodes'].append(root)
+        for k in ['meshes', 'materials', 'accessors', 'bufferViews']:
+            if len(self._doc[k]) == 0:
+                del self._doc[k]
+        binary = ''.join(self._buffer)
+        glb = utils.splitext(f)[1] == '.glb'
+        if len(binary) > 0:
+            buf = {'byteLength': len(binary)}
+            if not glb:
+                binfile = utils.splitext(f)[0] + '.bin'
+                buf['uri'] = os.path.basename(binfile)
+                with utils.openfile(binfile, 'wb') as fd:
+                    fd.write(binary)
+            self._doc['buffers'].append(buf)
+        else:
+            del self._doc['buffers']
+        doc = json.dumps(self._doc, sort_keys=True, separators=(',', ':'))
+        with utils.openfile(f, 'wb') as fd:
+            if glb:
+                doc = _pad(doc, ' ')
+                binary = _pad(binary)
+                length = 12 + 8 + len(doc)
+                if len(binary) > 0:
+                    length += 8 + len(binary)
+                fd.write(struct.pack('<III', GLB_MAGIC, 2, length))
+                fd.write(struct.pack('<II', len(doc), GLB_JSON))
+                fd.write(doc)
+                if len(binary) > 0:
+                    fd.write(struct.pack('<II', len(binary), GLB_BIN))
+                    fd.write(binary)
+            else:
+                fd.write(doc)
+        self._buffer = None
+
+    def writenode(self, m):
+        '''
+        Write node for the mesh tree (returns index of the node)
+        '''
+        node = {}
+        meshes = []
+        if type(m) == model.MeshTransformData:
+            if m.matrix is not None or m.trans is not None or m.rot is not None or m.scale is not None:
+                matrix = numpy.asarray(m.getmatrix(), dtype=float)
+                if not numpy.allclose(matrix, numpy.identity(4)):
+                    node['matrix'] = matrix.T.ravel().tolist()
+            children = []
+            for c in m.children:
+                if type(c) == model.MeshData:
+                    meshes.append(c)
+                else:
+                    n = self.writenode(c)
+                    if n is not None:
+                        children.append(n)
+            if len(children) > 0:
+                node['children'] = children
+        elif type(m) == model.MeshData:
+            meshes.append(m)
+        else:
+            return None
+        primitives = []
+        for c in meshes:
+            p = self.writeprimitive(c)
+            if p is not None:
+                primitives.append(p)
+        if len(primitives) > 0:
+            node['mesh'] = len(self._doc['meshes'])
+            self._doc['meshes'].append({'primitives': primitives})
+        if len(node) == 0:
+            return None
+        self._doc['nodes'].append(node)
+        return len(self._doc['nodes']) - 1
+
+    def writeprimitive(self, m):
+        '''
+        Write mesh data as a triangle primitive
+        '''
+        vertex = numpy.asarray(m.vertex, dtype=float).reshape(-1, 3)
+        vertex_index = numpy.asarray(m.vertex_index, dtype=int).reshape(-1, 3)
+        if len(vertex_index) == 0:
+            return None
+        normal, normal_index = m.getnormals()
+        normal = numpy.asarray(normal, dtype=float).reshape(-1, 3)
+        columns = [vertex_index, normal_index]
+        if m.uvmap is not None:
+            uvmap = numpy.asarray(m.uvmap, dtype=float).reshape(-1, 2)
+            columns.append(m.uvmap_index)
+        if all(numpy.array_equal(c, vertex_index) for c in columns[1:]):
+            keys = numpy.column_stack([numpy.arange(len(vertex))] * len(columns))
+            indices = vertex_index
+        else:
+            keys, indices = weld(columns)
+        position = vertex[keys[:, 0]]
+        normal = normal[keys[:, 1]]
+        length = numpy.sqrt(numpy.sum(normal * normal, axis=1))
+        normal[length == 0] = [0, 0, 1]
+        length[length == 0] = 1
+        normal = normal / length[:, numpy.newaxis]
+        attributes = {
+            'POSITION': self.accessor(position, 'VEC3', ARRAY_BUFFER, bounds=True),
+            'NORMAL': self.accessor(normal, 'VEC3', ARRAY_BUFFER)
+        }
+        if m.uvmap is not None:
+            # origin of texture coordinates is top left in glTF
+            uv = uvmap[keys[:, 2]] * [1, -1] + [0, 1]
+            attributes['TEXCOORD_0'] = self.accessor(uv, 'VEC2', ARRAY_BUFFER)
+        primitive = {
+            'attributes': attributes,
+            'indices': self.accessor(indices.ravel(), 'SCALAR', ELEMENT_ARRAY_BUFFER),
+            'mode': 4
+        }
+        if m.material is not None:
+            primitive['material'] = self.writematerial(m.material)
+        return primitive
+
+    def writematerial(self, mm):
+        '''
+        Write material as PBR metallic roughness material (returns index)
+        '''
+        try:
+            return self._materials[id(mm)]
+        except KeyError:
+            pass
+        color = list(mm.diffuse if mm.diffuse is not None else [0.8, 0.8, 0.8, 1.0])
+        if len(color) == 3:
+            color.append(1.0)
+        if isinstance(mm.transparency, (int, float)):
+            color[3] = 1.0 - mm.transparency
+        pbr = {
+            'baseColorFactor': [float(c) for c in color[:4]],
+            'metallicFactor': 0.0
+        }
+        if isinstance(mm.shininess, (int, float)):
+            pbr['roughnessFactor'] = 1.0 - min(max(float(mm.shininess), 0.0), 1.0)
+        if mm.texture:
+            pbr['baseColorTexture'] = {'index': self.writetexture(str(mm.texture))}
+        material = {'pbrMetallicRoughness': pbr}
+        if mm.name is not None:
+            material['name'] = mm.name
+        if mm.emission is not None:
+            material['emissiveFactor'] = [float(c) for c in list(mm.emission)[:3]]
+        if color[3] < 1.0:
+            material['alphaMode'] = 'BLEND'
+        index = len(self._doc['materials'])
+        self._doc['materials'].append(material)
+        self._materials[id(mm)] = index
+        return index
+
+    def writetexture(self, uri):
+        try:
+            return self._textures[uri]
+        except KeyError:
+            pass
+        doc = self._doc
+        if 'images' not in doc:
+            doc['images'] = []
+            doc['samplers'] = [{}]
+            doc['textures'] = []
+        doc['images'].append({'uri': uri})
+        doc['textures'].append({'source': len(doc['images']) - 1, 'sampler': 0})
+        self._textures[uri] = len(doc['textures']) - 1
+        return self._textures[uri]
+
+    def accessor(self, a, atype, target, bounds=False):
+        '''
+        Append array to the buffer (returns index of the accessor)
+        '''
+        if atype == 'SCALAR':
+            if a.max() < 65536:
+                a = a.astype('<u2')
+                ctype = UNSIGNED_SHORT
+            else:
+                a = a.astype('<u4')
+                ctype = UNSIGNED_INT
+        else:
+            a = a.astype('<f4')
+            ctype = FLOAT
+        data = _pad(a.tobytes())
+        view = {'buffer': 0, 'byteOffset': self._length, 'byteLength': a.nbytes, 'target': target}
+        self._buffer.append(data)
+        self._length += len(data)
+        self._doc['bufferViews'].append(view)
+        accessor = {'bufferView': len(self._doc['bufferViews']) - 1,
+                    'componentType': ctype, 'count': len(a), 'type': atype}
+        if bounds:
+            accessor['min'] = a.min(axis=0).astype(float).tolist()
+            accessor['max'] = a.max(axis=0).astype(float).tolist()
+        self._doc['accessors'].append(accessor)
+        return len(self._doc['accessors']) - 1
@@ -528,11 +528,87 @@ class MeshData(object):
     uvmap = None         #: UV mapping ([u,v] * N numpy matrix)
     uvmap_index = None   #: Vertex index  ([p1,p2,p3] * N numpy matrix)
     material = None      #: Name of material
+    creaseangle = None   #: Crease angle used to generate normals (radian, smooth if None)
 
     def __init__(self):
         self.vertex = []
         self.vertex_index = []
 
+    def getnormals(self):
+        '''
+        Normals of the mesh (returns normal and normal_index, generated
+        from the faces if the mesh has no normals)
+        '''
+        if self.normal is not None and self.normal_index is not None and len(self.normal_index) > 0:
+            return (self.normal, self.normal_index)
+        return self.generatenormals(self.creaseangle)
+
+    def generatenormals(self, creaseangle=None):
+        '''
+        Generate normals from the faces (returns normal and normal_index)
+
+        Vertex normals are area weighted average of the face normals. If
+        the crease angle is given, each corner of the face averages only
+        the faces around the vertex within the angle from the face (as
+        creaseAngle of VRML). Result is cached until the vertex or
+        vertex_index is replaced (the arrays are kept in the cache, set
+        _normalcache to None after modifying them in place).
+
+        >>> m = MeshData()
+        >>> m.vertex = numpy.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]])
+        >>> m.vertex_index = numpy.array([[0, 1, 2], [0, 3, 1]])
+        >>> normal, normal_index = m.generatenormals()
+        >>> numpy.allclose(normal[0], [0, 0.7071068, 0.7071068])
+        True
+        >>> normal, normal_index = m.generatenormals(creaseangle=0.5)
+        >>> numpy.allclose(normal[normal_index[0]], [0, 0, 1])
+        True
+        >>> m.generatenormals(creaseangle=0.5)[0] is normal
+        True
+        >>> m.vertex = numpy.array([[0, 0, 0], [1, 0, 0], [0, 0, 1], [0, 1, 0]])
+        >>> normal, normal_index = m.generatenormals(creaseangle=0.5)
+        >>> numpy.allclose(normal[normal_index[0]], [0, -1, 0])
+        True
+
+        Edges of the cube are kept sharp by the crease angle
+
+        >>> m = MeshData()
+        >>> m.vertex = numpy.array([[x, y, z] for x in [-1, 1] for y in [-1, 1] for z in [-1, 1]])
+        >>> m.vertex_index = numpy.array([[0, 1, 3], [0, 3, 2], [4, 6, 7], [4, 7, 5], [0, 4, 5], [0, 5, 1],
+        ...                               [2, 3, 7], [2, 7, 6], [0, 2, 6], [0, 6, 4], [1, 5, 7], [1, 7, 3]])
+        >>> normal, normal_index = m.generatenormals(creaseangle=1.0)
+        >>> numpy.allclose(numpy.abs(normal[normal_index]).max(axis=2), 1)
+        True
+        >>> normal, normal_index = m.generatenormals(creaseangle=2.0)
+        >>> numpy.allclose(normal[normal_index[0, 0]], [-0.5773503, -0.5773503, -0.5773503])
+        True
+        '''
+        # arrays are compared by identity (they are referred by the cache,
+        # so the ids are not reused by other arrays)
+        cache = self.__dict__.get('_normalcache')
+        if cache is not None and cache[0] is self.vertex and cache[1] is self.vertex_index and cache[2] == creaseangle:
+            return cache[3]
+        vertex = numpy.asarray(self.vertex, dtype=float).reshape(-1, 3)
+        index = numpy.asarray(self.vertex_index, dtype=int).reshape(-1, 3)
+        tris = vertex[index]
+        # length of the cross product is twice of the area of the face
+        facenormal = numpy.cross(tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0])
+        normal = numpy.zeros(vertex.shape)
+        for i in range(3):
+            normal[:, i] = numpy.bincount(index.ravel(), weights=numpy.repeat(facenormal[:, i], 3), minlength=len(vertex))
+        normal = _normalize(normal)
+        normal_index = index
+        if creaseangle is not None and len(index) > 0:
+            # corners with all the faces around the vertex in the angle
+            # share the vertex normal
+            corners, cornernormal = _creasenormals(index, facenormal, normal, creaseangle)
+            if len(corners) > 0:
+                normal_index = index.copy()
+                normal_index.ravel()[corners] = len(vertex) + numpy.arange(len(corners))
+                normal = numpy.vstack([normal, cornernormal])
+        self._normalcache = (self.vertex, self.vertex_index, creaseangle, (normal, normal_index))
+        return (normal, normal_index)
+
     def getbbox(self):
         maxv = numpy.array([-numpy.Inf, -numpy.Inf, -numpy.Inf])
         minv = numpy.array([numpy.Inf, numpy.Inf, numpy.Inf])
@@ -542,6 +618,58 @@ class MeshData(object):
         return [maxv, minv]
 
 
+def _normalize(v):
+    length = numpy.sqrt(numpy.sum(v * v, axis=1))
+    length[length == 0] = 1
+    return v / length[:, numpy.newaxis]
+
+
+def _creasenormals(index, facenormal, normal, creaseangle, chunk=1000000):
+    '''
+    Normals of the corners averaging the faces sharing the vertex within
+    the crease angle from the face of the corner (returns the corners
+    which do not average all the faces around the vertex and the normals
+    of them)
+    '''
+    unit = _normalize(facenormal)
+    area = numpy.sqrt(numpy.sum(facenormal * facenormal, axis=1))
+    vertex = index.ravel()
+    cornerunit = numpy.repeat(unit, index.shape[1], axis=0)
+    # faces within the half of the angle from the vertex normal are
+    # within the angle from each other (no need to check the pairs)
+    cos = numpy.einsum('ij,ij->i', cornerunit, normal[vertex])
+    check = numpy.zeros(len(normal), dtype=bool)
+    check[vertex[cos < numpy.cos(creaseangle / 2.0) - 1e-6]] = True
+    corners = numpy.nonzero(check[vertex])[0]
+    if len(corners) == 0:
+        return (corners, numpy.zeros((0, 3)))
+    # corners around the checked vertices sorted by the vertex
+    order = corners[numpy.argsort(vertex[corners])]
+    count = numpy.bincount(vertex[corners])
+    start = numpy.cumsum(count) - count
+    result = numpy.zeros((len(corners), 3))
+    smooth = numpy.zeros(len(corners), dtype=bool)
+    # pairs of the corners sharing the vertex are processed in chunks
+    # (vertex shared by many faces makes quadratic number of pairs)
+    pairs = numpy.cumsum(count[vertex[corners]])
+    begin = 0
+    while begin < len(corners):
+        end = max(numpy.searchsorted(pairs, (pairs[begin - 1] if begin > 0 else 0) + chunk, side='right'), begin + 1)
+        k = count[vertex[corners[begin:end]]]
+        first = numpy.cumsum(k) - k
+        a = numpy.repeat(numpy.arange(end - begin), k)
+        c = corners[begin:end][a]
+        g = order[start[vertex[c]] + numpy.arange(len(a)) - first[a]] // index.shape[1]
+        ug = unit[g]
+        include = numpy.einsum('ij,ij->i', cornerunit[c], ug) >= numpy.cos(creaseangle) - 1e-6
+        result[begin:end] = numpy.add.reduceat(ug * (area[g] * include)[:, numpy.newaxis], first)
+        smooth[begin:end] = numpy.logical_and.reduceat(include, first)
+        begin = end
+    # corners of the degenerate faces get the vertex normal
+    smooth |= ~result.any(axis=1)
+    return (corners[~smooth], _normalize(result[~smooth]))
+
+
 class BoxData(object):
     """
     Box shape data
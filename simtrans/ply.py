@@ -0,0 +1,364 @@
+# -*- coding:utf-8 -*-
+
+"""Reader and writer for ply format
+
+Binary PLY stores the vertex and face arrays as they are, which makes
+it the fastest mesh format to read and write (the reader maps the file
+to memory and views the arrays without parsing).
+
+:Organization:
+ AIST
+
+Requirements
+------------
+* numpy
+
+Examples
+--------
+
+Write a mesh and read it back
+
+>>> import tempfile
+>>> m = model.MeshData()
+>>> m.vertex = numpy.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=float)
+>>> m.vertex_index = numpy.array([[0, 1, 2], [0, 3, 1]])
+>>> s = model.ShapeModel()
+>>> s.data = m
+>>> fname = os.path.join(tempfile.mkdtemp(), 'mesh.ply')
+>>> PLYWriter().write(s, fname)
+>>> m2 = PLYReader().read(fname)
+>>> m2.vertex.tolist() == m.vertex.tolist()
+True
+>>> m2.vertex_index.tolist()
+[[0, 1, 2], [0, 3, 1]]
+>>> m2.normal is None
+True
+"""
+
+from __future__ import absolute_import
+from . import model
+from . import utils
+import os
+import logging
+import numpy
+
+
+#: numpy types of the PLY property types
+plytypes = {
+    'char': 'i1', 'int8': 'i1',
+    'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2',
+    'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4',
+    'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4',
+    'double': 'f8', 'float64': 'f8'
+}
+
+#: property names of the texture coordinates
+uvnames = [('s', 't'), ('u', 'v'), ('texture_u', 'texture_v'), ('texture_s', 'texture_t')]
+
+
+class PLYElement(object):
+    '''
+    Element declared in PLY header
+    '''
+    def __init__(self, name, count):
+        self.name = name
+        self.count = count
+        self.properties = []  # (name, type) or (name, (count type, item type))
+
+    def dtype(self, order):
+        '''
+        Record type of the element (None if it has list properties)
+        '''
+        if any(type(t) == tuple for n, t in self.properties):
+            return None
+        return numpy.dtype([(n, order + t) for n, t in self.properties])
+
+
+def parseheader(fd):
+    '''
+    Parse PLY header (returns byte order, list of elements and texture file)
+
+    >>> from io import BytesIO
+    >>> order, elements, texture = parseheader(BytesIO(b"""ply
+    ... format binary_little_endian 1.0
+    ... comment TextureFile body.png
+    ... element vertex 3
+    ... property float x
+    ... property float y
+    ... property float z
+    ... element face 1
+    ... property list uchar int vertex_indices
+    ... end_header
+    ... """))
+    >>> order, texture
+    ('<', 'body.png')
+    >>> [(e.name, e.count, e.properties) for e in elements]
+    [('vertex', 3, [('x', 'f4'), ('y', 'f4'), ('z', 'f4')]), ('face', 1, [('vertex_indices', ('u1', 'i4'))])]
+    '''
+    if fd.readline().strip() != 'ply':
+        raise Exception('not a ply file')
+    order = None
+    elements = []
+    texture = None
+    while True:
+        line = fd.readline()
+        if line == '':
+            raise Exception('unexpected end of ply header')
+        words = line.split()
+        if len(words) == 0:
+            continue
+        if words[0] == 'end_header':
+            break
+        elif words[0] == 'format':
+            if words[1] == 'binary_little_endian':
+                order = '<'
+            elif words[1] == 'binary_big_endian':
+                order = '>'
+            else:
+                raise Exception('unsupported ply format: %s' % words[1])
+        elif words[0] == 'comment':
+            if len(words) > 2 and words[1] == 'TextureFile':
+                texture = line.split(None, 2)[2].strip()
+        elif words[0] == 'element':
+            elements.append(PLYElement(words[1], int(words[2])))
+        elif words[0] == 'property':
+            if words[1] == 'list':
+                elements[-1].properties.append((words[4], (plytypes[words[2]], plytypes[words[3]])))
+            else:
+                elements[-1].properties.append((words[2], plytypes[words[1]]))
+    if order is None:
+        raise Exception('ply format is not specified')
+    return (order, elements, texture)
+
+
+def readfaces(buf, offset, e, order):
+    '''
+    Read face element and triangulate the polygons
+    (returns triangles and the end offset of the element)
+
+    >>> e = PLYElement('face', 2)
+    >>> e.properties = [('vertex_indices', ('u1', 'i4'))]
+    >>> quad = numpy.array([4], 'u1').tobytes() + numpy.arange(4, dtype='<i4').tobytes()
+    >>> tri = numpy.array([3], 'u1').tobytes() + numpy.arange(3, dtype='<i4').tobytes()
+    >>> buf = numpy.frombuffer(quad + tri, numpy.uint8)
+    >>> faces, end = readfaces(buf, 0, e, '<')
+    >>> faces.tolist(), end
+    ([[0, 1, 2], [0, 2, 3], [0, 1, 2]], 30)
+    '''
+    # fast path: all the faces are triangles
+    fields = []
+    for n, t in e.properties:
+        if type(t) == tuple:
+            fields.append((n + '_count', order + t[0]))
+            fields.append((n, order + t[1], (3,)))
+        else:
+            fields.append((n, order + t))
+    dtype = numpy.dtype(fields)
+    name = [n for n, t in e.properties if n in ('vertex_indices', 'vertex_index')][0]
+    end = offset + dtype.itemsize * e.count
+    if len([n for n, t in e.properties if type(t) == tuple]) == 1 and end <= len(buf):
+        faces = buf[offset:end].view(dtype)
+        if numpy.all(faces[name + '_count'] == 3):
+            return (numpy.array(faces[name], dtype=int), end)
+    # polygons of any size
+    triangles = []
+    for i in range(e.count):
+        for n, t in e.properties:
+            if type(t) == tuple:
+                ct = numpy.dtype(order + t[0])
+                it = numpy.dtype(order + t[1])
+                count = int(buf[offset:offset + ct.itemsize].view(ct)[0])
+                offset += ct.itemsize
+                items = buf[offset:offset + it.itemsize * count].view(it)
+                offset += it.itemsize * count
+                if n == name:
+                    for j in range(1, count - 1):
+                        triangles.append((items[0], items[j], items[j + 1]))
+            else:
+                offset += numpy.dtype(t).itemsize
+    return (numpy.array(triangles, dtype=int).reshape(-1, 3), offset)
+
+
+class PLYReader(object):
+    '''
+    PLY reader class
+    '''
+    def read(self, f, assethandler=None, submesh=None, options=None):
+        '''
+        Read mesh model in binary PLY format
+        '''
+        if submesh is not None:
+            logging.warning('submesh is not supported in ply format (%s)' % submesh)
+        with utils.openfile(f) as fd:
+            order, elements, texture = parseheader(fd)
+            offset = fd.tell()
+            if utils.isplainfile(f):
+                buf = numpy.memmap(f, dtype=numpy.uint8, mode='r')
+            else:
+                buf = numpy.frombuffer(fd.read(), dtype=numpy.uint8)
+                offset = 0
+        data = model.MeshData()
+        data.material = model.MaterialModel()
+        for e in elements:
+            dtype = e.dtype(order)
+            if e.name == 'face':
+                data.vertex_index, offset = readfaces(buf, offset, e, order)
+                continue
+            if dtype is None:
+                raise Exception('unsupported list property in ply element %s' % e.name)
+            end = offset + dtype.itemsize * e.count
+            if e.name == 'vertex':
+                v = buf[offset:end].view(dtype)
+                names = dtype.names
+                data.vertex = numpy.column_stack([v['x'], v['y'], v['z']]).astype(float)
+                if 'nx' in names:
+                    data.normal = numpy.column_stack([v['nx'], v['ny'], v['nz']]).astype(float)
+                for u, t in uvnames:
+                    if u in names and t in names:
+                        data.uvmap = numpy.column_stack([v[u], v[t]]).astype(float)
+                        break
+            offset = end
+        del buf
+        if data.normal is not None:
+            data.normal_index = data.vertex_index
+        if data.uvmap is not None:
+            data.uvmap_index = data.vertex_index
+        if texture is not None:
+            texture = os.path.join(os.path.dirname(f), texture)
+            if assethandler:
+                texture = assethandler(texture)
+            data.material.texture = texture
+        return data
+
+
+def flatten(m, trans=None):
+    '''
+    Collect mesh data in the mesh tree with the accumulated transformation
+    '''
+    if trans is None:
+        trans = numpy.identity(4)
+    if type(m) == model.MeshTransformData:
+        if m.matrix is not None:
+            trans = numpy.dot(trans, m.getmatrix())
+        meshes = []
+        for c in m.children:
+            meshes.extend(flatten(c, trans))
+        return meshes
+    elif type(m) == model.MeshData:
+        return [(m, trans)]
+    return []
+
+
+def weld(columns):
+    '''
+    Share vertices among the face corners having same vertex, normal and
+    uv indices (PLY has single index for all the vertex properties)
+
+    >>> keys, faces = weld([numpy.array([[0, 1, 2], [0, 2, 3]]), numpy.array([[0, 0, 0], [1, 1, 1]])])
+    >>> keys.tolist()
+    [[0, 0], [0, 1], [1, 0], [2, 0], [2, 1], [3, 1]]
+    >>> faces.tolist()
+    [[0, 2, 3], [1, 4, 5]]
+    '''
+    corners = numpy.column_stack([numpy.asarray(c).ravel() for c in columns]).astype(numpy.int64)
+    bounds = corners.max(axis=0) + 1
+    if numpy.prod(bounds.astype(float)) < 2 ** 62:
+        # pack the indices to single integer (much faster than unique rows)
+        packed = numpy.zeros(len(corners), dtype=numpy.int64)
+        for i in range(corners.shape[1]):
+            packed = packed * bounds[i] + corners[:, i]
+        packed, first, inverse = numpy.unique(packed, return_index=True, return_inverse=True)
+        keys = corners[first]
+    else:
+        keys, inverse = numpy.unique(corners, axis=0, return_inverse=True)
+    return (keys, inverse.reshape(-1, 3))
+
+
+class PLYWriter(object):
+    '''
+    PLY writer class
+    '''
+    def write(self, m, f, options=None):
+        '''
+        Write mesh model in binary little endian PLY format
+        (meshes in the tree are transformed and merged to single mesh)
+        '''
+        meshes = flatten(m.data)
+        hasnormal = any(d.normal is not None for d, t in meshes)
+        hasuv = any(d.uvmap is not None for d, t in meshes)
+        texture = None
+        for d, t in meshes:
+            if d.material is not None and d.material.texture:
+                texture = str(d.material.texture)
+                break
+        vertices = []
+        normals = []
+        uvmaps = []
+        faces = []
+        count = 0
+        for d, trans in meshes:
+            vertex = numpy.asarray(d.vertex, dtype=float).reshape(-1, 3)
+            vertex_index = numpy.asarray(d.vertex_index, dtype=int).reshape(-1, 3)
+            columns = [vertex_index]
+            if hasnormal:
+                normal, normal_index = d.getnormals()
+                normal = numpy.asarray(normal, dtype=float).reshape(-1, 3)
+                columns.append(normal_index)
+            if hasuv:
+                if d.uvmap is not None:
+                    uvmap = numpy.asarray(d.uvmap, dtype=float).reshape(-1, 2)
+                    columns.append(d.uvmap_index)
+                else:
+                    uvmap = numpy.zeros((1, 2))
+                    columns.append(numpy.zeros(vertex_index.shape, dtype=int))
+            if len(columns) > 1 and not all(numpy.array_equal(c, vertex_index) for c in columns[1:]):
+                keys, face = weld(columns)
+            else:
+                keys = numpy.column_stack([numpy.arange(len(vertex))] * len(columns))
+                face = vertex_index
+            vertices.append(numpy.dot(vertex[keys[:, 0]], trans[:3, :3].T) + trans[:3, 3])
+            if hasnormal:
+                n = numpy.dot(normal[keys[:, 1]], numpy.linalg.inv(trans[:3, :3]))
+                length = numpy.sqrt(numpy.sum(n * n, axis=1))
+                length[length == 0] = 1
+                normals.append(n / length[:, numpy.newaxis])
+            if hasuv:
+                uvmaps.append(uvmap[keys[:, -1]])
+            faces.append(face + count)
+            count += len(keys)
+
+        fields = [('x', '<f4'), ('y', '<f4'), ('z', '<f4')]
+        if hasnormal:
+            fields += [('nx', '<f4'), ('ny', '<f4'), ('nz', '<f4')]
+        if hasuv:
+            fields += [('s', '<f4'), ('t', '<f4')]
+        vertex = numpy.zeros(count, dtype=fields)
+        if count > 0:
+            a = numpy.concatenate(vertices)
+            vertex['x'], vertex['y'], vertex['z'] = a[:, 0], a[:, 1], a[:, 2]
+            if hasnormal:
+                a = numpy.concatenate(normals)
+                vertex['nx'], vertex['ny'], vertex['nz'] = a[:, 0], a[:, 1], a[:, 2]
+            if hasuv:
+                a = numpy.concatenate(uvmaps)
+                vertex['s'], vertex['t'] = a[:, 0], a[:, 1]
+        face = numpy.zeros(sum(len(a) for a in faces), dtype=[('n', 'u1'), ('vertex_indices', '<i4', (3,))])
+        face['n'] = 3
+        if len(face) > 0:
+            face['vertex_indices'] = numpy.concatenate(faces)
+
+        header = ['ply', 'format binary_little_endian 1.0', 'comment generated by simtrans']
+        if texture is not None:
+            header.append('comment TextureFile %s' % texture)
+        header.append('element vertex %i' % count)
+        header.extend(['property float %s' % n for n, t in fields])
+        header.append('element face %i' % len(face))
+        header.append('property list uchar int vertex_indices')
+        header.append('end_header')
+        with utils.openfile(f, 'wb') as fd:
+            fd.write('\n'.join(header) + '\n')
+            fd.write(vertex.tobytes())
+            fd.write(face.tobytes())
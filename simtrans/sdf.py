@@ -18,6 +18,13 @@ Read SDF model data given the model file
 
 >>> r = SDFReader()
 >>> m = r.read('model://pr2/model.sdf')
+
+libsdformat runs without holding the GIL, so files can be parsed concurrently
+
+>>> from multiprocessing.pool import ThreadPool
+>>> docs = ThreadPool(4).map(simtranssdfhelper.filter, [utils.resolveFile('model://pr2/model.sdf')] * 8)
+>>> len(set(docs))
+1
  
 Write simulation model in SDF format
 
@@ -40,14 +47,55 @@ import logging
 with warnings.catch_warnings():
     warnings.simplefilter('ignore')
     from .thirdparty import transformations as tf
-import jinja2
 import re
+import copy
 import tempfile
 from . import model
-from . import collada
-from . import stl
+from . import formats
 from . import utils
-import simtranssdfhelper
+from . import asset
+try:
+    import simtranssdfhelper
+except ImportError:
+    simtranssdfhelper = None
+
+
+class SDFElement(object):
+    '''
+    Element of the tree exported by simtranssdfhelper.tree
+    (provides the subset of lxml element interface used by SDFReader)
+
+    >>> e = SDFElement(('link', {'name': 'base'}, None, None, [('pose', {}, '0 0 1 0 0 0', (0.0, 0.0, 1.0, 0.0, 0.0, 0.0), [])]))
+    >>> e.attrib['name']
+    'base'
+    >>> e.find('pose').value
+    (0.0, 0.0, 1.0, 0.0, 0.0, 0.0)
+    >>> e.find('inertial') is None
+    True
+    '''
+    __slots__ = ('tag', 'attrib', 'text', 'value', '_children')
+
+    def __init__(self, node):
+        self.tag, self.attrib, self.text, self.value, children = node
+        self._children = [SDFElement(c) for c in children]
+
+    def find(self, tag):
+        for c in self._children:
+            if c.tag == tag:
+                return c
+        return None
+
+    def findall(self, tag):
+        return [c for c in self._children if c.tag == tag]
+
+    def getchildren(self):
+        return self._children
+
+    def __iter__(self):
+        return iter(self._children)
+
+    def __len__(self):
+        return len(self._children)
 
 
 class SDFReader(object):
@@ -59,37 +107,58 @@ class SDFReader(object):
         self._linkmap = {}
         self._relpositionmap = {}
         self._rootname = None
+        self._includecache = {}
 
-    def read(self, fname, assethandler=None, options=None):
+    def read(self, fname, assethandler=None, options=None, includecache=None):
         '''
         Read SDF model data given the model file
+
+        Models referred by <include> tag are parsed only once per read
+        (includecache is shared with the readers of the included models)
         '''
         self._assethandler = assethandler
+        if includecache is None:
+            includecache = {}
+        self._includecache = includecache
         
         # use libsdformat library as a filter to beautify input file
         # also used to convert urdf to sdf
-        sdfdata = simtranssdfhelper.filter(utils.resolveFile(fname))
-        d = lxml.etree.fromstring(sdfdata)
+        if simtranssdfhelper is None:
+            raise Exception('simtranssdfhelper module (libsdformat) is not available')
+        fname = utils.resolveFile(fname)
+        if not utils.isplainfile(fname):
+            # compressed file or member of the archive is passed as string
+            if not hasattr(simtranssdfhelper, 'treestring'):
+                raise Exception('simtranssdfhelper module is too old to read %s' % fname)
+            with utils.openfile(fname) as fd:
+                d = SDFElement(simtranssdfhelper.treestring(fd.read()))
+        elif hasattr(simtranssdfhelper, 'tree'):
+            # export the element tree directly (no xml round trip)
+            d = SDFElement(simtranssdfhelper.tree(fname))
+        else:
+            sdfdata = simtranssdfhelper.filter(fname)
+            d = lxml.etree.fromstring(sdfdata)
         
         bm = model.BodyModel()
         dm = d.find('model')
         bm.name = self._rootname = dm.attrib['name']
 
         for i in dm.findall('include'):
-            r = SDFReader()
-            m = r.read(utils.resolveFile(i.find('uri').text) + '/model.sdf')
+            m = self.readInclude(utils.resolveFile(i.find('uri').text) + '/model.sdf')
             name = i.find('name').text
             pose = i.find('pose')
             p = model.TransformationModel()
             if pose is not None:
                 self.readPose(p, pose)
             for l in m.links:
+                l = self.instantiateLink(l)
                 l.name = name + '::' + l.name
                 if pose is not None:
                     l.trans = p.gettranslation()
                     l.rot = p.getrotation()
                 bm.links.append(l)
             for j in m.joints:
+                j = self.instantiateJoint(j)
                 j.name = name + '::' + j.name
                 if j.parent != 'world':
                     j.parent = name + '::' + j.parent
@@ -110,7 +179,7 @@ class SDFReader(object):
                 lm.mass = float(inertial.find('mass').text)
                 pose = inertial.find('pose')
                 if pose is not None:
-                    lm.centerofmass = [float(v) for v in re.split(' +', pose.text.strip(' '))][0:3]
+                    lm.centerofmass = self.readFloats(pose)[0:3]
                 inertia = inertial.find('inertia')
                 if inertia is not None:
                     lm.inertia = self.readInertia(inertia)
@@ -171,8 +240,48 @@ class SDFReader(object):
                 bm.joints.append(jm)
         return bm
 
+    def readInclude(self, fname):
+        '''
+        Read included model (parsed once and cached for the rest of the read)
+        '''
+        try:
+            return self._includecache[fname]
+        except KeyError:
+            pass
+        logging.info("reading included model " + fname)
+        r = SDFReader()
+        m = r.read(fname, includecache=self._includecache)
+        self._includecache[fname] = m
+        return m
+
+    def instantiateLink(self, l):
+        '''
+        Create renamable shell of the cached link (shape and mesh data are shared)
+        '''
+        nl = copy.copy(l)
+        nl.centerofmass = copy.copy(l.centerofmass)
+        nl.inertia = l.inertia.copy()
+        nl.visuals = [copy.copy(v) for v in l.visuals]
+        nl.collisions = [copy.copy(c) for c in l.collisions]
+        return nl
+
+    def instantiateJoint(self, j):
+        '''
+        Create renamable shell of the cached joint
+        '''
+        nj = copy.copy(j)
+        nj.axis = copy.copy(j.axis)
+        nj.axis2 = copy.copy(j.axis2)
+        return nj
+
+    def readFloats(self, d):
+        # typed values are available when the tree is exported by the helper
+        if getattr(d, 'value', None) is not None:
+            return list(d.value)
+        return [float(v) for v in re.split(' +', d.text.strip(' '))]
+
     def readPose(self, m, doc):
-        pose = numpy.array([float(v) for v in re.split(' +', doc.text.strip(' '))])
+        pose = numpy.array(self.readFloats(doc))
         T = numpy.identity(4)
         T[:3, 3] = pose[:3]
         R = tf.euler_matrix(pose[3], pose[4], pose[5])
@@ -186,7 +295,7 @@ class SDFReader(object):
 
     def readAxis(self, jm, axis):
         am = model.AxisData()
-        am.axis = [float(v) for v in re.split(' +', axis.find('xyz').text.strip(' '))]
+        am.axis = self.readFloats(axis.find('xyz'))
         useparent = axis.find('use_parent_model_frame')
         if useparent is not None and useparent.text in ('1', 'true'):
             baseframe = self._linkmap[jm.parent]
@@ -255,16 +364,10 @@ class SDFReader(object):
                 m.shapeType = model.ShapeModel.SP_MESH
                 filename = utils.resolveFile(g.find('uri').text)
                 logging.info("reading mesh " + filename)
-                fileext = os.path.splitext(filename)[1].lower()
-                if fileext == '.dae':
-                    reader = collada.ColladaReader()
-                elif fileext == '.stl':
-                    reader = stl.STLReader()
-                else:
-                    raise Exception('unsupported mesh format: %s' % fileext)
+                reader = formats.meshreader(filename)
                 scale = g.find('scale')
                 if scale is not None:
-                    m.scale = numpy.array([float(v) for v in re.split(' +', scale.text.strip(' '))])
+                    m.scale = numpy.array(self.readFloats(scale))
                 submesh = g.find('submesh')
                 if submesh is not None:
                     submeshname = submesh.find('name').text
@@ -288,7 +391,7 @@ class SDFReader(object):
                     m.data = reader.read(filename, assethandler=self._assethandler)
             elif g.tag == 'box':
                 m.shapeType = model.ShapeModel.SP_BOX
-                boxsize = [float(v) for v in re.split(' +', g.find('size').text.strip(' '))]
+                boxsize = self.readFloats(g.find('size'))
                 m.data = model.BoxData()
                 m.data.x = boxsize[0]
                 m.data.y = boxsize[1]
@@ -313,17 +416,17 @@ class SDFReader(object):
             diffuseset = False
             ambient = materiald.find('ambient')
             if ambient is not None:
-                material.ambient = numpy.array([float(v) for v in re.split(' +', ambient.text.strip(' '))])
+                material.ambient = numpy.array(self.readFloats(ambient))
             diffuse = materiald.find('diffuse')
             if diffuse is not None:
-                material.diffuse = numpy.array([float(v) for v in re.split(' +', diffuse.text.strip(' '))])
+                material.diffuse = numpy.array(self.readFloats(diffuse))
                 diffuseset = True
             specular = materiald.find('specular')
             if specular is not None:
-                material.specular = numpy.array([float(v) for v in re.split(' +', specular.text.strip(' '))])
+                material.specular = numpy.array(self.readFloats(specular))
             emission = materiald.find('emission')
             if emission is not None:
-                material.emission = numpy.array([float(v) for v in re.split(' +', emission.text.strip(' '))])
+                material.emission = numpy.array(self.readFloats(emission))
             if diffuseset == False:
                 if emission is not None:
                     material.diffuse = material.emission
@@ -353,12 +456,13 @@ class SDFWriter(object):
         Write simulation model in SDF format
         '''
         # render the data structure using template
+        import jinja2
         loader = jinja2.PackageLoader(self.__module__, 'template')
         env = jinja2.Environment(loader=loader)
 
         # render mesh data to each separate collada file
-        cwriter = collada.ColladaWriter()
-        swriter = stl.STLWriter()
+        cwriter = formats.find('collada').meshwriter()
+        swriter = formats.find('stl').meshwriter()
         dirname = os.path.dirname(f)
         fpath, ext = os.path.splitext(f)
         if ext == '.world':
@@ -399,18 +503,34 @@ class SDFWriter(object):
             else:
                 self._sensorparentmap[s.parent] = [s]
 
+        # identical meshes refer to the files written first
+        store = asset.getstore(dirname)
+        exporter = asset.ExportPool(getattr(options, 'jobs', 1))
+        exports = {}
+        meshfiles = {}
+        for l in m.links:
+            for v in l.visuals:
+                if v.shapeType == model.ShapeModel.SP_MESH:
+                    key = ('dae+stl', asset.meshdigest(v.data))
+                    fname = exports.get(key) or store.find(key)
+                    if fname is None:
+                        fname = os.path.join(dirname, v.name + ".dae")
+                        exporter.submit(cwriter.write, v, fname)
+                        exporter.submit(swriter.write, v, os.path.splitext(fname)[0] + ".stl")
+                        exports[key] = fname
+                    meshfiles[v.name] = os.path.splitext(os.path.basename(fname))[0]
+        exporter.run()
+        for key, fname in exports.items():
+            store.add(key, fname)
+
         template = env.get_template('sdf.xml')
         with open(f, 'w') as ofile:
             ofile.write(template.render({
                 'model': m,
+                'meshfiles': meshfiles,
                 'jointparentmap': self._jointparentmap,
                 'sensorparentmap': self._sensorparentmap,
                 'ShapeModel': model.ShapeModel
             }))
 
-        for l in m.links:
-            for v in l.visuals:
-                if v.shapeType == model.ShapeModel.SP_MESH:
-                    cwriter.write(v, os.path.join(dirname, v.name + ".dae"))
-                    swriter.write(v, os.path.join(dirname, v.name + ".stl"))
 
@@ -1,7 +1,18 @@
+#define PY_SSIZE_T_CLEAN
 #include <Python.h>
 #include <string>
+#include <sstream>
+#include <vector>
+#include <cstdlib>
 #include <sdf/sdf.hh>
 
+#if PY_MAJOR_VERSION >= 3
+#define PyStr_FromString PyUnicode_FromString
+#define PyInt_FromLong PyLong_FromLong
+#else
+#define PyStr_FromString PyString_FromString
+#endif
+
 static PyObject *
 filter(PyObject *self, PyObject *args)
 {
@@ -10,25 +21,191 @@ filter(PyObject *self, PyObject *args)
     if (!PyArg_ParseTuple(args, "s", &filename))
         return NULL;
 
+    // libsdformat does not touch any python object, so we release the
+    // GIL while parsing to allow other threads to run concurrently
+    std::string path = filename;
+    std::string out;
+    bool ok;
+    Py_BEGIN_ALLOW_THREADS
     sdf::SDFPtr sdf(new sdf::SDF());
     sdf::init(sdf);
-    
-    char* homePath = getenv("HOME");
-    std::string home = homePath;
-    sdf::addURIPath("model://", home + "/.gazebo/models");
-    
-    if (!sdf::readFile(filename, sdf))
-      return NULL;
-    
-    std::string out = sdf->ToString();
-    
-    return Py_BuildValue("s", out.c_str());
+    ok = sdf::readFile(path, sdf);
+    if (ok)
+        out = sdf->ToString();
+    Py_END_ALLOW_THREADS
+
+    if (!ok) {
+        PyErr_Format(PyExc_IOError, "unable to read %s", filename);
+        return NULL;
+    }
+
+    return PyBytes_FromStringAndSize(out.data(), out.size());
+}
+
+// convert string value of the typed parameter to python object
+// (float tuple for pose and vectors, float, int or bool for scalars)
+static PyObject *
+convertValue(const std::string &type, const std::string &value)
+{
+    if (type == "pose" || type == "vector3" || type == "vector2d" ||
+        type == "vector2i" || type == "color" || type == "quaternion") {
+        std::vector<double> v;
+        std::istringstream is(value);
+        double d;
+        while (is >> d)
+            v.push_back(d);
+        PyObject *t = PyTuple_New(v.size());
+        for (size_t i = 0; i < v.size(); i++)
+            PyTuple_SET_ITEM(t, i, PyFloat_FromDouble(v[i]));
+        return t;
+    }
+    if (type == "double" || type == "float") {
+        return PyFloat_FromDouble(atof(value.c_str()));
+    }
+    if (type == "int" || type == "unsigned int") {
+        return PyInt_FromLong(atol(value.c_str()));
+    }
+    if (type == "bool") {
+        return PyBool_FromLong(value == "1" || value == "true");
+    }
+    Py_RETURN_NONE;
+}
+
+// intermediate tree of the element (built without holding the GIL)
+struct Node
+{
+    std::string tag;
+    std::vector<std::pair<std::string, std::string> > attrib;
+    bool hasValue;
+    std::string type;
+    std::string text;
+    std::vector<Node> children;
+};
+
+static void
+buildNode(sdf::ElementPtr elem, Node &node)
+{
+    node.tag = elem->GetName();
+    for (size_t i = 0; i < elem->GetAttributeCount(); i++) {
+        sdf::ParamPtr attr = elem->GetAttribute(i);
+        // same rule as sdf::Element::ToString
+        if (attr->GetSet() || attr->GetRequired())
+            node.attrib.push_back(std::make_pair(attr->GetKey(), attr->GetAsString()));
+    }
+    node.hasValue = false;
+    sdf::ElementPtr child = elem->GetFirstElement();
+    if (!child) {
+        sdf::ParamPtr value = elem->GetValue();
+        if (value) {
+            node.hasValue = true;
+            node.type = value->GetTypeName();
+            node.text = value->GetAsString();
+        }
+    }
+    while (child) {
+        node.children.push_back(Node());
+        buildNode(child, node.children.back());
+        child = child->GetNextElement("");
+    }
+}
+
+static PyObject *
+convertNode(const Node &node)
+{
+    PyObject *attrib = PyDict_New();
+    for (size_t i = 0; i < node.attrib.size(); i++) {
+        PyObject *v = PyStr_FromString(node.attrib[i].second.c_str());
+        PyDict_SetItemString(attrib, node.attrib[i].first.c_str(), v);
+        Py_DECREF(v);
+    }
+    PyObject *text;
+    PyObject *value;
+    if (node.hasValue) {
+        text = PyStr_FromString(node.text.c_str());
+        value = convertValue(node.type, node.text);
+    } else {
+        Py_INCREF(Py_None);
+        text = Py_None;
+        Py_INCREF(Py_None);
+        value = Py_None;
+    }
+    PyObject *children = PyList_New(node.children.size());
+    for (size_t i = 0; i < node.children.size(); i++)
+        PyList_SET_ITEM(children, i, convertNode(node.children[i]));
+    return Py_BuildValue("(sNNNN)", node.tag.c_str(), attrib, text, value, children);
+}
+
+static PyObject *
+tree(PyObject *self, PyObject *args)
+{
+    const char *filename;
+
+    if (!PyArg_ParseTuple(args, "s", &filename))
+        return NULL;
+
+    std::string path = filename;
+    Node root;
+    bool ok;
+    Py_BEGIN_ALLOW_THREADS
+    sdf::SDFPtr sdf(new sdf::SDF());
+    sdf::init(sdf);
+    ok = sdf::readFile(path, sdf);
+    if (ok)
+#if SDF_MAJOR_VERSION >= 3
+        buildNode(sdf->Root(), root);
+#else
+        buildNode(sdf->root, root);
+#endif
+    Py_END_ALLOW_THREADS
+
+    if (!ok) {
+        PyErr_Format(PyExc_IOError, "unable to read %s", filename);
+        return NULL;
+    }
+
+    return convertNode(root);
+}
+
+static PyObject *
+treestring(PyObject *self, PyObject *args)
+{
+    const char *data;
+    Py_ssize_t size;
+
+    if (!PyArg_ParseTuple(args, "s#", &data, &size))
+        return NULL;
+
+    // same as tree() but reads the document from the string (used for
+    // compressed files and members of the model archives)
+    std::string xml(data, size);
+    Node root;
+    bool ok;
+    Py_BEGIN_ALLOW_THREADS
+    sdf::SDFPtr sdf(new sdf::SDF());
+    sdf::init(sdf);
+    ok = sdf::readString(xml, sdf);
+    if (ok)
+#if SDF_MAJOR_VERSION >= 3
+        buildNode(sdf->Root(), root);
+#else
+        buildNode(sdf->root, root);
+#endif
+    Py_END_ALLOW_THREADS
+
+    if (!ok) {
+        PyErr_SetString(PyExc_IOError, "unable to read the string");
+        return NULL;
+    }
+
+    return convertNode(root);
 }
 
 static char ext_doc[] = "sdformat helper module\n";
 
 static PyMethodDef methods[] = {
-    {"filter", filter, METH_VARARGS, "filter SDF or URDF input"},
+    {"filter", filter, METH_VARARGS, "filter SDF or URDF input (returns bytes)"},
+    {"tree", tree, METH_VARARGS, "read SDF or URDF input as (tag, attrib, text, value, children) tuple"},
+    {"treestring", treestring, METH_VARARGS, "same as tree but read SDF or URDF document from the string"},
     {NULL, NULL, 0, NULL}
 };
 
@@ -56,6 +233,13 @@ initsimtranssdfhelper(void)
 #else
     m = Py_InitModule3("simtranssdfhelper", methods, ext_doc);
 #endif
+    // URI paths are global state of libsdformat, register them once here
+    // instead of on every call (which may run in parallel)
+    char* homePath = getenv("HOME");
+    if (homePath != NULL) {
+        std::string home = homePath;
+        sdf::addURIPath("model://", home + "/.gazebo/models");
+    }
 #if SDF_MAJOR_VERSION >= 3
     PyModule_AddStringConstant(m, "SDFVERSION", sdf::SDF::Version().c_str());
 #else
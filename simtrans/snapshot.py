@@ -0,0 +1,224 @@
+# -*- coding:utf-8 -*-
+
+"""Reader and writer for snapshot of the model data
+
+Snapshot stores the complete model data as read by the other readers,
+so that the heavy model is parsed once and converted to many formats
+quickly. The file consists of a magic string, a version, a JSON header
+describing the model objects and the raw array buffers (aligned to 64
+bytes), which are memory-mapped on load. Only the classes of
+simtrans.model are restored (no pickle is used).
+
+:Organization:
+ AIST
+
+Examples
+--------
+
+Write a model and read it back
+
+>>> import tempfile
+>>> b = model.BodyModel()
+>>> b.name = 'body'
+>>> l = model.LinkModel()
+>>> l.name = 'root'
+>>> s = model.ShapeModel()
+>>> s.shapeType = model.ShapeModel.SP_MESH
+>>> s.data = model.MeshData()
+>>> s.data.vertex = numpy.array([[0, 0, 0], [1, 0, 0], [0, 1, 0]], dtype=float)
+>>> s.data.vertex_index = numpy.array([[0, 1, 2]])
+>>> s.data.material = model.MaterialModel()
+>>> l.visuals = [s]
+>>> l.collisions = [s]
+>>> b.links.append(l)
+>>> fname = os.path.join(tempfile.mkdtemp(), 'body.snapshot')
+>>> SnapshotWriter().write(b, fname)
+>>> b2 = SnapshotReader().read(fname)
+>>> b2.name, b2.links[0].name
+('body', 'root')
+>>> b2.links[0].visuals[0].data.vertex.tolist() == s.data.vertex.tolist()
+True
+>>> b2.links[0].visuals[0] is b2.links[0].collisions[0]
+True
+>>> b2.links[0].inertia.tolist() == l.inertia.tolist()
+True
+
+Values other than the model data are not stored
+
+>>> l.name = object()
+>>> SnapshotWriter().write(b, fname)
+Traceback (most recent call last):
+    ...
+Exception: unable to store value of type object in snapshot
+"""
+
+from __future__ import absolute_import
+from . import model
+from . import utils
+from . import asset
+import os
+import json
+import struct
+import numpy
+
+
+MAGIC = 'SIMTRANS-SNAPSHOT'
+VERSION = 1
+ALIGNMENT = 64
+
+
+class SnapshotWriter(object):
+    '''
+    Snapshot writer class
+    '''
+    def __init__(self):
+        self._objects = []
+        self._ids = {}
+        self._arrays = []
+        self._length = 0
+
+    def write(self, m, f, options=None):
+        '''
+        Write model data in snapshot format
+        '''
+        self._objects = []
+        self._ids = {}
+        self._arrays = []
+        self._length = 0
+        pending = []
+        self.reference(m, pending)
+        while len(pending) > 0:
+            o = pending.pop()
+            attrs = {}
+            for k, v in sorted(vars(o).items()):
+                if not k.startswith('_'):
+                    attrs[k] = self.encode(v, pending)
+            self._objects[self._ids[id(o)][0]]['attrs'] = attrs
+        header = json.dumps({
+            'objects': self._objects,
+            'arrays': [a for a, data in self._arrays]
+        }, sort_keys=True, separators=(',', ':'))
+        offset = len(MAGIC) + 12 + len(header)
+        start = offset + (-offset % ALIGNMENT)
+        with utils.openfile(f, 'wb') as fd:
+            fd.write(MAGIC)
+            fd.write(struct.pack('<IQ', VERSION, len(header)))
+            fd.write(header)
+            fd.write('\0' * (start - offset))
+            for a, data in self._arrays:
+                fd.write(data)
+                fd.write('\0' * (-len(data) % ALIGNMENT))
+        self._objects = []
+        self._ids = {}
+        self._arrays = []
+
+    def reference(self, o, pending):
+        '''
+        Reference of the model object (shared objects are written once,
+        the object is kept in the table to keep its id unique)
+        '''
+        try:
+            return {'$obj': self._ids[id(o)][0]}
+        except KeyError:
+            pass
+        cls = type(o)
+        if getattr(model, cls.__name__, None) is not cls:
+            raise Exception('unable to store object of type %s in snapshot' % cls.__name__)
+        index = len(self._objects)
+        self._objects.append({'class': cls.__name__})
+        self._ids[id(o)] = (index, o)
+        pending.append(o)
+        return {'$obj': index}
+
+    def encode(self, v, pending):
+        if v is None or isinstance(v, (bool, int, long, float, basestring)):
+            return v
+        if isinstance(v, numpy.generic):
+            return v.item()
+        if isinstance(v, numpy.ndarray):
+            if v.dtype.hasobject:
+                return self.encode(v.tolist(), pending)
+            a = numpy.ascontiguousarray(v)
+            a = a.astype(a.dtype.newbyteorder('<'))
+            data = a.tobytes()
+            self._arrays.append(({'dtype': a.dtype.str, 'shape': list(a.shape), 'offset': self._length}, data))
+            self._length += len(data) + (-len(data) % ALIGNMENT)
+            return {'$array': len(self._arrays) - 1}
+        if isinstance(v, (list, tuple)):
+            return [self.encode(c, pending) for c in v]
+        if isinstance(v, dict):
+            return {'$dict': [[self.encode(k, pending), self.encode(c, pending)] for k, c in sorted(v.items())]}
+        if type(v).__module__ == model.__name__:
+            return self.reference(v, pending)
+        if isinstance(v, asset.AssetFuture):
+            # asset pipeline returns a future of the file name
+            return self.encode(v.result(), pending)
+        raise Exception('unable to store value of type %s in snapshot' % type(v).__name__)
+
+
+class SnapshotReader(object):
+    '''
+    Snapshot reader class
+    '''
+    def read(self, f, assethandler=None, options=None):
+        '''
+        Read model data in snapshot format
+        '''
+        with utils.openfile(f) as fd:
+            magic = fd.read(len(MAGIC))
+            if magic != MAGIC:
+                raise Exception('not a snapshot file: %s' % f)
+            version, length = struct.unpack('<IQ', fd.read(12))
+            if version != VERSION:
+                raise Exception('unsupported snapshot version %i (expected %i)' % (version, VERSION))
+            header = json.loads(fd.read(length))
+            offset = len(MAGIC) + 12 + length
+            offset += -offset % ALIGNMENT
+            if utils.isplainfile(f):
+                # copy on write to allow modification of the arrays
+                buf = numpy.memmap(f, dtype=numpy.uint8, mode='c').view(numpy.ndarray)
+            else:
+                fd.read(offset - fd.tell())
+                buf = numpy.frombuffer(bytearray(fd.read()), dtype=numpy.uint8)
+                offset = 0
+        arrays = []
+        for a in header['arrays']:
+            dtype = numpy.dtype(str(a['dtype']))
+            shape = tuple(a['shape'])
+            start = offset + a['offset']
+            count = reduce(lambda x, y: x * y, shape, 1)
+            arrays.append(buf[start:start + count * dtype.itemsize].view(dtype).reshape(shape))
+        objects = []
+        for o in header['objects']:
+            cls = getattr(model, o['class'], None)
+            if type(cls) is not type or cls.__module__ != model.__name__:
+                raise Exception('unknown class in snapshot: %s' % o['class'])
+            objects.append(cls.__new__(cls))
+
+        def decode(v):
+            if isinstance(v, list):
+                return [decode(c) for c in v]
+            if isinstance(v, dict):
+                if '$obj' in v:
+                    return objects[v['$obj']]
+                if '$array' in v:
+                    return arrays[v['$array']]
+                if '$dict' in v:
+                    return dict([(decode(k), decode(c)) for k, c in v['$dict']])
+            if isinstance(v, unicode):
+                try:
+                    return str(v)
+                except UnicodeEncodeError:
+                    pass
+            return v
+
+        dirname = os.path.dirname(os.path.abspath(f))
+        for o, d in zip(objects, header['objects']):
+            for k, v in d['attrs'].items():
+                setattr(o, str(k), decode(v))
+            if type(o) == model.MaterialModel and o.texture:
+                texture = os.path.join(dirname, o.texture)
+                if assethandler:
+                    texture = assethandler(texture)
+                o.texture = texture
+        return objects[0]
@@ -14,9 +14,11 @@ Requirements
 
 from __future__ import absolute_import
 from . import model
-from . import collada
+from . import formats
+from . import utils
 import numpy
 import os
+import shutil
 import subprocess
 import tempfile
 import logging
@@ -33,7 +35,14 @@ class STLReader(object):
         '''
         data = model.MeshData()
         #stl.MAX_COUNT = 1e10
-        p = stl.StlMesh(f)
+        if utils.isplainfile(f):
+            p = stl.StlMesh(f)
+        else:
+            # numpy-stl reads binary data only from the real file
+            with tempfile.NamedTemporaryFile(suffix='.stl') as tmp, utils.openfile(f) as fd:
+                shutil.copyfileobj(fd, tmp)
+                tmp.flush()
+                p = stl.StlMesh(tmp.name)
         npoints = p.v0.shape[0]
         idx = numpy.array(range(0, npoints))
         data.vertex = numpy.concatenate([p.v0, p.v1, p.v2])
@@ -52,10 +61,15 @@ class STLWriter(object):
         '''
         fd, daefile = tempfile.mkstemp(suffix='.dae')
         os.close(fd)
-        cwriter = collada.ColladaWriter()
+        cwriter = formats.find('collada').meshwriter()
         cwriter.write(m, daefile)
+        stlfile = f
+        if f.endswith('.gz'):
+            # meshlab output is compressed afterwards
+            fd, stlfile = tempfile.mkstemp(suffix='.stl')
+            os.close(fd)
         try:
-            output = subprocess.check_output(['xvfb-run', '-a', '-s', '-screen 0 800x600x24', 'meshlabserver', '-i', daefile, '-o', f], stderr=subprocess.STDOUT)
+            output = subprocess.check_output(['xvfb-run', '-a', '-s', '-screen 0 800x600x24', 'meshlabserver', '-i', daefile, '-o', stlfile], stderr=subprocess.STDOUT)
         except subprocess.CalledProcessError as e:
             logging.error("meshlabserver returned error: %s" % e.output)
             raise
@@ -64,3 +78,7 @@ class STLWriter(object):
             logging.error("$ sudo apt-get install xvfb meshlab")
             raise
         os.unlink(daefile)
+        if stlfile != f:
+            with open(stlfile, 'rb') as src, utils.openfile(f, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.unlink(stlfile)
@@ -22,6 +22,29 @@ Read URDF model data given the model file
 >>> r = URDFReader()
 >>> m = r.read('/tmp/atlas.urdf')
 
+Joint axis is kept in the joint frame when the joint origin is rotated
+
+>>> import tempfile, argparse
+>>> d = tempfile.mkdtemp()
+>>> with open(os.path.join(d, 'rotated.urdf'), 'w') as f:
+...     f.write('''<robot name="rotated">
+...  <link name="base"><inertial><mass value="1"/>
+...   <inertia ixx="1" ixy="0" ixz="0" iyy="1" iyz="0" izz="1"/></inertial></link>
+...  <link name="arm"><inertial><mass value="1"/>
+...   <inertia ixx="1" ixy="0" ixz="0" iyy="1" iyz="0" izz="1"/></inertial></link>
+...  <joint name="j1" type="revolute"><parent link="base"/><child link="arm"/>
+...   <origin xyz="0 0 1" rpy="0 0 1.5707963"/><axis xyz="2 0 0"/>
+...   <limit lower="-1" upper="1" effort="1" velocity="1"/></joint>
+... </robot>''')
+>>> options = argparse.Namespace(nativeurdf=True)
+>>> m = URDFReader().read(os.path.join(d, 'rotated.urdf'), options=options)
+>>> [j.axis.axis for j in m.joints if j.name == 'j1']
+[[1.0, 0.0, 0.0]]
+>>> URDFWriter().write(m, os.path.join(d, 'rotated2.urdf'))
+>>> m2 = URDFReader().read(os.path.join(d, 'rotated2.urdf'), options=options)
+>>> [j.axis.axis for j in m2.joints if j.name == 'j1']
+[[1.0, 0.0, 0.0]]
+
 Write simulation model in URDF format
 
 >>> from . import vrml
@@ -39,18 +62,17 @@ import lxml.etree
 import numpy
 import re
 import copy
+import collections
 import warnings
 with warnings.catch_warnings():
     warnings.simplefilter('ignore')
     from .thirdparty import transformations as tf
-import jinja2
-import uuid
 import subprocess
 import logging
 from . import model
-from . import collada
-from . import stl
+from . import formats
 from . import utils
+from . import asset
 from . import sdf
 
 
@@ -60,113 +82,191 @@ class URDFReader(object):
     '''
     def __init__(self):
         self._assethandler = None
+        self._basename = None
 
     def read(self, fname, assethandler=None, options=None):
         '''
         Read simulation model in urdf format
-        (internally convert to sdf using gz sdf utility)
+        (internally convert to sdf using libsdformat, or read the file
+        directly if libsdformat is not available or native reader is requested)
         '''
+        if sdf.simtranssdfhelper is None or (options is not None and getattr(options, 'nativeurdf', False)):
+            return self.read2(fname, assethandler, options)
         reader = sdf.SDFReader()
         m = reader.read(fname, assethandler)
         return m
 
     def read2(self, fname, assethandler=None, options=None):
-        """Read URDF model data given the model file
-        
-        ** [Deprecated] This function is currently broken but kept for historical reason **
-        ** (might be fixed if "gz sdf" command not work in some situation) **
-        
+        """Read URDF model data given the model file (without libsdformat)
+
+        The file is parsed in one pass by lxml iterparse and the absolute
+        positions of the links are computed by one traversal from the root
+        links. Unlike libsdformat, links connected by fixed joints are kept
+        as they are (not lumped to the parent link).
+
         :param fname: path of the file to read
         :param assethandler: asset handler (optional)
         :returns: model data
         :rtype: model.Model
 
         """
-        if assethandler is not None:
-            self._assethandler = assethandler
+        self._assethandler = assethandler
+        self._basename = os.path.basename(fname)
+        self._materials = {}
+        self._shapematerials = []
 
         bm = model.BodyModel()
-        d = lxml.etree.parse(open(utils.resolveFile(fname)))
-
-        for j in d.findall('joint'):
-            jm = model.JointModel()
-            # general property
-            jm.name = j.attrib['name']
-            jm.jointType = self.readJointType(j.attrib['type'])
-            origin = j.find('origin')
-            if origin is not None:
-                self.readOrigin(jm, origin)
-            axis = j.find('axis')
-            if axis is not None:
-                jm.axis = [float(v) for v in re.split(' +', axis.attrib['xyz'].strip(' '))]
-            jm.parent = j.find('parent').attrib['link']
-            jm.child = j.find('child').attrib['link']
-            # phisical property
-            dynamics = j.find('dynamics')
-            if dynamics is not None:
-                try:
-                    jm.damping = float(dynamics.attrib['damping'])
-                    jm.friction = float(dynamics.attrib['friction'])
-                except KeyError:
-                    pass
-            limit = j.find('limit')
-            if limit is not None:
-                try:
-                    jm.limit = [float(limit.attrib['upper']), float(limit.attrib['lower'])]
-                    velocity = float(limit.attrib['velocity'])
-                    jm.velocitylimit = [velocity, -velocity]
-                except KeyError:
-                    pass
-            bm.joints.append(jm)
-
-        for l in d.findall('link'):
-            # general information
-            lm = model.LinkModel()
-            lm.name = l.attrib['name']
-            # phisical property
-            inertial = l.find('inertial')
-            if inertial is not None:
-                lm.mass = float(inertial.find('mass').attrib['value'])
-                lm.centerofmass = [float(v) for v in re.split(' +', inertial.find('origin').attrib['xyz'].strip(' '))]
-                lm.inertia = self.readInertia(inertial.find('inertia'))
-            # visual property
-            lm.visuals = []
-            for v in l.findall('visual'):
-                lm.visuals.append(self.readShape(v))
-            # contact property
-            lm.collisions = []
-            for c in l.findall('collision'):
-                lm.collisions.append(self.readShape(c))
-            bm.links.append(lm)
+        with utils.openfile(utils.resolveFile(fname)) as fd:
+            for event, e in lxml.etree.iterparse(fd, events=('start', 'end')):
+                if event == 'start':
+                    if bm.name is None and e.getparent() is None:
+                        bm.name = e.attrib.get('name')
+                    continue
+                p = e.getparent()
+                if p is None or p.getparent() is not None:
+                    continue
+                if e.tag == 'link':
+                    lm = self.readLink(e)
+                    if lm.name != 'world':
+                        bm.links.append(lm)
+                elif e.tag == 'joint':
+                    bm.joints.append(self.readJoint(e))
+                elif e.tag == 'material':
+                    mm = self.readMaterial(e)
+                    self._materials[mm.name] = mm
+                # release the processed elements to keep the memory usage low
+                e.clear()
+                while e.getprevious() is not None:
+                    del p[0]
+
+        # materials may be referred before they are defined
+        for sm, mm in self._shapematerials:
+            if mm.name in self._materials and mm.diffuse is None and mm.texture is None:
+                mm = self._materials[mm.name]
+            if mm.diffuse is None:
+                mm.diffuse = model.MaterialModel().diffuse
+            if sm.shapeType != model.ShapeModel.SP_MESH:
+                sm.data.material = mm
+
+        self.convertChildren(bm)
+        return bm
 
-        self._linkmap = {}
+    def convertChildren(self, bm):
+        '''
+        Convert joint and link positions relative to the parent to absolute
+        positions (joint axis is kept in the joint frame)
+        '''
+        linkmap = {}
         for l in bm.links:
-            self._linkmap[l.name] = l
-
-        for r in utils.findroot(bm):
-            self._abslinks = {}
-            for c in utils.findchildren(bm, r):
-                logging.info("constructing tree from root joint: %s - > %s" % (c.parent, c.child))
-                self._abslinks[c.parent] = self._linkmap[c.parent]
-                self.convertChild(bm, c)
-            bm.links.extend(self._abslinks.values())
-        
-        return bm
+            linkmap[l.name] = l
+        topology = utils.Topology(bm)
+        queue = collections.deque()
+        for r in ['world'] + [l.name for l in bm.links if l.name not in topology.parents]:
+            queue.append((r, numpy.identity(4)))
+        visited = set()
+        while queue:
+            (name, parentmat) = queue.popleft()
+            if name in visited:
+                continue
+            visited.add(name)
+            for j in topology.findchildren(name):
+                relmat = j.getmatrix()
+                absmat = numpy.dot(parentmat, relmat)
+                axis = numpy.array(j.axis.axis, dtype=float)
+                if numpy.linalg.norm(axis) > 0:
+                    j.axis.axis = (axis / numpy.linalg.norm(axis)).tolist()
+                j.matrix = absmat
+                j.trans = None
+                j.rot = None
+                try:
+                    l = linkmap[j.child]
+                    l.matrix = absmat
+                    l.trans = None
+                    l.rot = None
+                except KeyError:
+                    logging.warn("link %s referenced by joint %s does not exist" % (j.child, j.name))
+                queue.append((j.child, absmat))
+
+    def readLink(self, d):
+        lm = model.LinkModel()
+        lm.name = d.attrib['name']
+        # phisical property
+        inertial = d.find('inertial')
+        if inertial is not None:
+            mass = inertial.find('mass')
+            if mass is not None:
+                lm.mass = float(mass.attrib['value'])
+            p = model.TransformationModel()
+            origin = inertial.find('origin')
+            if origin is not None:
+                self.readOrigin(p, origin)
+                lm.centerofmass = [float(v) for v in p.gettranslation()]
+            inertia = inertial.find('inertia')
+            if inertia is not None:
+                # convert to the link frame
+                R = p.getmatrix()[:3, :3]
+                lm.inertia = numpy.dot(numpy.dot(R, self.readInertia(inertia)), R.T)
+        # visual property
+        lm.visuals = []
+        for i, v in enumerate(d.findall('visual')):
+            lm.visuals.append(self.readShape(v, lm.name, i))
+        # contact property
+        lm.collisions = []
+        for i, c in enumerate(d.findall('collision')):
+            lm.collisions.append(self.readShape(c, lm.name, i))
+        return lm
+
+    def readJoint(self, d):
+        jm = model.JointModel()
+        # general property
+        jm.name = d.attrib['name']
+        jm.jointType = self.readJointType(d.attrib['type'])
+        origin = d.find('origin')
+        if origin is not None:
+            self.readOrigin(jm, origin)
+        jm.parent = d.find('parent').attrib['link']
+        jm.child = d.find('child').attrib['link']
+        jm.axis = model.AxisData()
+        jm.axis.axis = [1.0, 0.0, 0.0]
+        axis = d.find('axis')
+        if axis is not None:
+            jm.axis.axis = [float(v) for v in re.split(' +', axis.attrib['xyz'].strip(' '))]
+        # phisical property
+        dynamics = d.find('dynamics')
+        if dynamics is not None:
+            jm.axis.damping = float(dynamics.attrib.get('damping', 0))
+            jm.axis.friction = float(dynamics.attrib.get('friction', 0))
+        limit = d.find('limit')
+        if limit is not None:
+            if jm.jointType != model.JointModel.J_CONTINUOUS:
+                jm.axis.limit = [float(limit.attrib.get('upper', 0)), float(limit.attrib.get('lower', 0))]
+            try:
+                velocity = float(limit.attrib['velocity'])
+                jm.axis.velocitylimit = [velocity, -velocity]
+            except KeyError:
+                pass
+            try:
+                jm.axis.effortlimit = [float(limit.attrib['effort'])]
+            except KeyError:
+                pass
+        return jm
+
+    def readMaterial(self, d):
+        mm = model.MaterialModel()
+        mm.name = d.attrib.get('name')
+        mm.diffuse = None
+        color = d.find('color')
+        if color is not None:
+            mm.diffuse = [float(v) for v in re.split(' +', color.attrib['rgba'].strip(' '))]
+        texture = d.find('texture')
+        if texture is not None:
+            fname = utils.resolveFile(texture.attrib['filename'])
+            if self._assethandler:
+                mm.texture = self._assethandler(fname)
+            else:
+                mm.texture = fname
+        return mm
 
-    def convertChild(self, bm, l):
-        parent = self._abslinks[l.parent]
-        child = self._linkmap[l.child]
-        abschild = copy.deepcopy(child)
-        abschild.matrix = numpy.dot(parent.getmatrix(), child.getmatrix())
-        abschild.trans = None
-        abschild.rot = None
-        self._abslinks[l.child] = abschild
-        l.matrix = abschild.getmatrix()
-        l.trans = None
-        l.rot = None
-        for c in utils.findchildren(bm, l.child):
-            self.convertChild(bm, c)
-    
     def readOrigin(self, m, doc):
         try:
             m.trans = numpy.array([float(v) for v in re.split(' +', doc.attrib['xyz'].strip(' '))])
@@ -205,9 +305,9 @@ class URDFReader(object):
         inertia[2, 2] = float(d.attrib['izz'])
         return inertia
 
-    def readShape(self, d):
+    def readShape(self, d, linkname=None, index=0):
         sm = model.ShapeModel()
-        sm.name = 'shape-' + str(uuid.uuid1()).replace('-', '')
+        sm.name = utils.hashname('shape', self._basename, linkname, d.tag, index, lxml.etree.tostring(d))
         origin = d.find('origin')
         if origin is not None:
             self.readOrigin(sm, origin)
@@ -216,19 +316,15 @@ class URDFReader(object):
                 sm.shapeType = model.ShapeModel.SP_MESH
                 # print "reading mesh " + mesh.attrib['filename']
                 filename = utils.resolveFile(g.attrib['filename'])
-                fileext = os.path.splitext(filename)[1].lower()
-                if fileext == '.dae':
-                    reader = collada.ColladaReader()
-                else:
-                    reader = stl.STLReader()
+                reader = formats.meshreader(filename, 'stl')
                 sm.data = reader.read(filename, assethandler=self._assethandler)
                 try:
                     scales = [float(v) for v in re.split(' +', g.attrib['scale'].strip(' '))]
-                    if scales[0] != 0.0:
-                        d = model.MeshTransformData()
-                        d.matrix = tf.scale_matrix(scales[0])
-                        d.children = [sm.data]
-                        sm.data = d
+                    if scales != [1.0, 1.0, 1.0] and 0.0 not in scales:
+                        tm = model.MeshTransformData()
+                        tm.matrix = numpy.diag(scales[:3] + [1.0])
+                        tm.children = [sm.data]
+                        sm.data = tm
                 except KeyError:
                     pass
             elif g.tag == 'box':
@@ -243,12 +339,19 @@ class URDFReader(object):
                 sm.data = model.CylinderData()
                 sm.data.radius = float(g.attrib['radius'])
                 sm.data.height = float(g.attrib['length'])
+                # cylinder of urdf is along z axis while ours is along y axis
+                sm.matrix = numpy.dot(sm.getmatrix(), tf.rotation_matrix(numpy.pi/2, [1, 0, 0]))
+                sm.trans = None
+                sm.rot = None
             elif g.tag == 'sphere':
                 sm.shapeType = model.ShapeModel.SP_SPHERE
                 sm.data = model.SphereData()
                 sm.data.radius = float(g.attrib['radius'])
             else:
                 raise Exception('unsupported shape type: %s' % g.tag)
+        material = d.find('material')
+        if material is not None:
+            self._shapematerials.append((sm, self.readMaterial(material)))
         return sm
 
 
@@ -266,17 +369,31 @@ class URDFWriter(object):
 
         """
         # render the data structure using template
+        import jinja2
         loader = jinja2.PackageLoader(self.__module__, 'template')
         env = jinja2.Environment(loader=loader)
 
         # render mesh data to each separate collada file
-        cwriter = collada.ColladaWriter()
-        swriter = stl.STLWriter()
+        cwriter = formats.find('collada').meshwriter()
         dirname = os.path.dirname(f)
+        store = asset.getstore(dirname)
+        exporter = asset.ExportPool(getattr(options, 'jobs', 1))
+        exports = {}
+        self._meshfiles = {}
         for l in m.links:
             for v in l.visuals:
                 if v.shapeType == model.ShapeModel.SP_MESH:
-                    cwriter.write(v, os.path.join(dirname, m.name + "-" + v.name + ".dae"))
+                    # identical meshes refer to the file written first
+                    key = ('dae', asset.meshdigest(v.data))
+                    fname = exports.get(key) or store.find(key)
+                    if fname is None:
+                        fname = os.path.join(dirname, m.name + "-" + v.name + ".dae")
+                        exporter.submit(cwriter.write, v, fname)
+                        exports[key] = fname
+                    self._meshfiles[v.name] = os.path.basename(fname)
+        exporter.run()
+        for key, fname in exports.items():
+            store.add(key, fname)
             #for c in l.collisions:
             #    if c.shapeType == model.ShapeModel.SP_MESH:
             #        swriter.write(v, os.path.join(dirname, m.name + "-" + v.name + ".stl"))
@@ -295,23 +412,32 @@ class URDFWriter(object):
                     roots.append((r.child, "fixed"))
             else:
                 roots.append((root, "free"))
+        # sub-model of each root is rendered independently
         for r in roots:
             logging.info('writing model for %s' % r[0])
             if len(roots) == 1:
                 mfname = f
             else:
                 mfname = (m.name + "-" + r[0] + ".urdf").replace('::', '_')
-            self.renderchildren(m, r[0], r[1], os.path.join(dirname, mfname), template, options)
+            exporter.submit(self.renderchildren, m, r[0], r[1], os.path.join(dirname, mfname), template, options)
+        exporter.run()
 
     def convertchildren(self, mdata, pjoint):
-        plink = self._linkmap[pjoint.child]
-        for cjoint in utils.findchildren(mdata, pjoint.child):
+        topology = utils.Topology(mdata)
+        def childjoints(j):
+            ret = []
+            for c in topology.findchildren(j.child):
+                if c.child in self._linkmap:
+                    ret.append(c)
+                else:
+                    logging.warn("unable to find child link %s" % c.child)
+            return ret
+        for cjoint, pjoint2, depth, entering in utils.traverse(pjoint, childjoints):
+            if cjoint is pjoint or not entering:
+                continue
             logging.info('converting joint %s type %s' % (cjoint.name, cjoint.jointType))
-            try:
-                clink = self._linkmap[cjoint.child]
-            except KeyError:
-                logging.warn("unable to find child link %s" % cjoint.child)
-            pjointinv = numpy.linalg.pinv(pjoint.getmatrix())
+            clink = self._linkmap[cjoint.child]
+            pjointinv = numpy.linalg.pinv(pjoint2.getmatrix())
             cjointinv = numpy.linalg.pinv(cjoint.getmatrix())
             cjoint2 = copy.deepcopy(cjoint)
             cjoint2.matrix = numpy.dot(pjointinv, cjoint.getmatrix())
@@ -326,7 +452,6 @@ class URDFWriter(object):
                 clink2.translate(clink2.getmatrix())
             self._convertedjoints.append(cjoint2)
             self._convertedlinks.append(clink2)
-            self.convertchildren(mdata, cjoint)
 
     def renderchildren(self, mdata, root, jointtype, fname, template, options):
         self._convertedjoints = []
@@ -340,13 +465,16 @@ class URDFWriter(object):
         rootjoint.rot = None
         rootjoint.child = root
         self.convertchildren(mdata, rootjoint)
-        mdata.joints = self._convertedjoints
-        mdata.links = self._convertedlinks
-        mdata.links.append(rootlink)
-        with open(fname, 'w') as ofile:
+        # render the sub-model without modifying the model shared by the roots
+        submodel = copy.copy(mdata)
+        submodel.joints = self._convertedjoints
+        submodel.links = self._convertedlinks
+        submodel.links.append(rootlink)
+        with utils.openfile(fname, 'w') as ofile:
             ofile.write(template.render({
-                'model': mdata,
+                'model': submodel,
                 'options': options,
+                'meshfiles': self._meshfiles,
                 'ShapeModel': model.ShapeModel,
                 'JointModel': model.JointModel,
                 'tf': tf
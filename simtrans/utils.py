@@ -5,6 +5,14 @@ Miscellaneous utility functions
 """
 
 import os
+import re
+import io
+import gzip
+import tarfile
+import zipfile
+import hashlib
+import datetime
+import threading
 import subprocess
 import logging
 
@@ -22,6 +30,46 @@ def resolveFile(f):
     >>> resolveFile('model://PA10/pa10.main.wrl') == os.path.expandvars('$OPENHRP_MODEL_PATH/PA10/pa10.main.wrl')
     True
     '''
+    if f.count('://') == 0:
+        return f
+    key = (f, os.getcwd()) + tuple([os.environ.get(e) for e in _resolveenvs])
+    try:
+        return _resolvecache[key]
+    except KeyError:
+        pass
+    ff = _resolveFile(f)
+    if ff != f:
+        _resolvecache[key] = ff
+    return ff
+
+
+# environment variables which affect the result of resolveFile
+_resolveenvs = ['GAZEBO_MODEL_PATH', 'OPENHRP_MODEL_PATH', 'ROS_PACKAGE_PATH']
+_resolvecache = {}
+_packagecache = {}
+_packageindex = {}
+_modeldirindex = {}
+# opened model archives
+archiveexts = ['.tar.gz', '.tgz', '.tar.bz2', '.tar', '.zip']
+_archives = {}
+_archivelock = threading.Lock()
+
+
+def clearcache():
+    '''
+    Clear the caches used by resolveFile
+    '''
+    _resolvecache.clear()
+    _packagecache.clear()
+    _packageindex.clear()
+    _modeldirindex.clear()
+    with _archivelock:
+        for (m, a, names) in _archives.values():
+            a.close()
+        _archives.clear()
+
+
+def _resolveFile(f):
     logging.debug('resolveFile from %s' % f)
     try:
         if f.count('file://') > 0:
@@ -31,22 +79,30 @@ def resolveFile(f):
                 return ff
         if f.count('model://') > 0:
             fn = f.replace('model://', '')
-            paths = ['.', '~/.gazebo/models']
-            for env in ['GAZEBO_MODEL_PATH', 'OPENHRP_MODEL_PATH']:
-                try:
-                    paths.extend(os.environ[env].split(':'))
-                except KeyError:
-                    pass
-            for p in paths:
-                ff = os.path.expanduser(os.path.join(p, fn))
-                if os.path.exists(ff):
-                    logging.debug('resolveFile resolved to %s' % ff)
-                    return ff
+            top = fn.split('/', 1)[0]
+            for p in modelpaths():
+                p = os.path.expanduser(p)
+                names = listmodeldir(p)
+                if top in names:
+                    ff = os.path.join(p, fn)
+                    if os.path.exists(ff):
+                        logging.debug('resolveFile resolved to %s' % ff)
+                        return ff
+                # model archive (e.g. pr2.tar.gz containing pr2/model.sdf,
+                # or model.sdf at the top of the archive)
+                for ext in archiveexts:
+                    if top + ext not in names:
+                        continue
+                    for member in [fn, fn[len(top) + 1:]]:
+                        ff = os.path.join(p, top + ext, member).rstrip('/')
+                        if fileexists(ff):
+                            logging.debug('resolveFile resolved to %s' % ff)
+                            return ff
         if f.count('model://') > 0:
             f = f.replace('model://', 'package://')
         if f.count('package://') > 0:
             pkgname, pkgfile = f.replace('package://', '').split('/', 1)
-            ppath = subprocess.check_output(['rospack', 'find', pkgname]).rstrip()
+            ppath = findpackage(pkgname)
             logging.debug('resolveFile find package path %s' % ppath)
             ff = os.path.join(ppath, pkgfile)
             logging.debug('resolveFile resolved to %s' % ff)
@@ -57,6 +113,287 @@ def resolveFile(f):
     return f
 
 
+def splitarchive(f):
+    '''
+    Split path of the archive member to path of the archive and name of
+    the member (archive is None if the path does not go through an archive)
+
+    >>> import tempfile
+    >>> d = tempfile.mkdtemp()
+    >>> open(os.path.join(d, 'pr2.tar.gz'), 'w').close()
+    >>> splitarchive(os.path.join(d, 'pr2.tar.gz/pr2/model.sdf')) == (os.path.join(d, 'pr2.tar.gz'), 'pr2/model.sdf')
+    True
+    >>> splitarchive('/tmp/models/pr2/model.sdf')
+    (None, '/tmp/models/pr2/model.sdf')
+    '''
+    parts = f.split('/')
+    for i in range(len(parts) - 1):
+        if any([parts[i].endswith(e) for e in archiveexts]):
+            archive = '/'.join(parts[:i + 1])
+            if os.path.isfile(archive):
+                return (archive, '/'.join(parts[i + 1:]))
+    return (None, f)
+
+
+def _openarchive(archive):
+    # archive is kept open with the index of the members (until mtime of
+    # the archive changes)
+    mtime = os.stat(archive).st_mtime
+    try:
+        (m, a, names) = _archives[archive]
+        if m == mtime:
+            return (a, names)
+        a.close()
+    except KeyError:
+        pass
+    if archive.endswith('.zip'):
+        a = zipfile.ZipFile(archive)
+        names = frozenset(a.namelist())
+    else:
+        a = tarfile.open(archive)
+        names = frozenset([m.name for m in a.getmembers() if m.isfile()])
+    _archives[archive] = (mtime, a, names)
+    return (a, names)
+
+
+def _readmember(archive, member):
+    (a, names) = _openarchive(archive)
+    if member not in names:
+        raise IOError('%s is not found in %s' % (member, archive))
+    if isinstance(a, zipfile.ZipFile):
+        return a.read(member)
+    return a.extractfile(member).read()
+
+
+def fileexists(f):
+    '''
+    Check if the file or directory exists (also as a member of an archive)
+    '''
+    if os.path.exists(f):
+        return True
+    archive, member = splitarchive(f)
+    if archive is None:
+        return False
+    member = os.path.normpath(member)
+    with _archivelock:
+        names = _openarchive(archive)[1]
+    if member in names:
+        return True
+    # directory in the archive
+    return any([n.startswith(member + '/') for n in names])
+
+
+def isplainfile(f):
+    '''
+    Check if the file can be read by the path as it is (not compressed nor
+    a member of an archive)
+    '''
+    return not f.endswith('.gz') and splitarchive(f)[0] is None
+
+
+def openfile(f, mode='rb', raw=False):
+    '''
+    Open the file (".gz" files are decompressed or compressed on the fly,
+    members of tar or zip archive are read without extracting to the disk,
+    raw=True to read the compressed file as it is)
+
+    >>> import tempfile
+    >>> d = tempfile.mkdtemp()
+    >>> with openfile(os.path.join(d, 'a.wrl.gz'), 'w') as f:
+    ...     n = f.write('#VRML V2.0 utf8')
+    >>> openfile(os.path.join(d, 'a.wrl.gz')).read()
+    '#VRML V2.0 utf8'
+    >>> with tarfile.open(os.path.join(d, 'm.tar.gz'), 'w:gz') as t:
+    ...     t.add(os.path.join(d, 'a.wrl.gz'), 'm/a.wrl.gz')
+    >>> fileexists(os.path.join(d, 'm.tar.gz/m/a.wrl.gz'))
+    True
+    >>> openfile(os.path.join(d, 'm.tar.gz/m/a.wrl.gz')).read()
+    '#VRML V2.0 utf8'
+    '''
+    compressed = f.endswith('.gz') and not raw
+    if 'r' not in mode:
+        if compressed:
+            # header is fixed to make the output reproducible
+            mtime = int(os.environ.get('SOURCE_DATE_EPOCH', 0))
+            return gzip.GzipFile(f, 'wb', 6, mtime=mtime)
+        return open(f, mode)
+    archive, member = splitarchive(f)
+    if archive is None:
+        if compressed:
+            return gzip.GzipFile(f, 'rb')
+        return open(f, mode)
+    with _archivelock:
+        data = _readmember(archive, os.path.normpath(member))
+    fd = io.BytesIO(data)
+    if compressed:
+        return gzip.GzipFile(fileobj=fd, mode='rb')
+    return fd
+
+
+def splitext(f):
+    '''
+    Split extension of the file (".gz" suffix of the compressed file is
+    not counted as the extension)
+
+    >>> splitext('/tmp/model.wrl.gz')
+    ('/tmp/model', '.wrl')
+    >>> splitext('/tmp/model.dae')
+    ('/tmp/model', '.dae')
+    '''
+    if f.endswith('.gz'):
+        f = f[:-3]
+    return os.path.splitext(f)
+
+
+def modelpaths():
+    '''
+    List of the directories to search models referred by "model://"
+    '''
+    paths = ['.', '~/.gazebo/models']
+    for env in ['GAZEBO_MODEL_PATH', 'OPENHRP_MODEL_PATH']:
+        try:
+            paths.extend(os.environ[env].split(':'))
+        except KeyError:
+            pass
+    return paths
+
+
+def listmodeldir(p):
+    '''
+    List entries of the model directory (cached until mtime of the directory changes)
+
+    >>> import tempfile
+    >>> d = tempfile.mkdtemp()
+    >>> os.mkdir(os.path.join(d, 'box'))
+    >>> sorted(listmodeldir(d))
+    ['box']
+    >>> listmodeldir(os.path.join(d, 'notexist'))
+    frozenset([])
+    '''
+    try:
+        mtime = os.stat(p).st_mtime
+    except OSError:
+        return frozenset()
+    try:
+        (m, names) = _modeldirindex[p]
+        if m == mtime:
+            return names
+    except KeyError:
+        pass
+    try:
+        names = frozenset(os.listdir(p))
+    except OSError:
+        names = frozenset()
+    _modeldirindex[p] = (mtime, names)
+    return names
+
+
+def indexmodelpaths():
+    '''
+    Prebuild the index of all the model directories
+    '''
+    for p in modelpaths():
+        listmodeldir(os.path.expanduser(p))
+
+
+_packagename = re.compile(r'<name>\s*([^<\s]+)\s*</name>')
+
+
+def crawlpackages(rospackagepath):
+    '''
+    Find ROS packages under ROS_PACKAGE_PATH by reading package.xml
+    (same search rule as rospack, first one found takes precedence)
+
+    >>> import tempfile
+    >>> d = tempfile.mkdtemp()
+    >>> os.makedirs(os.path.join(d, 'src', 'mypkg'))
+    >>> open(os.path.join(d, 'src', 'mypkg', 'package.xml'), 'w').write('<package><name>my_pkg</name></package>')
+    >>> crawlpackages(d) == {'my_pkg': os.path.join(d, 'src', 'mypkg')}
+    True
+    '''
+    try:
+        return _packageindex[rospackagepath]
+    except KeyError:
+        pass
+    packages = {}
+    for root in rospackagepath.split(':'):
+        if root == '':
+            continue
+        for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+            if 'CATKIN_IGNORE' in filenames:
+                dirnames[:] = []
+                continue
+            name = None
+            if 'package.xml' in filenames:
+                try:
+                    with open(os.path.join(dirpath, 'package.xml')) as f:
+                        m = _packagename.search(f.read())
+                    if m:
+                        name = m.group(1)
+                except IOError:
+                    pass
+            elif 'manifest.xml' in filenames:
+                name = os.path.basename(dirpath)
+            if name is not None:
+                if name not in packages:
+                    packages[name] = dirpath
+                # packages are not nested
+                dirnames[:] = []
+                continue
+            if 'rospack_nosubdirs' in filenames:
+                dirnames[:] = []
+                continue
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+    _packageindex[rospackagepath] = packages
+    return packages
+
+
+def findpackage(pkgname):
+    '''
+    Find path of the ROS package
+    (use rospack command only if the package is not found by crawlpackages)
+    '''
+    rospackagepath = os.environ.get('ROS_PACKAGE_PATH', '')
+    try:
+        return _packagecache[(rospackagepath, pkgname)]
+    except KeyError:
+        pass
+    try:
+        ppath = crawlpackages(rospackagepath)[pkgname]
+    except KeyError:
+        ppath = subprocess.check_output(['rospack', 'find', pkgname]).rstrip()
+    _packagecache[(rospackagepath, pkgname)] = ppath
+    return ppath
+
+
+def hashname(prefix, *keys):
+    '''
+    Deterministic name derived from the keys (e.g. model path, link name and
+    content of the element), same input gives the same name on every run
+
+    >>> hashname('shape', 'robot.urdf', 'link1', 0) == hashname('shape', 'robot.urdf', 'link1', 0)
+    True
+    >>> hashname('shape', 'robot.urdf', 'link1', 0) == hashname('shape', 'robot.urdf', 'link1', 1)
+    False
+    '''
+    h = hashlib.sha1()
+    for k in keys:
+        h.update(str(k))
+        h.update('\0')
+    return prefix + '-' + h.hexdigest()[:16]
+
+
+def timestamp():
+    '''
+    Timestamp recorded in the output files (given by SOURCE_DATE_EPOCH
+    environment variable, unix epoch by default to make output reproducible)
+
+    >>> timestamp().year
+    1970
+    '''
+    return datetime.datetime.utcfromtimestamp(int(os.environ.get('SOURCE_DATE_EPOCH', 0)))
+
+
 def findroot(mdata):
     '''
     Find root link from parent to child relationships.
@@ -111,9 +448,10 @@ def findroot(mdata):
         except KeyError:
             pass
     peaks = [l[0] for l in sorted(links.items(), key=lambda x: x[1], reverse=True)]
+    topology = Topology(mdata)
     ret = []
     for p in peaks:
-        if hasopenlink(mdata, p):
+        if topology.hasopenlink(p):
             ret.append(p)
     for l in mdata.links:
         if not usedlinks.has_key(l.name):
@@ -132,11 +470,7 @@ def hasopenlink(mdata, linkname):
     >>> hasopenlink(m, 'l_gripper_l_parallel_link')
     False
     '''
-    for c in findchildren(mdata, linkname):
-        parents = [p.parent for p in findparent(mdata, c.child)]
-        if len(set(parents)) == 1:
-            return True
-    return False
+    return Topology(mdata).hasopenlink(linkname)
 
 
 def findchildren(mdata, linkname):
@@ -177,3 +511,83 @@ def findparent(mdata, linkname):
         if j.child == linkname:
             parents.append(j)
     return parents
+
+
+class Topology(object):
+    '''
+    Index of the parent to child relationships of the joints
+    (find children and parents of the link without scanning all the joints)
+
+    >>> from . import model
+    >>> m = model.BodyModel()
+    >>> for p, c in [('base', 'arm'), ('arm', 'hand'), ('base', 'leg')]:
+    ...     j = model.JointModel()
+    ...     j.name, j.parent, j.child = p + '-' + c, p, c
+    ...     m.joints.append(j)
+    >>> t = Topology(m)
+    >>> [j.child for j in t.findchildren('base')]
+    ['arm', 'leg']
+    >>> [j.parent for j in t.findparent('hand')]
+    ['arm']
+    >>> t.findchildren('hand')
+    []
+    '''
+    def __init__(self, mdata):
+        self.children = {}
+        self.parents = {}
+        for j in mdata.joints:
+            self.children.setdefault(j.parent, []).append(j)
+            self.parents.setdefault(j.child, []).append(j)
+
+    def findchildren(self, linkname):
+        '''
+        Find child joints connected to specified link
+        '''
+        return self.children.get(linkname, [])
+
+    def findparent(self, linkname):
+        '''
+        Find parent joints connected to specified link
+        '''
+        return self.parents.get(linkname, [])
+
+    def hasopenlink(self, linkname):
+        '''
+        Check if the link has open connection with neighboring links
+        '''
+        for c in self.findchildren(linkname):
+            parents = [p.parent for p in self.findparent(c.child)]
+            if len(set(parents)) == 1:
+                return True
+        return False
+
+
+def traverse(root, children):
+    '''
+    Walk the tree in depth first order using explicit stack (depth of the
+    tree is not limited by the recursion limit). Yields (node, parent, depth,
+    True) when entering the node and (node, parent, depth, False) after all
+    the descendants are visited. Nodes already visited are skipped.
+
+    >>> tree = {'a': ['b', 'd'], 'b': ['c']}
+    >>> [(n, e) for n, p, d, e in traverse('a', lambda n: tree.get(n, []))]
+    [('a', True), ('b', True), ('c', True), ('c', False), ('b', False), ('d', True), ('d', False), ('a', False)]
+    >>> [(n, p, d) for n, p, d, e in traverse('a', lambda n: tree.get(n, [])) if e]
+    [('a', None, 0), ('b', 'a', 1), ('c', 'b', 2), ('d', 'a', 1)]
+    >>> len(list(traverse(0, lambda n: [n + 1] if n < 5000 else [])))
+    10002
+    '''
+    visited = {}
+    stack = [(root, None, 0, True)]
+    while stack:
+        node, parent, depth, entering = stack.pop()
+        if not entering:
+            yield (node, parent, depth, False)
+            continue
+        if id(node) in visited:
+            continue
+        visited[id(node)] = node
+        yield (node, parent, depth, True)
+        stack.append((node, parent, depth, False))
+        for c in reversed(children(node)):
+            stack.append((c, node, depth + 1, True))
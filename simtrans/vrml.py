@@ -8,7 +8,7 @@
 Requirements
 ------------
 * numpy
-* omniorb-python
+* omniorb-python (optional, only used with the CORBA model loader)
 * jinja2 template engine
 
 Examples
@@ -19,6 +19,19 @@ Read vrml model data given the file path
 >>> r = VRMLReader()
 >>> m = r.read(os.path.expandvars('$OPENHRP_MODEL_PATH/closed-link-sample.wrl'))
 
+Load models concurrently with a pool of model loaders (each loader object is
+used by one thread at a time, stub loaders are used here)
+
+>>> class StubLoader(object):
+...     def clearData(self):
+...         pass
+...     def loadBodyInfo(self, f):
+...         return f
+>>> pool = ModelLoaderPool(loaders=[StubLoader(), StubLoader()])
+>>> from multiprocessing.pool import ThreadPool
+>>> ThreadPool(2).map(pool.loadBodyInfo, ['a.wrl', 'b.wrl', 'c.wrl'])
+['a.wrl', 'b.wrl', 'c.wrl']
+
 Write simulation model in VRML format
 
 >>> import subprocess
@@ -39,11 +52,15 @@ Write simulation model in VRML format
 
 from . import model
 from . import utils
+from . import vrmlparser
+from . import asset
 import os
 import sys
 import time
 import subprocess
 import atexit
+import threading
+import Queue
 import logging
 import warnings
 with warnings.catch_warnings():
@@ -52,19 +69,11 @@ with warnings.catch_warnings():
 import math
 import numpy
 import copy
-import jinja2
-import uuid
-try:
-    import CORBA
-    import CosNaming
-    import OpenHRP
-except ImportError:
-    print "Unable to find CORBA and OpenHRP library."
-    print "You can install the library by:"
-    print "$ sudo add-apt-repository ppa:hrg/daily"
-    print "$ sudo apt-get update"
-    print "$ sudo apt-get install openhrp openrtm-aist-python"
-    pass
+
+# CORBA libraries are imported on demand (see importcorba)
+CORBA = None
+CosNaming = None
+OpenHRP = None
 
 plist = []
 def terminator():
@@ -73,17 +82,157 @@ def terminator():
         p.terminate()
 atexit.register(terminator)
 
+_orb = None
+_loaderpool = None
+_loaderpoollock = threading.Lock()
+
+
+def importcorba():
+    '''
+    Import CORBA and OpenHRP libraries (returns False if not available)
+    '''
+    global CORBA, CosNaming, OpenHRP
+    if CORBA is None:
+        try:
+            import CORBA as corba
+            import CosNaming as cosnaming
+            import OpenHRP as openhrp
+        except ImportError:
+            return False
+        CosNaming = cosnaming
+        OpenHRP = openhrp
+        CORBA = corba
+    return True
+
+
+def getorb():
+    '''
+    Return process-wide CORBA ORB (initialized on the first call)
+    '''
+    global _orb
+    if _orb is None:
+        if not importcorba():
+            raise Exception('CORBA model loader is not available')
+        _orb = CORBA.ORB_init([sys.argv[0],
+                               "-ORBInitRef",
+                               "NameService=corbaloc::localhost:2809/NameService"],
+                              CORBA.ORB_ID)
+    return _orb
+
+
+def getloaderpool(size=1):
+    '''
+    Return process-wide pool of CORBA model loaders (with at least given size)
+    '''
+    global _loaderpool
+    with _loaderpoollock:
+        if _loaderpool is None or _loaderpool.size < size:
+            _loaderpool = ModelLoaderPool(size)
+        return _loaderpool
+
+
+class ModelLoaderPool(object):
+    '''
+    Pool of OpenHRP model loaders
+
+    The first loader is registered as "ModelLoader" and the others as
+    "ModelLoader-<n>" on the name service (loader processes are started if
+    they are not running), so that loadBodyInfo can be called from multiple
+    threads concurrently. Loader objects can also be given directly.
+    '''
+    def __init__(self, size=1, loaders=None, timeout=10.0):
+        self.timeout = timeout
+        self._queue = Queue.Queue()
+        if loaders is None:
+            loaders = [self.resolve(i) for i in range(size)]
+        self.size = len(loaders)
+        for l in loaders:
+            # loader caches the loaded models, clear them once per connection
+            l.clearData()
+            self._queue.put(l)
+
+    def loadBodyInfo(self, f):
+        '''
+        Load body information using one of the free loaders
+        '''
+        loader = self._queue.get()
+        try:
+            return loader.loadBodyInfo(f)
+        finally:
+            self._queue.put(loader)
+
+    def name(self, i):
+        if i == 0:
+            return "ModelLoader"
+        return "ModelLoader-%i" % i
+
+    def lookup(self, ns, name):
+        try:
+            obj = ns.resolve([CosNaming.NameComponent(name, "")])
+            if obj is None or obj._non_existent():
+                return None
+            return obj
+        except (CosNaming.NamingContext.NotFound, CORBA.TRANSIENT, CORBA.COMM_FAILURE, CORBA.OBJECT_NOT_EXIST):
+            return None
+
+    def resolve(self, i):
+        '''
+        Resolve i-th loader (start new openhrp-model-loader if not running)
+        '''
+        name = self.name(i)
+        nsobj = getorb().resolve_initial_references("NameService")
+        ns = nsobj._narrow(CosNaming.NamingContext)
+        obj = self.lookup(ns, name)
+        if obj is None:
+            logging.info("try running openhrp-model-loader as %s" % name)
+            # new loader always registers itself as "ModelLoader"
+            first = self.lookup(ns, self.name(0))
+            p = subprocess.Popen(["openhrp-model-loader"])
+            plist.append(p)
+            obj = self.probe(ns, p, first)
+            if i > 0:
+                ns.rebind([CosNaming.NameComponent(name, "")], obj)
+                if first is not None:
+                    ns.rebind([CosNaming.NameComponent(self.name(0), "")], first)
+            logging.info("resolved openhrp-model-loader as %s" % name)
+        return obj._narrow(OpenHRP.ModelLoader)
+
+    def probe(self, ns, p, old):
+        '''
+        Wait until the started loader gets ready (with exponential backoff)
+        '''
+        wait = 0.05
+        deadline = time.time() + self.timeout
+        while time.time() < deadline:
+            if p.poll() is not None:
+                raise Exception('openhrp-model-loader exited with code %i' % p.returncode)
+            obj = self.lookup(ns, self.name(0))
+            if obj is not None and (old is None or not obj._is_equivalent(old)):
+                return obj
+            time.sleep(wait)
+            wait = min(wait * 2, 1.0)
+        logging.error("unable to find openhrp-model-loader")
+        raise CosNaming.NamingContext.NotFound
+
+def toarray(seq, dtype, width):
+    '''
+    Convert sequence (CORBA sequence, list or numpy array) to N x width array
+    without copying through intermediate python lists
+    '''
+    if isinstance(seq, numpy.ndarray):
+        a = seq.astype(dtype, copy=False)
+    else:
+        a = numpy.fromiter(seq, dtype=dtype, count=len(seq))
+    return a.reshape(-1, width)
+
+
 class VRMLReader(object):
     '''
     VRML reader class
     '''
     def __init__(self):
-        self._orb = CORBA.ORB_init([sys.argv[0],
-                                    "-ORBInitRef",
-                                    "NameService=corbaloc::localhost:2809/NameService"],
-                                   CORBA.ORB_ID)
-        self._loader = None
-        self._ns = None
+        self._pyloader = None
+        self._shapetypes = vrmlparser
         self._model = None
         self._joints = []
         self._links = []
@@ -91,6 +240,7 @@ class VRMLReader(object):
         self._linknamemap['world'] = 'world'
         self._materials = []
         self._sensors = []
+        self._textures = {}
         self._assethandler = None
 
     def read(self, f, assethandler=None, options=None):
@@ -98,35 +248,21 @@ class VRMLReader(object):
         Read vrml model data given the file path
         '''
         self._assethandler = assethandler
-        try:
-            self.resolveModelLoader()
-            self._loader.clearData()
-        except (CosNaming.NamingContext.NotFound, CORBA.TRANSIENT):
-            logging.info("try running openhrp-model-loader")
-            plist.append(subprocess.Popen(["openhrp-model-loader"]))
-            for t in range(0, 6):
-                if t == 5:
-                    logging.error("unable to find openhrp-model-loader")
-                    raise CosNaming.NamingContext.NotFound
-                try:
-                    self.resolveModelLoader()
-                    self._loader.clearData()
-                except (CosNaming.NamingContext.NotFound, CORBA.TRANSIENT):
-                    time.sleep(1)
-                else:
-                    logging.info("resolved openhrp-model-loader")
-                    break
-        try:
-            self._model = self._loader.loadBodyInfo(f)
-        except CORBA.TRANSIENT:
-            logging.error('unable to connect to model loader corba service (is "openhrp-model-loader" running?)')
-            raise
+        if options is not None and getattr(options, 'corbaloader', False):
+            self._model = self.loadBodyInfoCORBA(f)
+            self._shapetypes = OpenHRP
+        else:
+            if self._pyloader is None:
+                self._pyloader = vrmlparser.ModelLoader()
+            self._model = self._pyloader.loadBodyInfo(f)
+            self._shapetypes = vrmlparser
         bm = model.BodyModel()
         bm.name = self._model._get_name()
         self._joints = []
         self._links = []
         self._materials = []
         self._sensors = []
+        self._textures = {}
         self._hrplinks = self._model._get_links()
         self._hrpshapes = self._model._get_shapes()
         self._hrpapperances = self._model._get_appearances()
@@ -178,6 +314,23 @@ class VRMLReader(object):
         bm.sensors = self._sensors
         return bm
 
+    def loadBodyInfoCORBA(self, f):
+        '''
+        Load body information using OpenHRP model loader (CORBA)
+        '''
+        if not importcorba():
+            logging.error("Unable to find CORBA and OpenHRP library.")
+            logging.error("You can install the library by:")
+            logging.error("$ sudo add-apt-repository ppa:hrg/daily")
+            logging.error("$ sudo apt-get update")
+            logging.error("$ sudo apt-get install openhrp openrtm-aist-python")
+            raise Exception('CORBA model loader is not available')
+        try:
+            return getloaderpool().loadBodyInfo(f)
+        except CORBA.TRANSIENT:
+            logging.error('unable to connect to model loader corba service (is "openhrp-model-loader" running?)')
+            raise
+
     def readLink(self, m):
         lm = model.LinkModel()
         if len(m.segments) > 0:
@@ -189,6 +342,7 @@ class VRMLReader(object):
         lm.centerofmass = numpy.array(m.centerOfMass)
         lm.inertia = numpy.array(m.inertia).reshape(3, 3)
         lm.visuals = []
+        lm.collisions = []
         for s in m.sensors:
             sm = model.SensorModel()
             sm.name = s.name
@@ -236,27 +390,27 @@ class VRMLReader(object):
             sm.name = lm.name + "-shape-%i" % s.shapeIndex
             sm.matrix = numpy.matrix(s.transformMatrix+[0, 0, 0, 1]).reshape(4, 4)
             sdata = self._hrpshapes[s.shapeIndex]
-            if sdata.primitiveType == OpenHRP.SP_MESH:
+            if sdata.primitiveType == self._shapetypes.SP_MESH:
                 sm.shapeType = model.ShapeModel.SP_MESH
                 sm.data = self.readMesh(sdata)
-            elif sdata.primitiveType == OpenHRP.SP_SPHERE and numpy.allclose(sm.matrix, numpy.identity(4)):
+            elif sdata.primitiveType == self._shapetypes.SP_SPHERE and numpy.allclose(sm.matrix, numpy.identity(4)):
                 sm.shapeType = model.ShapeModel.SP_SPHERE
                 sm.data = model.SphereData()
                 sm.data.radius = sdata.primitiveParameters[0]
-                sm.data.material = self._materials[sdata.appearanceIndex]
-            elif sdata.primitiveType == OpenHRP.SP_CYLINDER and numpy.allclose(sm.matrix, numpy.identity(4)):
+                sm.data.material = self.getMaterial(sdata)
+            elif sdata.primitiveType == self._shapetypes.SP_CYLINDER and numpy.allclose(sm.matrix, numpy.identity(4)):
                 sm.shapeType = model.ShapeModel.SP_CYLINDER
                 sm.data = model.CylinderData()
                 sm.data.radius = sdata.primitiveParameters[0]
                 sm.data.height = sdata.primitiveParameters[1]
-                sm.data.material = self._materials[sdata.appearanceIndex]
-            elif sdata.primitiveType == OpenHRP.SP_BOX and numpy.allclose(sm.matrix, numpy.identity(4)):
+                sm.data.material = self.getMaterial(sdata)
+            elif sdata.primitiveType == self._shapetypes.SP_BOX and numpy.allclose(sm.matrix, numpy.identity(4)):
                 sm.shapeType = model.ShapeModel.SP_BOX
                 sm.data = model.BoxData()
                 sm.data.x = sdata.primitiveParameters[0]
                 sm.data.y = sdata.primitiveParameters[1]
                 sm.data.z = sdata.primitiveParameters[2]
-                sm.data.material = self._materials[sdata.appearanceIndex]
+                sm.data.material = self.getMaterial(sdata)
             else:
                 # raise Exception('unsupported shape primitive: %s' % sdata.primitiveType)
                 sm.shapeType = model.ShapeModel.SP_MESH
@@ -265,48 +419,62 @@ class VRMLReader(object):
             lm.collisions.append(sm)
         return lm
 
+    def getMaterial(self, sdata):
+        materialIndex = self._hrpapperances[sdata.appearanceIndex].materialIndex
+        if materialIndex >= 0:
+            return self._materials[materialIndex]
+        return None
+
     def readMesh(self, sdata):
         data = model.MeshData()
-        data.vertex = numpy.array(sdata.vertices).reshape(len(sdata.vertices)/3, 3)
-        data.vertex_index = numpy.array(sdata.triangles).reshape(len(sdata.triangles)/3, 3)
+        data.vertex = toarray(sdata.vertices, float, 3)
+        data.vertex_index = toarray(sdata.triangles, int, 3)
         adata = self._hrpapperances[sdata.appearanceIndex]
-        if adata.normalPerVertex is True:
-            data.normal = numpy.array(adata.normals).reshape(len(adata.normals)/3, 3)
+        if len(adata.normals) == 0:
+            data.creaseangle = adata.creaseAngle
+        elif adata.normalPerVertex is True:
+            data.normal = toarray(adata.normals, float, 3)
             if len(adata.normalIndices) > 0:
-                data.normal_index = numpy.array(adata.normalIndices).reshape(len(adata.normalIndices)/3, 3)
+                data.normal_index = toarray(adata.normalIndices, int, 3)
             else:
                 data.normal_index = data.vertex_index
         else:
-            data.normal = numpy.array(adata.normals).reshape(len(adata.normals)/3, 3)
+            data.normal = toarray(adata.normals, float, 3)
             if len(adata.normalIndices) > 0:
-                idx = []
-                for i in adata.normalIndices:
-                    idx.append(i)
-                    idx.append(i)
-                    idx.append(i)
-                data.normal_index = numpy.array(idx).reshape(len(idx)/3, 3)
+                idx = toarray(adata.normalIndices, int, 1)
             else:
-                idx = []
-                for i in range(0, len(adata.normals)/3):
-                    idx.append(i)
-                    idx.append(i)
-                    idx.append(i)
-                data.normal_index = numpy.array(idx).reshape(len(idx)/3, 3)
+                idx = numpy.arange(len(data.normal)).reshape(-1, 1)
+            data.normal_index = numpy.repeat(idx, 3, axis=1)
 #        if len(data.vertex_index) != len(data.normal_index):
 #            raise Exception('vertex length and normal length not match')
         if adata.materialIndex >= 0:
             data.material = self._materials[adata.materialIndex]
         if data.material is not None and adata.textureIndex >= 0:
-            fname = self._hrptextures[adata.textureIndex].url
-            if self._assethandler:
-                data.material.texture = self._assethandler(fname)
-            else:
-                data.material.texture = fname
-            data.uvmap = numpy.array(adata.textureCoordinate).reshape(len(adata.textureCoordinate)/2, 2)
-            data.uvmap_index = numpy.array(adata.textureCoordIndices).reshape(len(adata.textureCoordIndices)/3, 3)
+            data.material.texture = self.readTexture(adata.textureIndex)
+            data.uvmap = toarray(adata.textureCoordinate, float, 2)
+            data.uvmap_index = toarray(adata.textureCoordIndices, int, 3)
         return data
 
+    def readTexture(self, textureIndex):
+        # pass each texture to the asset handler only once
+        try:
+            return self._textures[textureIndex]
+        except KeyError:
+            pass
+        fname = self._hrptextures[textureIndex].url
+        if self._assethandler:
+            fname = self._assethandler(fname)
+        self._textures[textureIndex] = fname
+        return fname
+
     def readChild(self, parent, child):
+        # descendants are read using explicit stack (not limited by recursion depth)
+        jointmap = {id(parent): parent}
+        for c, p, depth, entering in utils.traverse(child, lambda l: [self._hrplinks[i] for i in l.childIndices]):
+            if entering:
+                jointmap[id(c)] = self.readJoint(jointmap[id(p) if p is not None else id(parent)], c)
+
+    def readJoint(self, parent, child):
         # first, create joint pairs
         jm = model.JointModel()
         jm.parent = parent.name
@@ -355,18 +523,141 @@ class VRMLReader(object):
         lm.trans = None
         lm.rot = None
         self._links.append(lm)
-        for c in child.childIndices:
-            self.readChild(jm, self._hrplinks[c])
+        return jm
 
-    def resolveModelLoader(self):
-        nsobj = self._orb.resolve_initial_references("NameService")
-        self._ns = nsobj._narrow(CosNaming.NamingContext)
-        try:
-            obj = self._ns.resolve([CosNaming.NameComponent("ModelLoader", "")])
-            self._loader = obj._narrow(OpenHRP.ModelLoader)
-        except CosNaming.NamingContext.NotFound:
-            logging.error("unable to resolve OpenHRP model loader on CORBA name service")
-            raise
+
+# normals of the mesh are omitted in compact mode only if the viewer
+# regenerates them within this angle (in radians) by the crease angle
+NORMAL_TOLERANCE = 0.01
+
+
+def creaseangle(m):
+    '''
+    Crease angle which regenerates the normals of the mesh (returns None
+    if the normals given to the mesh are not reproduced)
+
+    >>> m = model.MeshData()
+    >>> m.vertex = numpy.array([[x, y, z] for x in [-1, 1] for y in [-1, 1] for z in [-1, 1]])
+    >>> m.vertex_index = numpy.array([[0, 1, 3], [0, 3, 2], [4, 6, 7], [4, 7, 5], [0, 4, 5], [0, 5, 1],
+    ...                               [2, 3, 7], [2, 7, 6], [0, 2, 6], [0, 6, 4], [1, 5, 7], [1, 7, 3]])
+    >>> creaseangle(m) == math.pi
+    True
+    >>> m.normal, m.normal_index = m.generatenormals(0.5)
+    >>> creaseangle(m)
+    0.5
+    >>> m.normal = numpy.array(m.normal)
+    >>> m.normal[m.normal_index[0, 0]] = [0, 0, 1]
+    >>> creaseangle(m) is None
+    True
+    '''
+    if m.normal is None or m.normal_index is None or len(m.normal_index) == 0:
+        return m.creaseangle if m.creaseangle is not None else math.pi
+    index = numpy.asarray(m.normal_index, dtype=int)
+    if index.shape != numpy.shape(m.vertex_index) or index.ndim != 2 or index.shape[1] != 3:
+        return None
+    normal = numpy.asarray(m.normal, dtype=float).reshape(-1, 3)[index]
+    length = numpy.sqrt(numpy.sum(normal * normal, axis=2))
+    length[length == 0] = 1
+    normal = normal / length[:, :, numpy.newaxis]
+    # smooth and flat shaded meshes are tried if the angle is not given
+    angles = [m.creaseangle] if m.creaseangle is not None else [math.pi, 0.5]
+    for angle in angles:
+        generated, generatedindex = m.generatenormals(angle)
+        cos = numpy.sum(normal * generated[generatedindex], axis=2)
+        if numpy.all(cos >= math.cos(NORMAL_TOLERANCE)):
+            return angle
+    return None
+
+
+def numberformatter(digits):
+    '''
+    Finalizer of the template which rounds floats to given significant digits
+
+    >>> f = numberformatter(4)
+    >>> f(3.14159265), f(numpy.float32(0.1)), f(2), f('rotate')
+    ('3.142', '0.1', 2, 'rotate')
+    '''
+    fmt = '%%.%ig' % digits
+    def finalize(v):
+        if isinstance(v, (float, numpy.floating)):
+            return fmt % v
+        return v
+    return finalize
+
+
+def templateenvironment(options=None):
+    '''
+    Template environment of the VRML writers (floats are rounded in compact mode)
+    '''
+    import jinja2
+    loader = jinja2.PackageLoader(__name__, 'template')
+    finalize = None
+    if getattr(options, 'compact', False):
+        finalize = numberformatter(getattr(options, 'precision', None) or 6)
+    return jinja2.Environment(loader=loader, extensions=['jinja2.ext.do'], finalize=finalize)
+
+
+class NodeNames(object):
+    '''
+    Names of the nodes written more than once in compact mode (the first
+    occurrence is written with DEF and the others are replaced by USE,
+    nodes are identified by the key function)
+
+    >>> n = NodeNames('MESH', ['a', 'b', 'a'])
+    >>> n.use('a'), n.define('a'), n.use('a'), n.define('b')
+    (None, 'DEF MESH_0 ', 'MESH_0', '')
+    '''
+    def __init__(self, prefix, nodes, key=None):
+        self._prefix = prefix
+        self._key = key or (lambda n: n)
+        self._counts = {}
+        for n in nodes:
+            k = self._key(n)
+            self._counts[k] = self._counts.get(k, 0) + 1
+        self._names = {}
+
+    def use(self, node):
+        '''
+        Name of the node if it is already written (None otherwise)
+        '''
+        return self._names.get(self._key(node))
+
+    def define(self, node):
+        '''
+        DEF statement of the node if it is written more than once
+        '''
+        k = self._key(node)
+        if self._counts.get(k, 0) < 2:
+            return ''
+        name = '%s_%i' % (self._prefix, len(self._names))
+        self._names[k] = name
+        return 'DEF %s ' % name
+
+
+def rendermesh(template, name, data, options=None):
+    '''
+    Render mesh data using the vrml-mesh template
+    '''
+    compact = getattr(options, 'compact', False)
+    nodenames = None
+    if compact:
+        # shapes shared in the scenegraph are written once
+        meshes = []
+        stack = [data]
+        while stack:
+            c = stack.pop()
+            if hasattr(c, 'vertex'):
+                meshes.append(c)
+            stack.extend(getattr(c, 'children', []))
+        nodenames = NodeNames('MESH', meshes, key=id)
+    return template.render({
+        'name': name,
+        'ShapeModel': model.ShapeModel,
+        'mesh': {'children': [data]},
+        'normals': not compact or getattr(options, 'keepnormals', False),
+        'creaseangle': creaseangle,
+        'nodenames': nodenames
+    })
 
 
 class VRMLWriter(object):
@@ -384,9 +675,11 @@ class VRMLWriter(object):
         Write simulation model in VRML format
         '''
         self._options = options
-        fpath, fext = os.path.splitext(fname)
+        fpath, fext = utils.splitext(fname)
         basename = os.path.basename(fpath)
         dirname = os.path.dirname(fname)
+        # files written along with the main file are compressed as well
+        suffix = '.wrl.gz' if fname.endswith('.gz') else '.wrl'
         if mdata.name is None or mdata.name == '':
             mdata.name = basename
 
@@ -418,28 +711,35 @@ class VRMLWriter(object):
             for v in l.visuals:
                 if v.name in usednames:
                     v.name = l.name + "-visual"
-                    if v.name in usednames:
-                        v.name = l.name + "-visual-" + str(uuid.uuid1()).replace('-', '')
+                    n = 1
+                    while v.name in usednames:
+                        v.name = l.name + "-visual-%i" % n
+                        n += 1
                 usednames[v.name] = True
             for c in l.collisions:
                 if c.name in usednames:
                     c.name = l.name + "-collision"
-                    if c.name in usednames:
-                        c.name = l.name + "-collision-" + str(uuid.uuid1()).replace('-', '')
+                    n = 1
+                    while c.name in usednames:
+                        c.name = l.name + "-collision-%i" % n
+                        n += 1
                 usednames[c.name] = True
 
         # find root joint (including local peaks)
         self._roots = utils.findroot(mdata)
 
         # render the data structure using template
-        loader = jinja2.PackageLoader(self.__module__, 'template')
-        env = jinja2.Environment(loader=loader, extensions=['jinja2.ext.do'])
+        env = templateenvironment(options)
 
         self._linkmap['world'] = model.LinkModel()
         for m in mdata.links:
             self._linkmap[m.name] = m
 
         # render shape vrml file for each links
+        compact = getattr(options, 'compact', False)
+        store = asset.getstore(dirname)
+        exporter = asset.ExportPool(getattr(options, 'jobs', 1))
+        exports = {}
         shapefilemap = {}
         for l in mdata.links:
             shapes = copy.copy(l.visuals)
@@ -453,16 +753,22 @@ class VRMLWriter(object):
                     template = env.get_template('vrml-mesh.wrl')
                     if isinstance(v.data, model.MeshTransformData):
                         v.data.pretranslate()
-                    m = {}
-                    m['children'] = [v.data]
-                    shapefname = (mdata.name + "-" + l.name + "-" + v.name + ".wrl").replace('::', '_')
-                    with open(os.path.join(dirname, shapefname), 'w') as ofile:
-                        ofile.write(template.render({
-                            'name': v.name,
-                            'ShapeModel': model.ShapeModel,
-                            'mesh': m
-                        }))
+                    shapefname = (mdata.name + "-" + l.name + "-" + v.name + suffix).replace('::', '_')
+                    if compact:
+                        # identical meshes refer to the file written first
+                        key = ('wrl', getattr(options, 'precision', None), getattr(options, 'keepnormals', False), asset.meshdigest(v.data))
+                        f = exports.get(key) or store.find(key)
+                        if f is None:
+                            exporter.submit(self.writeshape, template, os.path.join(dirname, shapefname), v.name, v.data)
+                            exports[key] = os.path.join(dirname, shapefname)
+                        else:
+                            shapefname = os.path.basename(f)
+                    else:
+                        exporter.submit(self.writeshape, template, os.path.join(dirname, shapefname), v.name, v.data)
                     shapefilemap[v.name] = shapefname
+        exporter.run()
+        for key, f in exports.items():
+            store.add(key, f)
 
         # render main vrml file for each bodies
         template = env.get_template('vrml.wrl')
@@ -474,40 +780,56 @@ class VRMLWriter(object):
                     roots.append((r.child, "fixed"))
             else:
                 roots.append((root, "free"))
+        # sub-model of each root is rendered independently
         for r in roots:
             logging.info('writing model for %s' % r[0])
             if len(roots) == 1:
                 mfname = fname
             else:
-                mfname = (mdata.name + "-" + r[0] + ".wrl").replace('::', '_')
-            self.renderchildren(mdata, r[0], r[1], os.path.join(dirname, mfname), shapefilemap, template)
+                mfname = (mdata.name + "-" + r[0] + suffix).replace('::', '_')
+            exporter.submit(self.renderchildren, mdata, r[0], r[1], os.path.join(dirname, mfname), shapefilemap, template)
             modelfiles[mfname] = self._linkmap[r[0]]
-        
+        exporter.run()
+
         # render openhrp project
         template = env.get_template('openhrp-project.xml')
-        with open(fname.replace('.wrl', '-project.xml'), 'w') as ofile:
+        with open(fpath + '-project.xml', 'w') as ofile:
             ofile.write(template.render({
                 'models': modelfiles,
             }))
 
         # render choreonoid project
         template = env.get_template('choreonoid-project.yaml')
-        with open(fname.replace('.wrl', '-project.cnoid'), 'w') as ofile:
+        with open(fpath + '-project.cnoid', 'w') as ofile:
             ofile.write(template.render({
                 'models': modelfiles,
             }))
 
+    def writeshape(self, template, fname, name, data):
+        with utils.openfile(fname, 'w') as ofile:
+            ofile.write(rendermesh(template, name, data, self._options))
+
     def convertchildren(self, mdata, pjoint, joints, links):
-        children = []
-        plink = self._linkmap[pjoint.child]
-        for cjoint in utils.findchildren(mdata, pjoint.child):
-            nmodel = {}
-            try:
-                clink = self._linkmap[cjoint.child]
-            except KeyError:
-                logging.warning("unable to find child link %s" % cjoint.child)
-            (cchildren, joints, links) = self.convertchildren(mdata, cjoint, joints, links)
-            pjointinv = numpy.linalg.pinv(pjoint.getmatrix())
+        topology = utils.Topology(mdata)
+        def childjoints(j):
+            ret = []
+            for c in topology.findchildren(j.child):
+                if c.child in self._linkmap:
+                    ret.append(c)
+                else:
+                    logging.warning("unable to find child link %s" % c.child)
+            return ret
+        nmodels = {id(pjoint): {'children': []}}
+        for cjoint, pjoint2, depth, entering in utils.traverse(pjoint, childjoints):
+            if cjoint is pjoint:
+                continue
+            if not entering:
+                # joints are listed after their descendants
+                joints.append(cjoint.name)
+                links.append(cjoint.child)
+                continue
+            clink = self._linkmap[cjoint.child]
+            pjointinv = numpy.linalg.pinv(pjoint2.getmatrix())
             cjointinv = numpy.linalg.pinv(cjoint.getmatrix())
             cjoint2 = copy.deepcopy(cjoint)
             cjoint2.matrix = numpy.dot(pjointinv, cjoint.getmatrix())
@@ -522,14 +844,14 @@ class VRMLWriter(object):
                 clink2.mass = 0.001
             if not numpy.allclose(clink2.getmatrix(), numpy.identity(4)):
                 clink2.translate(clink2.getmatrix())
+            nmodel = {}
             nmodel['joint'] = cjoint2
             nmodel['jointtype'] = self.convertjointtype(cjoint.jointType)
             nmodel['link'] = clink2
-            nmodel['children'] = cchildren
-            children.append(nmodel)
-            joints.append(cjoint.name)
-            links.append(cjoint.child)
-        return (children, joints, links)
+            nmodel['children'] = []
+            nmodels[id(pjoint2)]['children'].append(nmodel)
+            nmodels[id(cjoint)] = nmodel
+        return (nmodels[id(pjoint)]['children'], joints, links)
 
     def renderchildren(self, mdata, root, jointtype, fname, shapefilemap, template):
         nmodel = {}
@@ -560,9 +882,24 @@ class VRMLWriter(object):
             jointmap[j] = jointcount
             jointcount = jointcount + 1
 
-        with open(fname, 'w') as ofile:
+        # joints are rendered flat (entering and leaving each of them) to
+        # avoid recursion in the template, indentation is limited to keep
+        # size of the output linear for very deep chains
+        nodes = [(n, min(depth, 32), entering) for n, p, depth, entering in utils.traverse(nmodel, lambda n: n['children'])]
+
+        # mesh files inlined more than once are loaded once in compact mode
+        nodenames = None
+        if getattr(self._options, 'compact', False):
+            urls = []
+            for l in mdata.links:
+                urls.extend([shapefilemap[v.name] for v in l.visuals + l.collisions if v.name in shapefilemap])
+            nodenames = NodeNames('INLINE', urls)
+
+        with utils.openfile(fname, 'w') as ofile:
             ofile.write(template.render({
                 'model': {'name':rootlink.name, 'children':[nmodel]},
+                'nodes': nodes,
+                'nodenames': nodenames,
                 'body': mdata,
                 'links': links,
                 'joints': joints,
@@ -599,22 +936,15 @@ class VRMLMeshWriter(object):
         '''
         Write mesh in VRML format
         '''
-        fpath, fext = os.path.splitext(fname)
+        fpath, fext = utils.splitext(fname)
         basename = os.path.basename(fpath)
         dirname = os.path.dirname(fname)
 
         # render the data structure using template
-        loader = jinja2.PackageLoader(self.__module__, 'template')
-        env = jinja2.Environment(loader=loader, extensions=['jinja2.ext.do'])
+        env = templateenvironment(options)
         template = env.get_template('vrml-mesh.wrl')
         if m.shapeType == model.ShapeModel.SP_MESH:
             if isinstance(m.data, model.MeshTransformData):
                 m.data.pretranslate()
-            nm = {}
-            nm['children'] = [m.data]
-            with open(fname, 'w') as ofile:
-                ofile.write(template.render({
-                    'name': basename,
-                    'ShapeModel': model.ShapeModel,
-                    'mesh': nm
-                }))
+            with utils.openfile(fname, 'w') as ofile:
+                ofile.write(rendermesh(template, basename, m.data, options))
@@ -0,0 +1,958 @@
+# -*- coding:utf-8 -*-
+
+"""Pure python VRML97 parser and model loader for OpenHRP models
+
+:Organization:
+ AIST
+
+Requirements
+------------
+* numpy
+
+Examples
+--------
+
+Parse VRML97 text into the node tree
+
+>>> nodes = parse('DEF T Transform { translation 1 0 0 children [ Shape { geometry Box { size 1 2 3 } } ] }')
+>>> nodes[0].type, nodes[0].name
+('Transform', 'T')
+>>> nodes[0].fields['translation']
+[1.0, 0.0, 0.0]
+>>> nodes[0].fields['children'][0].fields['geometry'].fields['size']
+[1.0, 2.0, 3.0]
+
+Numeric arrays are read into numpy at once
+
+>>> nodes = parse('Coordinate { point [ 0 0 0, 1 0 0, # comment\\n 0 1 0 ] }')
+>>> nodes[0].fields['point'].reshape(-1, 3).shape
+(3, 3)
+>>> nodes = parse('Coordinate { point [ # 3 vertices (see coordIndex[] below)\\n 0 0 0, 1 0 0, 0 1 0 ] }')
+>>> nodes[0].fields['point'].reshape(-1, 3).shape
+(3, 3)
+
+Load model data without the CORBA model loader (same interface as the
+BodyInfo of OpenHRP model loader)
+
+>>> l = ModelLoader()
+>>> b = l.loadBodyInfo(os.path.join(os.path.dirname(__file__), '../tests/simple_vehicle/valid.wrl'))
+>>> b._get_name()
+'SimpleVehicle'
+>>> [k.name for k in b._get_links()]
+['root', 'Steering', 'WheelC', 'WheelL', 'WheelR']
+>>> b._get_links()[0].childIndices
+[1, 3, 4]
+>>> [s.type for s in b._get_links()[0].sensors]
+['Vision']
+
+Fan triangulation of polygons (returns the positions in the index array and
+face number of each triangle)
+
+>>> pos, faces = triangulate([0, 1, 2, 3, -1, 4, 5, 6])
+>>> pos.tolist()
+[[0, 1, 2], [0, 2, 3], [5, 6, 7]]
+>>> faces.tolist()
+[0, 0, 1]
+"""
+
+import os
+import re
+import logging
+import warnings
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore')
+    from .thirdparty import transformations as tf
+import math
+import numpy
+from . import utils
+
+# shape types (same order as OpenHRP::ShapePrimitiveType)
+SP_MESH, SP_BOX, SP_CYLINDER, SP_CONE, SP_SPHERE, SP_PLANE = range(6)
+
+# separators are matched one by one (nested repetition of them backtracks
+# exponentially on long indentation)
+_token = re.compile(r'(?:[\s,]|#[^\n]*(?:\n|\Z))*(?:("(?:[^"\\]|\\.)*")|([\[\]{}])|([^\s,\[\]{}"#]+))', re.S)
+_arraystart = re.compile(r'(?:[\s,]|#[^\n]*(?:\n|\Z))*([-+.0-9\]])', re.S)
+_comment = re.compile(r'#[^\n]*')
+
+
+class Scanner(object):
+    '''
+    Tokenizer of VRML97 text
+    '''
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+        self._peek = None
+
+    def next(self):
+        if self._peek is not None:
+            t = self._peek
+            self._peek = None
+            return t
+        m = _token.match(self.text, self.pos)
+        if m is None:
+            self.pos = len(self.text)
+            return None
+        self.pos = m.end()
+        return m.group(m.lastindex)
+
+    def peek(self):
+        if self._peek is None:
+            self._peek = self.next()
+        return self._peek
+
+    def array(self):
+        '''
+        Read numeric array until the closing bracket at once
+        (returns None if the array is not numeric)
+        '''
+        m = _arraystart.match(self.text, self.pos)
+        if m is None:
+            return None
+        if m.group(1) == ']':
+            self.pos = m.end()
+            return []
+        # closing bracket in the comments does not end the array
+        pos = self.pos
+        while True:
+            end = self.text.find(']', pos)
+            if end < 0:
+                raise Exception('unexpected end of file')
+            c = self.text.find('#', pos, end)
+            if c < 0:
+                break
+            pos = self.text.find('\n', c)
+            if pos < 0:
+                raise Exception('unexpected end of file')
+        s = self.text[self.pos:end]
+        if '#' in s:
+            s = _comment.sub(' ', s)
+        self.pos = end + 1
+        return numpy.fromstring(s.replace(',', ' '), sep=' ')
+
+
+class Node(object):
+    '''
+    VRML node (field values are kept as they are parsed)
+    '''
+    __slots__ = ('type', 'name', 'fields')
+
+    def __init__(self, type, name, fields):
+        self.type = type
+        self.name = name
+        self.fields = fields
+
+
+def isnumber(t):
+    return t[0] in '0123456789+-.' or t in ('inf', 'nan')
+
+
+def unquote(t):
+    return t[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+
+
+class Parser(object):
+    '''
+    VRML97 parser
+
+    Nodes are parsed by an explicit stack (deep joint hierarchy does not
+    hit the recursion limit). Instances of PROTO are kept as nodes of the
+    PROTO name with the default values of the interface, PROTO bodies and
+    ROUTEs are skipped.
+    '''
+    def __init__(self):
+        self.protos = {}
+        self.defs = {}
+
+    def parse(self, text):
+        s = Scanner(text)
+        top = []
+        # frame: [kind, object, destination]
+        stack = [['top', top, None]]
+        while stack:
+            frame = stack[-1]
+            kind = frame[0]
+            t = s.next()
+            if t is None:
+                if kind != 'top':
+                    raise Exception('unexpected end of file')
+                break
+            if t == 'PROTO':
+                name = s.next()
+                if s.next() != '[':
+                    raise Exception('syntax error in PROTO %s' % name)
+                stack.append(['proto', {}, name])
+            elif t == 'EXTERNPROTO':
+                self.skipexternproto(s)
+            elif t == 'ROUTE':
+                s.next()
+                s.next()
+                s.next()
+            elif kind == 'node':
+                if t == '}':
+                    stack.pop()
+                    self.deliver(frame[1], frame[2])
+                elif t in ('eventIn', 'eventOut', 'field', 'exposedField'):
+                    s.next()
+                    name = s.next()
+                    if t in ('field', 'exposedField'):
+                        self.readvalue(s, stack, frame[1].fields, name)
+                else:
+                    self.readvalue(s, stack, frame[1].fields, t)
+            elif kind == 'proto':
+                if t == ']':
+                    stack.pop()
+                    self.skipblock(s)
+                    self.protos[frame[2]] = frame[1]
+                else:
+                    s.next()
+                    name = s.next()
+                    if t in ('field', 'exposedField'):
+                        self.readvalue(s, stack, frame[1], name)
+            else:
+                if t == ']' and kind == 'list':
+                    stack.pop()
+                    self.deliver(frame[1], frame[2])
+                elif t[0] == '"':
+                    frame[1].append(unquote(t))
+                elif t == 'TRUE' or t == 'FALSE':
+                    frame[1].append(t == 'TRUE')
+                elif isnumber(t):
+                    frame[1].append(float(t))
+                else:
+                    self.startnode(s, stack, t, (frame[1], None))
+        return top
+
+    def deliver(self, v, dest):
+        (container, key) = dest
+        if key is None:
+            container.append(v)
+        else:
+            container[key] = v
+
+    def readvalue(self, s, stack, fields, name):
+        t = s.next()
+        if t == '[':
+            a = s.array()
+            if a is not None:
+                fields[name] = a
+            else:
+                stack.append(['list', [], (fields, name)])
+        elif t[0] == '"':
+            fields[name] = unquote(t)
+        elif t == 'TRUE' or t == 'FALSE':
+            fields[name] = (t == 'TRUE')
+        elif t == 'IS':
+            s.next()
+        elif isnumber(t):
+            v = [float(t)]
+            while True:
+                t = s.peek()
+                if t is None or not isnumber(t):
+                    break
+                v.append(float(s.next()))
+            fields[name] = v
+        else:
+            self.startnode(s, stack, t, (fields, name))
+
+    def startnode(self, s, stack, t, dest):
+        if t == 'NULL':
+            self.deliver(None, dest)
+            return
+        if t == 'USE':
+            name = s.next()
+            try:
+                self.deliver(self.defs[name], dest)
+            except KeyError:
+                raise Exception('undefined node %s' % name)
+            return
+        name = None
+        if t == 'DEF':
+            name = s.next()
+            t = s.next()
+        if s.next() != '{':
+            raise Exception('syntax error near %s' % t)
+        n = Node(t, name, dict(self.protos.get(t, ())))
+        if name is not None:
+            self.defs[name] = n
+        stack.append(['node', n, dest])
+
+    def skipblock(self, s):
+        if s.next() != '{':
+            raise Exception('syntax error in PROTO body')
+        depth = 1
+        while depth > 0:
+            t = s.next()
+            if t is None:
+                raise Exception('unexpected end of file')
+            if t == '{':
+                depth += 1
+            elif t == '}':
+                depth -= 1
+
+    def skipexternproto(self, s):
+        name = s.next()
+        while s.next() != ']':
+            pass
+        if s.next() == '[':
+            while s.next() != ']':
+                pass
+        self.protos[name] = {}
+
+
+def parse(text):
+    '''
+    Parse VRML97 text and return list of the top level nodes
+    '''
+    return Parser().parse(text)
+
+
+def children(v):
+    '''
+    List of nodes of MFNode or SFNode field value
+    '''
+    if v is None:
+        return []
+    if isinstance(v, Node):
+        return [v]
+    return [c for c in v if isinstance(c, Node)]
+
+
+def getfloat(n, name, default):
+    try:
+        return float(n.fields[name][0])
+    except (KeyError, IndexError, TypeError):
+        return default
+
+
+def getfloats(n, name, default):
+    try:
+        v = n.fields[name]
+    except KeyError:
+        return list(default)
+    if isinstance(v, (str, bool)) or v is None:
+        return list(default)
+    return [float(f) for f in v]
+
+
+def getstring(n, name, default):
+    v = n.fields.get(name, default)
+    if isinstance(v, list) and len(v) > 0 and isinstance(v[0], str):
+        v = v[0]
+    if not isinstance(v, str):
+        return default
+    return v
+
+
+def getbool(n, name, default):
+    v = n.fields.get(name, default)
+    if isinstance(v, bool):
+        return v
+    return default
+
+
+def rotationmatrix(r):
+    if r[3] == 0 or numpy.linalg.norm(r[0:3]) == 0:
+        return numpy.identity(4)
+    return tf.rotation_matrix(r[3], r[0:3])
+
+
+def transformmatrix(n):
+    '''
+    Matrix of the Transform node (T * C * R * SR * S * -SR * -C)
+    '''
+    m = tf.translation_matrix(getfloats(n, 'translation', [0, 0, 0]))
+    c = getfloats(n, 'center', [0, 0, 0])
+    if c != [0, 0, 0]:
+        m = numpy.dot(m, tf.translation_matrix(c))
+    m = numpy.dot(m, rotationmatrix(getfloats(n, 'rotation', [0, 0, 1, 0])))
+    s = getfloats(n, 'scale', [1, 1, 1])
+    if s != [1, 1, 1]:
+        sr = rotationmatrix(getfloats(n, 'scaleOrientation', [0, 0, 1, 0]))
+        m = numpy.dot(m, sr)
+        m = numpy.dot(m, numpy.diag(s + [1]))
+        m = numpy.dot(m, sr.T)
+    if c != [0, 0, 0]:
+        m = numpy.dot(m, tf.translation_matrix(-numpy.array(c)))
+    return m
+
+
+def axisangle(m):
+    '''
+    Convert rotation matrix to [x, y, z, angle]
+    '''
+    angle, direction, point = tf.rotation_from_matrix(m)
+    return list(direction) + [angle]
+
+
+def triangulate(index):
+    '''
+    Fan triangulation of the polygons in VRML index array (vectorized)
+    '''
+    index = numpy.asarray(index, dtype=int)
+    if len(index) == 0 or index[-1] != -1:
+        index = numpy.append(index, -1)
+    ends = numpy.flatnonzero(index < 0)
+    starts = numpy.append(0, ends[:-1] + 1)
+    counts = numpy.maximum(ends - starts - 2, 0)
+    faces = numpy.repeat(numpy.arange(len(starts)), counts)
+    k = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts) + 1
+    first = starts[faces]
+    pos = numpy.column_stack((first, first + k, first + k + 1))
+    return pos, faces
+
+
+def boxmesh(x, y, z):
+    v = numpy.array([[-1, -1, -1], [1, -1, -1], [1, 1, -1], [-1, 1, -1],
+                     [-1, -1, 1], [1, -1, 1], [1, 1, 1], [-1, 1, 1]]) * [x/2, y/2, z/2]
+    t = numpy.array([[0, 2, 1], [0, 3, 2], [4, 5, 6], [4, 6, 7],
+                     [0, 1, 5], [0, 5, 4], [2, 3, 7], [2, 7, 6],
+                     [1, 2, 6], [1, 6, 5], [0, 4, 7], [0, 7, 3]])
+    return v, t
+
+
+def cylindermesh(radius, height, top=True, bottom=True, side=True, division=20, topradius=None):
+    '''
+    Mesh of cylinder (or cone if topradius is 0) along y-axis
+    '''
+    if topradius is None:
+        topradius = radius
+    a = numpy.linspace(0, 2 * math.pi, division, endpoint=False)
+    ring = numpy.column_stack((numpy.sin(a), numpy.zeros(division), numpy.cos(a)))
+    v = numpy.vstack((ring * radius + [0, -height/2, 0], ring * topradius + [0, height/2, 0],
+                      [[0, -height/2, 0], [0, height/2, 0]]))
+    i = numpy.arange(division)
+    j = (i + 1) % division
+    t = []
+    if side:
+        t.append(numpy.column_stack((i, j, j + division)))
+        t.append(numpy.column_stack((i, j + division, i + division)))
+    if bottom:
+        t.append(numpy.column_stack((numpy.repeat(2 * division, division), j, i)))
+    if top:
+        t.append(numpy.column_stack((numpy.repeat(2 * division + 1, division), i + division, j + division)))
+    if len(t) == 0:
+        return v, numpy.zeros((0, 3), dtype=int)
+    return v, numpy.vstack(t)
+
+
+def spheremesh(radius, division=20):
+    lat = numpy.linspace(0, math.pi, division / 2 + 1)[1:-1]
+    lon = numpy.linspace(0, 2 * math.pi, division, endpoint=False)
+    la, lo = numpy.meshgrid(lat, lon, indexing='ij')
+    v = numpy.column_stack((numpy.sin(la) * numpy.sin(lo), numpy.cos(la), numpy.sin(la) * numpy.cos(lo))).reshape(-1, 3)
+    v = numpy.vstack(([[0, 1, 0]], v, [[0, -1, 0]])) * radius
+    rows = len(lat)
+    i = numpy.arange(division)
+    j = (i + 1) % division
+    t = [numpy.column_stack((numpy.zeros(division, dtype=int), i + 1, j + 1))]
+    for r in range(rows - 1):
+        a = 1 + r * division
+        b = a + division
+        t.append(numpy.column_stack((a + i, b + i, b + j)))
+        t.append(numpy.column_stack((a + i, b + j, a + j)))
+    last = len(v) - 1
+    a = 1 + (rows - 1) * division
+    t.append(numpy.column_stack((numpy.repeat(last, division), a + j, a + i)))
+    return v, numpy.vstack(t)
+
+
+class BodyInfo(object):
+    '''
+    Body information (same interface as OpenHRP::BodyInfo)
+    '''
+    def __init__(self):
+        self.name = None
+        self.url = None
+        self.links = []
+        self.shapes = []
+        self.appearances = []
+        self.materials = []
+        self.textures = []
+        self.extraJoints = []
+
+    def _get_name(self):
+        return self.name
+
+    def _get_url(self):
+        return self.url
+
+    def _get_links(self):
+        return self.links
+
+    def _get_shapes(self):
+        return self.shapes
+
+    def _get_appearances(self):
+        return self.appearances
+
+    def _get_materials(self):
+        return self.materials
+
+    def _get_textures(self):
+        return self.textures
+
+    def _get_extraJoints(self):
+        return self.extraJoints
+
+
+class LinkInfo(object):
+    def __init__(self):
+        self.name = None
+        self.jointId = -1
+        self.jointType = ''
+        self.jointAxis = [0, 0, 1]
+        self.translation = [0, 0, 0]
+        self.rotation = [0, 0, 1, 0]
+        self.mass = 0.0
+        self.centerOfMass = [0, 0, 0]
+        self.inertia = [0] * 9
+        self.ulimit = []
+        self.llimit = []
+        self.uvlimit = []
+        self.lvlimit = []
+        self.climit = []
+        self.gearRatio = 1.0
+        self.torqueConst = 1.0
+        self.rotorInertia = 0.0
+        self.parentIndex = -1
+        self.childIndices = []
+        self.segments = []
+        self.sensors = []
+        self.shapeIndices = []
+
+
+class SegmentInfo(object):
+    def __init__(self):
+        self.name = None
+        self.mass = 0.0
+        self.centerOfMass = [0, 0, 0]
+        self.inertia = [0] * 9
+        self.transformMatrix = []
+
+
+class SensorInfo(object):
+    def __init__(self):
+        self.name = None
+        self.type = None
+        self.id = -1
+        self.translation = [0, 0, 0]
+        self.rotation = [0, 0, 1, 0]
+        self.specValues = []
+
+
+class ShapeInstanceInfo(object):
+    def __init__(self):
+        self.shapeIndex = -1
+        self.transformMatrix = []
+
+
+class ShapeInfo(object):
+    def __init__(self):
+        self.url = ''
+        self.primitiveType = SP_MESH
+        self.primitiveParameters = []
+        self.vertices = []
+        self.triangles = []
+        self.appearanceIndex = -1
+
+
+class AppearanceInfo(object):
+    def __init__(self):
+        self.materialIndex = -1
+        self.normals = []
+        self.normalIndices = []
+        self.normalPerVertex = True
+        self.solid = True
+        self.creaseAngle = 0.0
+        self.colors = []
+        self.colorIndices = []
+        self.colorPerVertex = True
+        self.textureIndex = -1
+        self.textureCoordinate = []
+        self.textureCoordIndices = []
+
+
+class MaterialInfo(object):
+    def __init__(self):
+        self.ambientIntensity = 0.2
+        self.diffuseColor = [0.8, 0.8, 0.8]
+        self.emissiveColor = [0, 0, 0]
+        self.shininess = 0.2
+        self.specularColor = [0, 0, 0]
+        self.transparency = 0.0
+
+
+class TextureInfo(object):
+    def __init__(self):
+        self.url = None
+
+
+class ExtraJointInfo(object):
+    def __init__(self):
+        self.name = None
+        self.jointType = None
+        self.axis = [0, 0, 1]
+        self.link = []
+        self.point = []
+
+
+_sensortypes = {
+    'VisionSensor': 'Vision',
+    'ForceSensor': 'Force',
+    'Gyro': 'RateGyro',
+    'AccelerationSensor': 'Acceleration',
+    'RangeSensor': 'Range',
+    'PressureSensor': 'Pressure',
+    'PhotoInterrupter': 'PhotoInterrupter',
+    'TorqueSensor': 'Torque'
+}
+
+_cameratypes = {
+    'NONE': 0,
+    'COLOR': 1,
+    'MONO': 2,
+    'DEPTH': 3,
+    'COLOR_DEPTH': 4,
+    'MONO_DEPTH': 5
+}
+
+_grouptypes = ('Group', 'Collision', 'Anchor', 'Billboard')
+
+
+class ModelLoader(object):
+    '''
+    Model loader which reads VRML97 model files of OpenHRP in process
+    (replacement of the CORBA model loader, parsed Inline files are cached)
+    '''
+    def __init__(self):
+        self._inlines = {}
+
+    def parseFile(self, fname):
+        fname = os.path.abspath(fname)
+        try:
+            return self._inlines[fname]
+        except KeyError:
+            pass
+        with utils.openfile(fname) as f:
+            nodes = Parser().parse(f.read())
+        self._inlines[fname] = nodes
+        return nodes
+
+    def loadBodyInfo(self, url):
+        '''
+        Load model file and return body information
+        '''
+        fname = utils.resolveFile(url)
+        nodes = self.parseFile(fname)
+        self._body = BodyInfo()
+        self._body.url = fname
+        self._shapemap = {}
+        self._materialmap = {}
+        self._texturemap = {}
+
+        roots = nodes
+        self._body.name = os.path.splitext(os.path.basename(fname))[0]
+        for n in nodes:
+            if n.type == 'Humanoid':
+                self._body.name = n.name or getstring(n, 'name', self._body.name)
+                roots = children(n.fields.get('humanoidBody'))
+                break
+        joints = [n for n in roots if n.type == 'Joint']
+        if len(joints) == 0:
+            raise Exception('unable to find root joint in %s' % fname)
+        self.readJoints(joints[0], os.path.dirname(fname))
+
+        for n in nodes:
+            if n.type == 'ExtraJoint':
+                self._body.extraJoints.append(self.readExtraJoint(n))
+        return self._body
+
+    def readJoints(self, root, basedir):
+        # depth first (pre-order) traversal as the CORBA model loader
+        stack = [(root, -1, None, basedir)]
+        while stack:
+            (n, parent, prefix, basedir) = stack.pop()
+            index = len(self._body.links)
+            link = self.readJoint(n, prefix)
+            link.parentIndex = parent
+            self._body.links.append(link)
+            if parent >= 0:
+                self._body.links[parent].childIndices.append(index)
+            childjoints = self.readJointChildren(n, link, basedir)
+            for (c, m, d) in reversed(childjoints):
+                stack.append((c, index, m, d))
+
+    def readJoint(self, n, prefix):
+        link = LinkInfo()
+        link.name = n.name or getstring(n, 'name', '')
+        link.jointId = int(getfloat(n, 'jointId', -1))
+        link.jointType = getstring(n, 'jointType', '')
+        axis = n.fields.get('jointAxis')
+        if isinstance(axis, str):
+            link.jointAxis = {'X': [1, 0, 0], 'Y': [0, 1, 0], 'Z': [0, 0, 1]}[axis.upper()]
+        else:
+            link.jointAxis = getfloats(n, 'jointAxis', [0, 0, 1])
+        link.translation = getfloats(n, 'translation', [0, 0, 0])
+        link.rotation = getfloats(n, 'rotation', [0, 0, 1, 0])
+        if prefix is not None:
+            m = numpy.dot(prefix, numpy.dot(tf.translation_matrix(link.translation), rotationmatrix(link.rotation)))
+            link.translation = m[0:3, 3].tolist()
+            link.rotation = axisangle(m)
+        for k in ('ulimit', 'llimit', 'uvlimit', 'lvlimit', 'climit'):
+            setattr(link, k, getfloats(n, k, []))
+        link.gearRatio = getfloat(n, 'gearRatio', 1.0)
+        link.torqueConst = getfloat(n, 'torqueConst', 1.0)
+        link.rotorInertia = getfloat(n, 'rotorInertia', 0.0)
+        return link
+
+    def readJointChildren(self, joint, link, basedir):
+        '''
+        Read segments, sensors and shapes of the joint and return the child joints
+        '''
+        childjoints = []
+        segments = []
+        identity = numpy.identity(4)
+        stack = [(c, identity, basedir) for c in reversed(children(joint.fields.get('children')))]
+        while stack:
+            (n, m, basedir) = stack.pop()
+            cs = []
+            if n.type == 'Joint':
+                childjoints.append((n, None if m is identity else m, basedir))
+            elif n.type == 'Segment':
+                segments.append((n, m))
+                cs = children(n.fields.get('children'))
+            elif n.type in _sensortypes:
+                link.sensors.append(self.readSensor(n, m))
+            elif n.type == 'Shape':
+                self.readShapeInstance(n, m, link, basedir)
+            elif n.type == 'Transform':
+                m = numpy.dot(m, transformmatrix(n))
+                cs = children(n.fields.get('children'))
+            elif n.type in _grouptypes:
+                cs = children(n.fields.get('children'))
+            elif n.type == 'Switch':
+                cs = children(n.fields.get('choice'))
+                choice = int(getfloat(n, 'whichChoice', -1))
+                cs = cs[choice:choice + 1] if choice >= 0 else []
+            elif n.type == 'LOD':
+                cs = children(n.fields.get('level'))[0:1]
+            elif n.type == 'Inline':
+                urls = n.fields.get('url', [])
+                if isinstance(urls, str):
+                    urls = [urls]
+                for u in urls:
+                    fname = self.resolveURL(u, basedir)
+                    if utils.fileexists(fname):
+                        basedir = os.path.dirname(fname)
+                        cs = self.parseFile(fname)
+                        break
+                else:
+                    logging.warn('unable to find inline file %s' % urls)
+            for c in reversed(cs):
+                stack.append((c, m, basedir))
+        self.readSegments(link, segments)
+        return childjoints
+
+    def resolveURL(self, u, basedir):
+        if u.find('://') >= 0:
+            return utils.resolveFile(u)
+        return os.path.join(basedir, u)
+
+    def readSegments(self, link, segments):
+        '''
+        Combine mass properties of the segments to the link
+        '''
+        mass = 0.0
+        mc = numpy.zeros(3)
+        props = []
+        for (n, m) in segments:
+            s = SegmentInfo()
+            s.name = n.name or getstring(n, 'name', '')
+            s.mass = getfloat(n, 'mass', 0.0)
+            s.centerOfMass = getfloats(n, 'centerOfMass', [0, 0, 0])
+            s.inertia = getfloats(n, 'momentsOfInertia', [0] * 9)
+            s.transformMatrix = m[0:3, :].flatten().tolist()
+            link.segments.append(s)
+            c = numpy.dot(m, s.centerOfMass + [1])[0:3]
+            mass += s.mass
+            mc += s.mass * c
+            props.append((s.mass, c, m[0:3, 0:3], numpy.array(s.inertia).reshape(3, 3)))
+        com = mc / mass if mass > 0 else numpy.zeros(3)
+        inertia = numpy.zeros((3, 3))
+        for (m, c, R, I) in props:
+            d = c - com
+            inertia += numpy.dot(numpy.dot(R, I), R.T) + m * (numpy.dot(d, d) * numpy.identity(3) - numpy.outer(d, d))
+        link.mass = mass
+        link.centerOfMass = com.tolist()
+        link.inertia = inertia.flatten().tolist()
+
+    def readSensor(self, n, m):
+        s = SensorInfo()
+        s.name = n.name or getstring(n, 'name', '')
+        s.type = _sensortypes[n.type]
+        s.id = int(getfloat(n, 'sensorId', -1))
+        s.translation = getfloats(n, 'translation', [0, 0, 0])
+        s.rotation = getfloats(n, 'rotation', [0, 0, 1, 0])
+        if not numpy.allclose(m, numpy.identity(4)):
+            p = numpy.dot(m, numpy.dot(tf.translation_matrix(s.translation), rotationmatrix(s.rotation)))
+            s.translation = p[0:3, 3].tolist()
+            s.rotation = axisangle(p)
+        if s.type == 'Vision':
+            s.specValues = [getfloat(n, 'frontClipDistance', 0.01),
+                            getfloat(n, 'backClipDistance', 10.0),
+                            getfloat(n, 'fieldOfView', 0.785398),
+                            _cameratypes.get(getstring(n, 'type', 'NONE'), 0),
+                            int(getfloat(n, 'width', 320)),
+                            int(getfloat(n, 'height', 240)),
+                            getfloat(n, 'frameRate', 30)]
+        elif s.type == 'Force':
+            s.specValues = getfloats(n, 'maxForce', [-1, -1, -1]) + getfloats(n, 'maxTorque', [-1, -1, -1])
+        elif s.type == 'RateGyro':
+            s.specValues = getfloats(n, 'maxAngularVelocity', [-1, -1, -1])
+        elif s.type == 'Acceleration':
+            s.specValues = getfloats(n, 'maxAcceleration', [-1, -1, -1])
+        elif s.type == 'Range':
+            s.specValues = [getfloat(n, 'scanAngle', math.pi),
+                            getfloat(n, 'scanStep', 0.1),
+                            getfloat(n, 'scanRate', 10),
+                            getfloat(n, 'maxDistance', 10)]
+        return s
+
+    def readShapeInstance(self, n, m, link, basedir):
+        try:
+            index = self._shapemap[id(n)]
+        except KeyError:
+            shape = self.readShape(n, basedir)
+            index = -1
+            if shape is not None:
+                index = len(self._body.shapes)
+                self._body.shapes.append(shape)
+            self._shapemap[id(n)] = index
+        if index >= 0:
+            si = ShapeInstanceInfo()
+            si.shapeIndex = index
+            si.transformMatrix = m[0:3, :].flatten().tolist()
+            link.shapeIndices.append(si)
+
+    def readShape(self, n, basedir):
+        g = n.fields.get('geometry')
+        if g is None:
+            return None
+        shape = ShapeInfo()
+        a = AppearanceInfo()
+        if g.type == 'IndexedFaceSet':
+            shape.primitiveType = SP_MESH
+            self.readFaceSet(g, shape, a)
+        elif g.type == 'Box':
+            shape.primitiveType = SP_BOX
+            shape.primitiveParameters = getfloats(g, 'size', [2, 2, 2])
+            v, t = boxmesh(*shape.primitiveParameters)
+        elif g.type == 'Cylinder':
+            shape.primitiveType = SP_CYLINDER
+            shape.primitiveParameters = [getfloat(g, 'radius', 1), getfloat(g, 'height', 2),
+                                         getbool(g, 'top', True), getbool(g, 'bottom', True), getbool(g, 'side', True)]
+            v, t = cylindermesh(*shape.primitiveParameters)
+        elif g.type == 'Cone':
+            shape.primitiveType = SP_CONE
+            shape.primitiveParameters = [getfloat(g, 'bottomRadius', 1), getfloat(g, 'height', 2),
+                                         getbool(g, 'bottom', True), getbool(g, 'side', True)]
+            (r, h, bottom, side) = shape.primitiveParameters
+            v, t = cylindermesh(r, h, False, bottom, side, topradius=0)
+        elif g.type == 'Sphere':
+            shape.primitiveType = SP_SPHERE
+            shape.primitiveParameters = [getfloat(g, 'radius', 1)]
+            v, t = spheremesh(shape.primitiveParameters[0])
+        else:
+            logging.warn('unsupported geometry type %s' % g.type)
+            return None
+        if shape.primitiveType != SP_MESH:
+            shape.vertices = v.flatten()
+            shape.triangles = t.flatten()
+        self.readAppearance(n.fields.get('appearance'), a, basedir)
+        shape.appearanceIndex = len(self._body.appearances)
+        self._body.appearances.append(a)
+        return shape
+
+    def readFaceSet(self, g, shape, a):
+        coord = g.fields.get('coord')
+        points = numpy.asarray(coord.fields.get('point', []) if coord is not None else [], dtype=float)
+        shape.vertices = points.flatten()
+        index = numpy.asarray(g.fields.get('coordIndex', []), dtype=int)
+        pos, faces = triangulate(index)
+        index = numpy.append(index, -1)
+        tri = index[pos]
+        ccw = getbool(g, 'ccw', True)
+        if not ccw:
+            tri = tri[:, [0, 2, 1]]
+            pos = pos[:, [0, 2, 1]]
+        shape.triangles = tri.flatten()
+        a.solid = getbool(g, 'solid', True)
+        a.creaseAngle = getfloat(g, 'creaseAngle', 0.0)
+        normal = g.fields.get('normal')
+        if normal is not None:
+            a.normals = numpy.asarray(normal.fields.get('vector', []), dtype=float).flatten()
+            a.normalPerVertex = getbool(g, 'normalPerVertex', True)
+            nindex = numpy.asarray(g.fields.get('normalIndex', []), dtype=int)
+            if a.normalPerVertex:
+                if len(nindex) > 0:
+                    a.normalIndices = numpy.append(nindex, -1)[pos].flatten()
+            else:
+                if len(nindex) > 0:
+                    a.normalIndices = nindex[faces]
+                else:
+                    a.normalIndices = faces
+        texcoord = g.fields.get('texCoord')
+        if texcoord is not None:
+            a.textureCoordinate = numpy.asarray(texcoord.fields.get('point', []), dtype=float).flatten()
+            tindex = numpy.asarray(g.fields.get('texCoordIndex', []), dtype=int)
+            if len(tindex) > 0:
+                a.textureCoordIndices = numpy.append(tindex, -1)[pos].flatten()
+            else:
+                a.textureCoordIndices = shape.triangles
+
+    def readAppearance(self, n, a, basedir):
+        if n is None:
+            return
+        m = n.fields.get('material')
+        if m is not None:
+            try:
+                a.materialIndex = self._materialmap[id(m)]
+            except KeyError:
+                mi = MaterialInfo()
+                mi.ambientIntensity = getfloat(m, 'ambientIntensity', 0.2)
+                mi.diffuseColor = getfloats(m, 'diffuseColor', [0.8, 0.8, 0.8])
+                mi.emissiveColor = getfloats(m, 'emissiveColor', [0, 0, 0])
+                mi.shininess = getfloat(m, 'shininess', 0.2)
+                mi.specularColor = getfloats(m, 'specularColor', [0, 0, 0])
+                mi.transparency = getfloat(m, 'transparency', 0.0)
+                a.materialIndex = len(self._body.materials)
+                self._materialmap[id(m)] = a.materialIndex
+                self._body.materials.append(mi)
+        t = n.fields.get('texture')
+        if t is not None and t.type == 'ImageTexture':
+            try:
+                a.textureIndex = self._texturemap[id(t)]
+            except KeyError:
+                ti = TextureInfo()
+                u = t.fields.get('url', [])
+                if isinstance(u, list):
+                    u = u[0] if len(u) > 0 else ''
+                ti.url = self.resolveURL(u, basedir)
+                a.textureIndex = len(self._body.textures)
+                self._texturemap[id(t)] = a.textureIndex
+                self._body.textures.append(ti)
+
+    def readExtraJoint(self, n):
+        j = ExtraJointInfo()
+        j.name = n.name or getstring(n, 'name', '')
+        j.jointType = getstring(n, 'jointType', 'xyz')
+        axis = n.fields.get('jointAxis')
+        if isinstance(axis, str):
+            j.axis = {'X': [1, 0, 0], 'Y': [0, 1, 0], 'Z': [0, 0, 1]}[axis.upper()]
+        else:
+            j.axis = getfloats(n, 'jointAxis', [0, 0, 1])
+        j.link = [getstring(n, 'link1Name', ''), getstring(n, 'link2Name', '')]
+        j.point = [getfloats(n, 'link1LocalPos', [0, 0, 0]), getfloats(n, 'link2LocalPos', [0, 0, 0])]
+        return j
@@ -7,7 +7,9 @@ import simtrans.collada
 import simtrans.urdf
 import simtrans.sdf
 import simtrans.vrml
+import simtrans.vrmlparser
 import simtrans.graphviz
+import simtrans.asset
 
 import logging
 logging.basicConfig(level=logging.DEBUG)
@@ -30,4 +32,6 @@ doctest.testmod(simtrans.collada)
 doctest.testmod(simtrans.urdf)
 doctest.testmod(simtrans.sdf)
 doctest.testmod(simtrans.vrml)
+doctest.testmod(simtrans.vrmlparser)
 doctest.testmod(simtrans.graphviz)
+doctest.testmod(simtrans.asset)
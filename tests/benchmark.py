@@ -0,0 +1,653 @@
+# -*- coding:utf-8 -*-
+
+"""Benchmarks for the performance sensitive parts of simtrans
+
+Run each benchmark by its name, e.g.:
+
+$ python -m tests.benchmark sdfhelper /tmp/atlas.urdf /tmp/pr2.urdf
+"""
+
+import os
+import sys
+import time
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from argparse import ArgumentParser, ArgumentError
+
+
+def timeit(func, *args):
+    start = time.time()
+    ret = func(*args)
+    return (time.time() - start, ret)
+
+
+def sdfhelper(files, options):
+    '''
+    Parse many URDF/SDF files at once with simtranssdfhelper
+    (serial and threaded, the threaded run is faster only if the GIL is released)
+    '''
+    import simtranssdfhelper
+    files = files * options.repeat
+    serial, docs = timeit(lambda: [simtranssdfhelper.filter(f) for f in files])
+    pool = ThreadPool(options.jobs)
+    try:
+        threaded, docs2 = timeit(pool.map, simtranssdfhelper.filter, files)
+    finally:
+        pool.close()
+        pool.join()
+    if docs != docs2:
+        raise Exception('threaded parse returned different result')
+    print 'parsed %i files' % len(files)
+    print 'serial:   %.3f sec' % serial
+    print 'threaded: %.3f sec (%i threads, %.2fx)' % (threaded, options.jobs, serial / threaded)
+
+
+def makechain(fname, n):
+    '''
+    Write synthetic URDF file with a chain of n links
+    '''
+    with open(fname, 'w') as f:
+        f.write('<robot name="chain">\n')
+        f.write('<material name="blue"><color rgba="0 0 0.8 1"/></material>\n')
+        for i in range(n):
+            f.write('''<link name="link%i">
+ <inertial><mass value="1.0"/><origin xyz="0 0 0.05" rpy="0 0 0"/>
+  <inertia ixx="0.01" ixy="0" ixz="0" iyy="0.01" iyz="0" izz="0.01"/></inertial>
+ <visual><origin xyz="0 0 0.05"/><geometry><cylinder radius="0.02" length="0.1"/></geometry>
+  <material name="blue"/></visual>
+ <collision><geometry><box size="0.04 0.04 0.1"/></geometry></collision>
+</link>
+''' % i)
+            if i > 0:
+                f.write('''<joint name="joint%i" type="revolute">
+ <parent link="link%i"/><child link="link%i"/>
+ <origin xyz="0 0 0.1" rpy="0 0 0.1"/><axis xyz="0 1 0"/>
+ <limit lower="-1.57" upper="1.57" effort="10" velocity="1"/>
+</joint>
+''' % (i, i - 1, i))
+        f.write('</robot>\n')
+
+
+def urdf(files, options):
+    '''
+    Read URDF files with the native reader and libsdformat
+    (a synthetic chain of 1000 links is used if no file is given)
+    '''
+    from simtrans import urdf, sdf
+    if len(files) == 0:
+        files = ['/tmp/simtrans-benchmark-chain.urdf']
+        makechain(files[0], 1000)
+    for f in files:
+        r = urdf.URDFReader()
+        t, m = timeit(lambda: [r.read2(f) for i in range(options.repeat)])
+        print '%s: %i links' % (f, len(m[0].links))
+        print 'native:     %.3f sec/read' % (t / options.repeat)
+        if sdf.simtranssdfhelper is not None:
+            t, m = timeit(lambda: [sdf.SDFReader().read(f) for i in range(options.repeat)])
+            print 'libsdformat: %.3f sec/read' % (t / options.repeat)
+
+
+def makebody(fname, n):
+    '''
+    Write synthetic Choreonoid body file with a tree of n links
+    '''
+    with open(fname, 'w') as f:
+        f.write('format: ChoreonoidBody\nformatVersion: 1.0\nangleUnit: degree\nname: tree\nrootLink: link0\n\nlinks:\n')
+        for i in range(n):
+            f.write('''  -
+    name: link%i
+    jointType: %s
+    translation: [ 0, 0, 0.1 ]
+    rotation: [ 0, 0, 1, 10 ]
+    jointAxis: Y
+    jointRange: [ -90, 90 ]
+    mass: 1.0
+    centerOfMass: [ 0, 0, 0.05 ]
+    inertia: [ 0.01, 0, 0, 0, 0.01, 0, 0, 0, 0.01 ]
+    elements:
+      Shape:
+        geometry: {type: Box, size: [ 0.04, 0.04, 0.1 ]}
+''' % (i, 'free' if i == 0 else 'revolute'))
+            if i > 0:
+                f.write('    parent: link%i\n' % ((i - 1) / 2))
+
+
+def cnoidbody(files, options):
+    '''
+    Read Choreonoid body files
+    (a synthetic tree of 1000 links is used if no file is given)
+    '''
+    from simtrans import cnoidbody
+    if len(files) == 0:
+        files = ['/tmp/simtrans-benchmark-tree.body']
+        makebody(files[0], 1000)
+    for f in files:
+        t, m = timeit(lambda: [cnoidbody.CnoidBodyReader().read(f) for i in range(options.repeat)])
+        print '%s: %i links' % (f, len(m[0].links))
+        print 'read: %.3f sec/read' % (t / options.repeat)
+
+
+def makevrml(fname, n, points=1000):
+    '''
+    Write synthetic OpenHRP VRML file with a chain of n joints
+    (each segment has a mesh with the given number of points)
+    '''
+    import numpy
+    with open(fname, 'w') as f:
+        f.write('''#VRML V2.0 utf8
+PROTO Joint [
+  exposedField SFVec3f translation 0 0 0
+  exposedField SFRotation rotation 0 0 1 0
+  exposedField MFNode children []
+  exposedField SFString jointType ""
+  exposedField SFInt32 jointId -1
+  exposedField SFVec3f jointAxis 0 0 1
+  exposedField MFFloat llimit []
+  exposedField MFFloat ulimit []
+] { Transform { translation IS translation rotation IS rotation children IS children } }
+PROTO Segment [
+  exposedField SFVec3f centerOfMass 0 0 0
+  exposedField SFFloat mass 0
+  exposedField MFFloat momentsOfInertia [ 0 0 0 0 0 0 0 0 0 ]
+  exposedField MFNode children []
+] { Group { children IS children } }
+PROTO Humanoid [
+  exposedField MFNode humanoidBody []
+  exposedField SFString name ""
+] { Group { children IS humanoidBody } }
+DEF chain Humanoid { humanoidBody [
+''')
+        v = numpy.random.rand(points, 3) * 0.1
+        idx = numpy.column_stack((numpy.random.randint(0, points, (points, 3)), -numpy.ones(points, dtype=int)))
+        vs = ', '.join(' '.join('%g' % x for x in p) for p in v)
+        ids = ' '.join(str(i) for i in idx.flatten())
+        for i in range(n):
+            f.write('''DEF J%i Joint { jointType "%s" jointId %i translation 0 0 0.1 jointAxis 0 1 0 ulimit [ 1.57 ] llimit [ -1.57 ]
+children [ DEF L%i Segment { mass 1 centerOfMass 0 0 0.05 momentsOfInertia [ 0.01 0 0 0 0.01 0 0 0 0.01 ]
+children [ Shape { appearance Appearance { material Material { diffuseColor 0.8 0.2 0.2 } }
+geometry IndexedFaceSet { coord Coordinate { point [ %s ] } coordIndex [ %s ] } } ] }
+''' % (i, 'free' if i == 0 else 'rotate', i - 1, i, vs, ids))
+        f.write(']}' * n)
+        f.write(''' ] }
+''')
+
+
+def vrml(files, options):
+    '''
+    Read VRML files with the builtin parser
+    (a synthetic chain of 300 joints is used if no file is given)
+    '''
+    from simtrans import vrml
+    if len(files) == 0:
+        files = ['/tmp/simtrans-benchmark-chain.wrl']
+        makevrml(files[0], 300)
+    for f in files:
+        t, m = timeit(lambda: [vrml.VRMLReader().read(f) for i in range(options.repeat)])
+        print '%s: %i links' % (f, len(m[0].links))
+        print 'read: %.3f sec/read' % (t / options.repeat)
+
+
+def snapshot(files, options):
+    '''
+    Read model files with the reader of the format and from the snapshot
+    (a synthetic VRML chain of 300 joints is used if no file is given)
+    '''
+    import tempfile
+    from simtrans import cli, snapshot
+    if len(files) == 0:
+        files = ['/tmp/simtrans-benchmark-chain.wrl']
+        makevrml(files[0], 300)
+    dirname = tempfile.mkdtemp()
+    for f in files:
+        t, m = timeit(lambda: [cli.read(f, None, options) for i in range(options.repeat)])
+        fname = os.path.join(dirname, os.path.basename(f) + '.snapshot')
+        w, r = timeit(snapshot.SnapshotWriter().write, m[0], fname)
+        s, m2 = timeit(lambda: [snapshot.SnapshotReader().read(fname) for i in range(options.repeat)])
+        print '%s: %i links' % (f, len(m[0].links))
+        print 'read:     %.3f sec/read' % (t / options.repeat)
+        print 'snapshot: %.3f sec/read, %.3f sec to write (%i bytes)' % (s / options.repeat, w, os.path.getsize(fname))
+
+
+def outputs(files, options):
+    '''
+    Convert a model to VRML, URDF and dot format by separate runs and by
+    single run with multiple outputs (a synthetic VRML chain of 300 joints
+    is used if no file is given)
+    '''
+    import tempfile
+    from simtrans import cli
+    if len(files) == 0:
+        files = ['/tmp/simtrans-benchmark-chain.wrl']
+        makevrml(files[0], 300)
+    def run(args):
+        sys.argv = ['simtrans', '-s'] + args
+        if cli.main() != 0:
+            raise Exception('conversion failed')
+    for f in files:
+        dirname = tempfile.mkdtemp()
+        tofiles = [os.path.join(dirname, 'model' + ext) for ext in ['.wrl', '.urdf', '.dot']]
+        separate, r = timeit(lambda: [run(['-i', f, '-o', t]) for t in tofiles])
+        multiple, r = timeit(run, ['-i', f] + sum([['-o', t] for t in tofiles], []))
+        concurrent, r = timeit(run, ['-i', f, '--concurrent'] + sum([['-o', t] for t in tofiles], []))
+        print '%s: %i outputs' % (f, len(tofiles))
+        print 'separate:   %.3f sec' % separate
+        print 'multiple:   %.3f sec' % multiple
+        print 'concurrent: %.3f sec' % concurrent
+
+
+STARTUP = '''
+import sys
+import time
+start = time.time()
+from simtrans import cli
+sys.argv = ['simtrans'] + sys.argv[1:]
+if len(sys.argv) > 1:
+    try:
+        cli.main()
+    except SystemExit:
+        pass
+print '%f %s' % (time.time() - start, ' '.join(sorted(k for k, v in sys.modules.items() if v is not None)))
+'''
+
+# libraries used only by some of the formats
+HEAVY = ['numpy', 'lxml', 'collada', 'yaml', 'jinja2', 'CORBA', 'OpenHRP', 'simtranssdfhelper', 'PIL', 'stl']
+
+
+def startup(files, options):
+    '''
+    Time start up of the command line interface in new processes (import,
+    --help and conversion of each file to dot format) and check that the
+    modules of unused formats are not imported (a synthetic VRML chain of
+    10 joints is used if no file is given)
+    '''
+    import tempfile
+    import subprocess
+    from simtrans import formats
+    if len(files) == 0:
+        files = ['/tmp/simtrans-benchmark-startup.wrl']
+        makevrml(files[0], 10, points=100)
+    dirname = tempfile.mkdtemp()
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(formats.__file__))), env.get('PYTHONPATH', '')])
+    cases = [('import', [], []), ('--help', ['--help'], [])]
+    for f in files:
+        fmt = formats.find(fname=f)
+        cases.append((os.path.basename(f), ['-s', '-i', f, '-o', os.path.join(dirname, 'model.dot')], [fmt.module] + ['graphviz']))
+    for name, args, used in cases:
+        # simtrans modules of unused formats and the libraries of them
+        unused = ['simtrans.' + f.module for f in formats.formats if f.module not in used]
+        if len(used) == 0:
+            unused += HEAVY
+        elif used[0] == 'vrml':
+            unused += [m for m in HEAVY if m not in ['numpy', 'PIL']]
+        with open(os.devnull, 'w') as null:
+            t, out = timeit(lambda: [subprocess.check_output([sys.executable, '-c', STARTUP] + args, env=env, stderr=null) for i in range(options.repeat)])
+        modules = out[-1].splitlines()[-1].split()
+        imported = float(modules.pop(0))
+        loaded = [m for m in unused if any(k == m or k.startswith(m + '.') for k in modules)]
+        print '%s: %.3f sec/run (%.3f sec after interpreter start up, %i modules)' % (name, t / options.repeat, imported, len(modules))
+        if len(loaded) > 0:
+            raise Exception('%s imports modules of unused formats: %s' % (name, ', '.join(loaded)))
+
+
+def compactvrml(files, options):
+    '''
+    Write VRML files in default and compact mode and compare size of the
+    output and time to read it back (sample model and a synthetic chain of
+    30 mesh segments are used if no file is given)
+    '''
+    import glob
+    import tempfile
+    from simtrans import vrml
+    if len(files) == 0:
+        files = [os.path.join(os.path.dirname(__file__), 'simple_vehicle/valid.wrl'),
+                 '/tmp/simtrans-benchmark-mesh.wrl']
+        makevrml(files[1], 30)
+    class Options(object):
+        usecollision = False
+        useboth = False
+        jobs = 1
+        precision = 6
+        keepnormals = False
+    for f in files:
+        print '%s:' % f
+        for compact in [False, True]:
+            o = Options()
+            o.compact = compact
+            dirname = tempfile.mkdtemp()
+            fname = os.path.join(dirname, 'out.wrl')
+            vrml.VRMLWriter().write(vrml.VRMLReader().read(f), fname, o)
+            size = sum([os.path.getsize(w) for w in glob.glob(os.path.join(dirname, '*.wrl'))])
+            t, m = timeit(lambda: [vrml.VRMLReader().read(fname) for i in range(options.repeat)])
+            print '  %-8s %9i bytes, read: %.3f sec/read' % ('compact' if compact else 'default', size, t / options.repeat)
+
+
+def readmesh(files, options):
+    '''
+    Convert synthetic mesh of 500k triangles given as python sequences
+    (as returned by the CORBA model loader) with VRMLReader.readMesh
+    '''
+    import numpy
+    from simtrans import vrml, vrmlparser
+    n = 500000
+    shape = vrmlparser.ShapeInfo()
+    shape.vertices = numpy.random.rand(n * 3).tolist()
+    shape.triangles = numpy.random.randint(0, n, n * 3).tolist()
+    shape.appearanceIndex = 0
+    app = vrmlparser.AppearanceInfo()
+    app.normals = numpy.random.rand(n * 3).tolist()
+    app.normalIndices = range(n)
+    app.normalPerVertex = False
+    r = vrml.VRMLReader()
+    r._hrpapperances = [app]
+    r._textures = {}
+    t, m = timeit(lambda: [r.readMesh(shape) for i in range(options.repeat)])
+    print 'readMesh: %.3f sec/mesh (%i triangles)' % (t / options.repeat, n)
+
+
+def colladawriter(files, options):
+    '''
+    Write synthetic mesh of 200k triangles in collada format
+    '''
+    import numpy
+    import tempfile
+    from simtrans import model, collada
+    n = 200000
+    m = model.MeshData()
+    m.vertex = numpy.random.rand(n, 3)
+    m.vertex_index = numpy.random.randint(0, n, (n, 3))
+    m.normal = numpy.random.rand(n, 3)
+    m.normal_index = numpy.random.randint(0, n, (n, 3))
+    s = model.ShapeModel()
+    s.shapeType = model.ShapeModel.SP_MESH
+    s.data = m
+    fname = os.path.join(tempfile.mkdtemp(), 'mesh.dae')
+    t, r = timeit(lambda: [collada.ColladaWriter().write(s, fname) for i in range(options.repeat)])
+    print 'write: %.3f sec/mesh (%i triangles, %i bytes)' % (t / options.repeat, n, os.path.getsize(fname))
+
+
+def plymesh(files, options):
+    '''
+    Read synthetic mesh of 200k triangles in collada and ply format
+    '''
+    import numpy
+    import tempfile
+    from simtrans import model, collada, ply
+    n = 200000
+    m = model.MeshData()
+    m.vertex = numpy.random.rand(n, 3)
+    m.vertex_index = numpy.random.randint(0, n, (n, 3))
+    m.normal = m.vertex
+    m.normal_index = m.vertex_index
+    s = model.ShapeModel()
+    s.shapeType = model.ShapeModel.SP_MESH
+    s.data = m
+    dirname = tempfile.mkdtemp()
+    for ext, writer, reader in [('.dae', collada.ColladaWriter(), collada.ColladaReader()),
+                                ('.ply', ply.PLYWriter(), ply.PLYReader())]:
+        fname = os.path.join(dirname, 'mesh' + ext)
+        w, r = timeit(writer.write, s, fname)
+        t, r = timeit(lambda: [reader.read(fname) for i in range(options.repeat)])
+        print '%s: write %.3f sec, read %.3f sec/mesh (%i triangles, %i bytes)' % (ext, w, t / options.repeat, n, os.path.getsize(fname))
+
+
+def gltfwriter(files, options):
+    '''
+    Write synthetic mesh of 200k triangles in collada and glb format
+    '''
+    import numpy
+    import tempfile
+    from simtrans import model, collada, gltf
+    n = 200000
+    m = model.MeshData()
+    m.vertex = numpy.random.rand(n, 3)
+    m.vertex_index = numpy.random.randint(0, n, (n, 3))
+    m.normal = numpy.random.rand(n, 3)
+    m.normal_index = numpy.random.randint(0, n, (n, 3))
+    m.material = model.MaterialModel()
+    s = model.ShapeModel()
+    s.shapeType = model.ShapeModel.SP_MESH
+    s.data = m
+    dirname = tempfile.mkdtemp()
+    for ext, writer in [('.dae', collada.ColladaWriter()), ('.glb', gltf.GLTFWriter())]:
+        fname = os.path.join(dirname, 'mesh' + ext)
+        t, r = timeit(lambda: [writer.write(s, fname) for i in range(options.repeat)])
+        print '%s: %.3f sec/mesh (%i triangles, %i bytes)' % (ext, t / options.repeat, n, os.path.getsize(fname))
+
+
+def normals(files, options):
+    '''
+    Generate normals of synthetic mesh of 500k triangles
+    (first call, cached call and pycollada for comparison)
+    '''
+    import numpy
+    import collada
+    from simtrans import model
+    n = 500000
+    m = model.MeshData()
+    m.vertex = numpy.random.rand(n, 3)
+    m.vertex_index = numpy.random.randint(0, n, (n, 3))
+    first, r = timeit(m.generatenormals, 0.5)
+    cached, r = timeit(lambda: [m.generatenormals(0.5) for i in range(options.repeat)])
+    class TriangleSet(collada.triangleset.TriangleSet):
+        def __init__(self):
+            pass
+    t = TriangleSet()
+    t._vertex = m.vertex
+    t._vertex_index = m.vertex_index
+    ref, r = timeit(t.generateNormals)
+    print 'generatenormals: %.3f sec (cached: %.6f sec)' % (first, cached / options.repeat)
+    print 'pycollada:       %.3f sec' % ref
+
+
+def export(files, options):
+    '''
+    Write URDF of synthetic model with 20 links of different meshes
+    (20k triangles each) serially and with worker processes
+    '''
+    import numpy
+    import tempfile
+    from simtrans import model, urdf
+    def makemodel():
+        numpy.random.seed(0)
+        m = model.BodyModel()
+        m.name = 'export'
+        for i in range(20):
+            l = model.LinkModel()
+            l.name = 'link%i' % i
+            s = model.ShapeModel()
+            s.name = 'shape%i' % i
+            s.shapeType = model.ShapeModel.SP_MESH
+            s.data = model.MeshData()
+            s.data.vertex = numpy.random.rand(20000, 3)
+            s.data.vertex_index = numpy.random.randint(0, 20000, (20000, 3))
+            l.visuals = [s]
+            m.links.append(l)
+        return m
+    class Options(object):
+        prefix = ''
+    o = Options()
+    o.jobs = 1
+    serial, r = timeit(urdf.URDFWriter().write, makemodel(), os.path.join(tempfile.mkdtemp(), 'export.urdf'), o)
+    o.jobs = options.jobs
+    pooled, r = timeit(urdf.URDFWriter().write, makemodel(), os.path.join(tempfile.mkdtemp(), 'export.urdf'), o)
+    print 'serial: %.3f sec' % serial
+    print 'pool:   %.3f sec (%i processes, %.2fx)' % (pooled, options.jobs, serial / pooled)
+
+
+def deepchain(files, options):
+    '''
+    Write and read back synthetic chain of 3000 links in VRML and URDF
+    (deeper than the recursion limit of python)
+    '''
+    import tempfile
+    from simtrans import urdf, vrml
+    class Options(object):
+        prefix = ''
+        usecollision = False
+        useboth = False
+        jobs = 1
+    dirname = tempfile.mkdtemp()
+    fname = os.path.join(dirname, 'chain.urdf')
+    makechain(fname, 3000)
+    t1, r = timeit(urdf.URDFWriter().write, urdf.URDFReader().read2(fname), os.path.join(dirname, 'out.urdf'), Options())
+    t2, r = timeit(vrml.VRMLWriter().write, urdf.URDFReader().read2(fname), os.path.join(dirname, 'out.wrl'), Options())
+    t3, m = timeit(vrml.VRMLReader().read, os.path.join(dirname, 'out.wrl'))
+    print 'urdf write: %.3f sec' % t1
+    print 'vrml write: %.3f sec' % t2
+    print 'vrml read:  %.3f sec (%i links)' % (t3, len(m.links))
+
+
+def makeworld(n):
+    '''
+    Make synthetic world model with n independent objects of 3 links
+    '''
+    import numpy
+    from simtrans import model
+    m = model.BodyModel()
+    m.name = 'world'
+    for i in range(n):
+        for k in range(3):
+            l = model.LinkModel()
+            l.name = 'obj%i_link%i' % (i, k)
+            l.mass = 1.0
+            l.matrix = numpy.identity(4)
+            l.matrix[0:3, 3] = [i, 0, k * 0.1]
+            l.trans = None
+            l.rot = None
+            s = model.ShapeModel()
+            s.name = 'obj%i_box%i' % (i, k)
+            s.shapeType = model.ShapeModel.SP_BOX
+            s.data = model.BoxData()
+            s.data.x = s.data.y = s.data.z = 0.1
+            l.visuals = [s]
+            m.links.append(l)
+            if k > 0:
+                j = model.JointModel()
+                j.name = 'obj%i_joint%i' % (i, k)
+                j.jointType = model.JointModel.J_REVOLUTE
+                j.parent = 'obj%i_link%i' % (i, k - 1)
+                j.child = l.name
+                j.axis = model.AxisData()
+                j.axis.axis = [0, 1, 0]
+                j.axis.limit = [-1, 1]
+                j.matrix = l.matrix.copy()
+                j.trans = None
+                j.rot = None
+                m.joints.append(j)
+    return m
+
+
+def roots(files, options):
+    '''
+    Write VRML and URDF of synthetic world with 400 independent objects
+    serially and with worker processes
+    '''
+    import tempfile
+    from simtrans import vrml, urdf
+    class Options(object):
+        prefix = ''
+        usecollision = False
+        useboth = False
+    o = Options()
+    for writer, ext in [(vrml.VRMLWriter, '.wrl'), (urdf.URDFWriter, '.urdf')]:
+        o.jobs = 1
+        serial, r = timeit(writer().write, makeworld(400), os.path.join(tempfile.mkdtemp(), 'world' + ext), o)
+        o.jobs = options.jobs
+        pooled, r = timeit(writer().write, makeworld(400), os.path.join(tempfile.mkdtemp(), 'world' + ext), o)
+        print '%s serial: %.3f sec' % (ext, serial)
+        print '%s pool:   %.3f sec (%i processes, %.2fx)' % (ext, pooled, options.jobs, serial / pooled)
+
+
+def assets(files, options):
+    '''
+    Convert textures to jpeg serially and with the asset pipeline
+    (300 synthetic textures referred twice each are used if no file is given)
+    '''
+    import tempfile
+    from simtrans import cli, asset
+    if len(files) == 0:
+        from PIL import Image
+        d = tempfile.mkdtemp()
+        for i in range(300):
+            files.append(os.path.join(d, 'texture%i.png' % i))
+            Image.new('RGB', (512, 512), (i % 256, 0, 0)).save(files[-1])
+    files = files * 2
+    cli.basedir = tempfile.mkdtemp()
+    asset._imagecache.clear()
+    serial, r = timeit(lambda: [cli.jpegconverthandler(f) for f in files])
+    cli.basedir = tempfile.mkdtemp()
+    asset._imagecache.clear()
+    pipeline = asset.AssetPipeline(cli.jpegconverthandler, options.jobs)
+    def run():
+        futures = [pipeline(f) for f in files]
+        pipeline.close()
+        return [str(f) for f in futures]
+    pooled, r2 = timeit(run)
+    print 'converted %i references' % len(files)
+    print 'serial:   %.3f sec' % serial
+    print 'pipeline: %.3f sec (%i threads, %.2fx)' % (pooled, options.jobs, serial / pooled)
+
+
+def meshstore(files, options):
+    '''
+    Write URDF files into the same directory (identical meshes are written once)
+    (a synthetic chain of 100 joints sharing the same mesh is used if no file is given)
+    '''
+    import tempfile
+    from simtrans import vrml, urdf
+    if len(files) == 0:
+        files = ['/tmp/simtrans-benchmark-mesh.wrl']
+        makevrml(files[0], 100)
+    models = [vrml.VRMLReader().read(f) for f in files]
+    d = tempfile.mkdtemp()
+    def run():
+        for i in range(options.repeat):
+            for j, m in enumerate(models):
+                urdf.URDFWriter().write(m, os.path.join(d, 'model%i-%i.urdf' % (j, i)))
+    t, r = timeit(run)
+    size = sum(os.path.getsize(os.path.join(d, f)) for f in os.listdir(d))
+    print 'wrote %i models (%i files, %i bytes)' % (len(models) * options.repeat, len(os.listdir(d)), size)
+    print 'write: %.3f sec/model' % (t / options.repeat / len(models))
+
+
+benchmarks = {
+    'assets': assets,
+    'cnoidbody': cnoidbody,
+    'colladawriter': colladawriter,
+    'compactvrml': compactvrml,
+    'deepchain': deepchain,
+    'export': export,
+    'gltf': gltfwriter,
+    'meshstore': meshstore,
+    'sdfhelper': sdfhelper,
+    'snapshot': snapshot,
+    'startup': startup,
+    'normals': normals,
+    'outputs': outputs,
+    'ply': plymesh,
+    'readmesh': readmesh,
+    'roots': roots,
+    'urdf': urdf,
+    'vrml': vrml,
+}
+
+parser = ArgumentParser(description='Run simtrans benchmarks.')
+parser.add_argument('benchmark', metavar='NAME', choices=sorted(benchmarks.keys()), help='name of the benchmark')
+parser.add_argument('files', metavar='FILE', nargs='*', help='input files')
+parser.add_argument('-j', '--jobs', dest='jobs', metavar='N', type=int, default=multiprocessing.cpu_count(), help='number of parallel jobs')
+parser.add_argument('-r', '--repeat', dest='repeat', metavar='N', type=int, default=10, help='repeat count of the input files')
+
+
+def main():
+    try:
+        options = parser.parse_args()
+    except ArgumentError, e:
+        print >> sys.stderr, 'OptionError: ', e
+        print >> sys.stderr, parser.print_help()
+        return 1
+    benchmarks[options.benchmark](options.files, options)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
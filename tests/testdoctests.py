@@ -5,7 +5,13 @@ import simtrans.collada
 import simtrans.urdf
 import simtrans.sdf
 import simtrans.vrml
+import simtrans.vrmlparser
 import simtrans.graphviz
+import simtrans.asset
+import simtrans.ply
+import simtrans.gltf
+import simtrans.snapshot
+import simtrans.formats
 
 
 def load_tests(loader, tests, ignore):
@@ -14,5 +20,11 @@ def load_tests(loader, tests, ignore):
     tests.addTests(doctest.DocTestSuite(simtrans.urdf))
     tests.addTests(doctest.DocTestSuite(simtrans.sdf))
     tests.addTests(doctest.DocTestSuite(simtrans.vrml))
+    tests.addTests(doctest.DocTestSuite(simtrans.vrmlparser))
     tests.addTests(doctest.DocTestSuite(simtrans.graphviz))
+    tests.addTests(doctest.DocTestSuite(simtrans.asset))
+    tests.addTests(doctest.DocTestSuite(simtrans.ply))
+    tests.addTests(doctest.DocTestSuite(simtrans.gltf))
+    tests.addTests(doctest.DocTestSuite(simtrans.snapshot))
+    tests.addTests(doctest.DocTestSuite(simtrans.formats))
     return tests